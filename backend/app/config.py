@@ -3,6 +3,7 @@ Application configuration using Pydantic Settings.
 """
 from pydantic_settings import BaseSettings
 from functools import lru_cache
+from typing import Dict
 
 
 class Settings(BaseSettings):
@@ -22,6 +23,47 @@ class Settings(BaseSettings):
     # Dify API (for future AI integration)
     dify_api_key: str = ""
     dify_api_url: str = ""
+    dify_max_concurrency: int = 8  # In-flight Dify requests per API process
+    dify_max_connections: int = 16  # Pooled keep-alive connections
+    dify_timeout: float = 60.0  # Seconds per request attempt
+    dify_connect_timeout: float = 5.0
+    dify_max_retries: int = 3  # Retries of 429 / 5xx / connection errors
+    dify_retry_backoff: float = 0.5  # Base seconds of the jittered exponential backoff
+    dify_retry_backoff_max: float = 8.0
+    dify_streaming: bool = True  # Streaming-mode completions relayed over GET /reports/{id}/stream
+    report_flush_interval: float = 1.0  # Seconds between content writes of a streaming report
+    dify_app_version: str = "v1"  # Bump when the Dify app's prompt changes; part of the report cache key
+    report_cache_enabled: bool = True
+    report_cache_ttl: int = 7 * 24 * 3600  # Seconds a cached answer is served
+    report_cache_max_bytes: int = 50 * 1024 * 1024  # Least recently used answers evicted beyond this
+    report_batch_max_size: int = 1000  # Reports per batch
+    report_batch_concurrency: int = 4  # Reports of a batch generated at a time
+    report_batch_rate: float = 2.0  # Report generations started per second and batch, 0 = unlimited
+    
+    # Analysis task execution (worker processes)
+    analysis_runner_enabled: bool = True  # Disable on all but one API process
+    analysis_max_workers: int = 2
+    analysis_type_limits: Dict[str, int] = {"clustering": 2, "k_sweep": 1, "segmented_clustering": 1, "stability": 1}
+    analysis_task_timeout: int = 3600  # Seconds, overridable per task (timeout_seconds)
+    analysis_poll_interval: float = 1.0
+    analysis_sweep_workers: int = 0  # Process pool size of a K sweep / segmented clustering, 0 = the task's cores
+    
+    # CPU governance of analysis workers (see services/cpu_governor.py)
+    analysis_cpu_budget: int = 0  # Cores shared by running tasks, 0 = all but analysis_reserved_cores
+    analysis_reserved_cores: int = 1  # Cores kept free for serving API requests
+    analysis_task_threads: int = 0  # Cores granted per task, 0 = budget / analysis_max_workers
+    analysis_worker_nice: int = 10  # Added to the scheduling niceness of worker processes (POSIX)
+    analysis_pin_workers: bool = False  # Pin workers to the cores not reserved for the API (Linux)
+    
+    # Clustering feature cache (memory-mapped .npy files)
+    feature_cache_dir: str = "./feature_cache"
+    feature_cache_max_entries: int = 8
+    
+    # Payment-mix features (TF-IDF + TruncatedSVD of payment_records, see services/payment_mix.py)
+    payment_mix_components: int = 8
+    payment_mix_hash_columns: int = 4096  # Hashed manufacturer / payment type / product terms
+    payment_mix_chunk_rows: int = 200000  # Payments read per streaming chunk
+    payment_mix_memory_mb: int = 1024  # Budget of the sparse doctor x term matrix
     
     # Data paths
     raw_data_path: str = r"E:\毕设\OP_DTL_GNRL_PGYR2024_P06302025_06162025.csv"
@@ -1,7 +1,7 @@
 """
 Database configuration and session management.
 """
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, declarative_base
 
 # SQLite database path
@@ -10,9 +10,25 @@ DATABASE_URL = "sqlite:///./pharma.db"
 # Create engine with SQLite-specific settings
 engine = create_engine(
     DATABASE_URL,
-    connect_args={"check_same_thread": False}  # Required for SQLite with FastAPI
+    connect_args={
+        "check_same_thread": False,  # Required for SQLite with FastAPI
+        "timeout": 30  # Wait for locks held by analysis worker processes
+    }
 )
 
+
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    WAL lets API reads proceed while a worker process is writing.
+    Temp tables (bulk write staging) are kept in memory.
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+
 # Session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
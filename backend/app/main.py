@@ -57,9 +57,33 @@ async def health_check():
     }
 
 
-from .routers import analysis_tasks, auth, doctors, reports
+from .routers import analysis_results, analysis_tasks, auth, doctors, manufacturers, reports
+from .services.task_runner import task_runner
+from .services.dify_client import dify_client
 
 app.include_router(auth.router, prefix="/api/v1/auth", tags=["auth"])
 app.include_router(doctors.router, prefix="/api/v1/doctors", tags=["doctors"])
+app.include_router(manufacturers.router, prefix="/api/v1/manufacturers", tags=["manufacturers"])
 app.include_router(reports.router, prefix="/api/v1/reports", tags=["reports"])
 app.include_router(analysis_tasks.router, prefix="/api/v1/analysis/tasks", tags=["analysis-tasks"])
+app.include_router(analysis_results.router, prefix="/api/v1/analysis/results", tags=["analysis-results"])
+
+
+@app.on_event("startup")
+async def start_task_runner():
+    """Start dispatching queued analysis tasks to worker processes."""
+    if settings.analysis_runner_enabled:
+        task_runner.start()
+
+
+@app.on_event("shutdown")
+async def stop_task_runner():
+    """Terminate workers; their tasks are re-queued for the next start."""
+    if settings.analysis_runner_enabled:
+        task_runner.stop()
+
+
+@app.on_event("shutdown")
+async def close_dify_client():
+    """Close pooled Dify connections."""
+    await dify_client.aclose()
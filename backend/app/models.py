@@ -5,13 +5,19 @@ Tables:
 - User: System users with authentication
 - Doctor: Aggregated doctor profiles with RFM values
 - PaymentRecord: Cleaned payment records from CMS Open Payments
+- DoctorMonthlyRollup / ManufacturerMonthlyRollup: Monthly payment rollups built by the ETL
 - ClusterResult: K-Means clustering results for AI strategy generation
+- ClusterAssignment: Per-result cluster membership of each doctor
+- ClusterVizLevel: Per-result binned density grids and samples for the charts
+- KSweepResult: Quality metrics across K values (elbow / silhouette analysis)
+- ReportBatch: Batch report generation requests (reports link back via batch_id)
+- ReportCache: Dify answers keyed by a hash of report type, context and app version
 """
 from datetime import date, datetime
 from typing import Optional
-from sqlalchemy import Column, Integer, String, Float, Date, DateTime, Text, ForeignKey, JSON, Boolean
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, Text, ForeignKey, JSON, Boolean, Index, LargeBinary
 from sqlalchemy.orm import relationship
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, text
 
 from .database import Base
 
@@ -70,7 +76,7 @@ class Doctor(Base):
     avg_payment_amount = Column(Float, default=0.0, comment="平均单笔支付金额")
     last_payment_date = Column(Date, nullable=True, comment="最近支付日期")
     
-    # Clustering result
+    # Clustering result (legacy: labels are now stored per result in cluster_assignments)
     cluster_id = Column(Integer, ForeignKey("cluster_results.cluster_id"), nullable=True)
     cluster_label = Column(String(50), nullable=True, comment="聚类标签 (如: 核心客户)")
     
@@ -88,6 +94,10 @@ class PaymentRecord(Base):
     Each record represents a single payment/transfer of value.
     """
     __tablename__ = "payment_records"
+    __table_args__ = (
+        # Serves "latest payments of one doctor" without a sort step
+        Index("idx_payment_records_npi_date", "npi", text("payment_date DESC")),
+    )
     
     # Primary key (auto-increment)
     id = Column(Integer, primary_key=True, autoincrement=True)
@@ -111,6 +121,51 @@ class PaymentRecord(Base):
         return f"<PaymentRecord(id={self.id}, npi={self.npi}, amount={self.amount})>"
 
 
+class DoctorMonthlyRollup(Base):
+    """
+    Monthly per-doctor payment rollup, built by the ETL.
+    Time-windowed doctor analytics read these rows instead of payment_records.
+    """
+    __tablename__ = "doctor_monthly_rollups"
+    __table_args__ = (
+        Index("idx_doctor_monthly_rollups_month", "month"),
+    )
+    
+    npi = Column(String(10), ForeignKey("doctors.npi"), primary_key=True)
+    month = Column(Date, primary_key=True, comment="月份 (当月1日)")
+    
+    payment_count = Column(Integer, nullable=False, default=0, comment="当月支付笔数")
+    total_amount = Column(Float, nullable=False, default=0.0, comment="当月支付总金额")
+    max_amount = Column(Float, nullable=True, comment="当月最大单笔金额")
+    manufacturer_count = Column(Integer, nullable=True, comment="当月不同药企数")
+    last_payment_date = Column(Date, nullable=True, comment="当月最近支付日期")
+    
+    def __repr__(self):
+        return f"<DoctorMonthlyRollup(npi={self.npi}, month={self.month}, count={self.payment_count})>"
+
+
+class ManufacturerMonthlyRollup(Base):
+    """
+    Monthly per-manufacturer payment rollup, built by the ETL.
+    Backs manufacturer trend queries without scanning payment_records.
+    """
+    __tablename__ = "manufacturer_monthly_rollups"
+    __table_args__ = (
+        Index("idx_manufacturer_monthly_rollups_month", "month"),
+    )
+    
+    manufacturer_name = Column(String(200), primary_key=True)
+    month = Column(Date, primary_key=True, comment="月份 (当月1日)")
+    
+    payment_count = Column(Integer, nullable=False, default=0, comment="当月支付笔数")
+    total_amount = Column(Float, nullable=False, default=0.0, comment="当月支付总金额")
+    max_amount = Column(Float, nullable=True, comment="当月最大单笔金额")
+    doctor_count = Column(Integer, nullable=True, comment="当月覆盖医生数")
+    
+    def __repr__(self):
+        return f"<ManufacturerMonthlyRollup(name={self.manufacturer_name}, month={self.month})>"
+
+
 class ClusterResult(Base):
     """
     Cluster result table - stores K-Means clustering analysis results.
@@ -127,8 +182,12 @@ class ClusterResult(Base):
     size_percentage = Column(Float, nullable=True, comment="占总医生百分比")
     
     # Analysis metadata
-    task_id = Column(Integer, ForeignKey("analysis_tasks.task_id"), nullable=True, comment="关联的分析任务ID")
+    task_id = Column(Integer, ForeignKey("analysis_tasks.task_id"), nullable=True, index=True, comment="关联的分析任务ID")
     algorithm = Column(String(50), default="k-means", comment="聚类算法")
+    
+    # Segmented clustering: the doctor partition this result covers (null for whole-population results)
+    segment_by = Column(String(50), nullable=True, comment="分区属性 (specialty / state), 全量结果为空")
+    segment_value = Column(String(200), nullable=True, comment="分区取值")
     features_used = Column(Text, nullable=True, comment="使用的特征列表 (JSON)")
     cluster_labels = Column(Text, nullable=True, comment="聚类标签映射 (JSON)")
     
@@ -149,6 +208,13 @@ class ClusterResult(Base):
     # Visualization and status
     visualization_data = Column(Text, nullable=True, comment="可视化数据 (JSON)")
     is_active = Column(Boolean, default=True, comment="是否激活")
+    is_current = Column(Boolean, default=False, comment="是否为当前生效结果 (医生分群据此解析)")
+    
+    # Fitted preprocessing + centroids for assigning new doctors (see services/cluster_model.py)
+    model_params = Column(JSON, nullable=True, comment="模型参数: 对数特征、标准化均值/尺度、质心 (JSON)")
+    
+    # Sampled silhouette with CI plus full-population centroid metrics (see services/cluster_metrics.py)
+    quality_metrics = Column(JSON, nullable=True, comment="聚类质量指标: 分层抽样轮廓系数(含置信区间)、简化轮廓系数、DB、CH 指数")
     
     # Relationships
     doctors = relationship("Doctor", back_populates="cluster")
@@ -159,6 +225,43 @@ class ClusterResult(Base):
         return f"<ClusterResult(id={self.cluster_id}, name={self.cluster_name})>"
 
 
+class ClusterAssignment(Base):
+    """
+    Cluster assignment table - cluster membership of each doctor per result.
+    Keeping every result's labels makes switching the current result a
+    metadata change instead of rewriting doctors.
+    """
+    __tablename__ = "cluster_assignments"
+    __table_args__ = (
+        # Secondary index entries carry the primary key, so this covers npi
+        Index("idx_cluster_assignments_result_cluster", "result_id", "cluster"),
+        {"sqlite_with_rowid": False},
+    )
+    
+    result_id = Column(Integer, ForeignKey("cluster_results.cluster_id", ondelete="CASCADE"), primary_key=True, comment="聚类结果ID")
+    npi = Column(String(10), primary_key=True, comment="National Provider Identifier")
+    cluster = Column(Integer, nullable=False, comment="簇编号")
+    
+    def __repr__(self):
+        return f"<ClusterAssignment(result={self.result_id}, npi={self.npi}, cluster={self.cluster})>"
+
+
+class ClusterVizLevel(Base):
+    """
+    Cluster visualization level table - one level of detail of a result:
+    per-cluster binned density grids plus a cluster-stratified sample,
+    stored as a compressed .npz payload (see services/viz_service.py).
+    """
+    __tablename__ = "cluster_viz_levels"
+    
+    result_id = Column(Integer, ForeignKey("cluster_results.cluster_id", ondelete="CASCADE"), primary_key=True, comment="聚类结果ID")
+    level = Column(Integer, primary_key=True, comment="细节层级 (0 最粗)")
+    payload = Column(LargeBinary, nullable=False, comment="密度网格与分层样本 (npz)")
+    
+    def __repr__(self):
+        return f"<ClusterVizLevel(result={self.result_id}, level={self.level})>"
+
+
 class AnalysisTask(Base):
     """
     Analysis task table - tracks K-Means clustering and RFM analysis jobs.
@@ -175,8 +278,10 @@ class AnalysisTask(Base):
     parameters = Column(Text, nullable=True, comment="任务参数 (JSON)")
     
     # Status tracking
-    status = Column(String(20), default="pending", comment="状态: pending/running/completed/failed")
+    status = Column(String(20), default="pending", comment="状态: pending/running/completed/failed/cancelled")
     progress = Column(Integer, default=0, comment="进度 (0-100)")
+    progress_detail = Column(JSON, nullable=True, comment="进度明细 (各阶段耗时等, JSON)")
+    fingerprint = Column(String(40), nullable=True, index=True, comment="请求指纹 (任务类型+规范化参数+数据版本), 用于去重")
     error_message = Column(Text, nullable=True, comment="错误信息")
     
     # User and timing
@@ -197,6 +302,38 @@ class AnalysisTask(Base):
         return f"<AnalysisTask(id={self.task_id}, name={self.task_name}, status={self.status})>"
 
 
+class KSweepResult(Base):
+    """
+    K sweep result table - clustering quality metrics for a range of K.
+    Cached per feature set and dataset version to back the elbow chart.
+    """
+    __tablename__ = "k_sweep_results"
+    
+    # Primary key
+    sweep_id = Column(Integer, primary_key=True, autoincrement=True)
+    
+    # Cache key: hash of features, transform, dataset version and sweep settings
+    cache_key = Column(String(40), nullable=False, index=True, comment="缓存键")
+    dataset_version = Column(String(40), nullable=False, comment="数据版本指纹")
+    task_id = Column(Integer, ForeignKey("analysis_tasks.task_id", ondelete="SET NULL"), nullable=True, comment="关联的分析任务ID")
+    
+    # Sweep settings
+    features_used = Column(Text, nullable=True, comment="使用的特征列表 (JSON)")
+    k_min = Column(Integer, nullable=False, comment="最小 K")
+    k_max = Column(Integer, nullable=False, comment="最大 K")
+    sample_size = Column(Integer, nullable=False, comment="拟合样本量")
+    
+    # Results: [{"k", "inertia", "silhouette", "calinski_harabasz", "davies_bouldin", "fit_seconds"}]
+    metrics = Column(JSON, nullable=False, comment="各 K 的质量指标 (JSON)")
+    recommended_k = Column(Integer, nullable=True, comment="推荐 K (轮廓系数最大)")
+    elbow_k = Column(Integer, nullable=True, comment="肘部法则 K")
+    
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    
+    def __repr__(self):
+        return f"<KSweepResult(id={self.sweep_id}, k={self.k_min}..{self.k_max})>"
+
+
 class AIReport(Base):
     """
     AI report table - stores Dify-generated market strategy reports.
@@ -221,6 +358,9 @@ class AIReport(Base):
     generated_by = Column(Integer, ForeignKey("users.id"), nullable=False)
     dify_conversation_id = Column(String(100), nullable=True, comment="Dify对话ID")
     generation_time = Column(Float, nullable=True, comment="生成耗时 (秒)")
+    timing = Column(JSON, nullable=True, comment="生成各阶段耗时 (秒, JSON)")
+    cached = Column(Boolean, default=False, comment="是否来自响应缓存")
+    batch_id = Column(Integer, ForeignKey("report_batches.batch_id"), nullable=True, index=True, comment="批量生成批次ID")
     
     # Publishing status
     status = Column(String(20), default="draft", comment="状态: draft/published/archived")
@@ -239,6 +379,56 @@ class AIReport(Base):
         return f"<AIReport(id={self.report_id}, title={self.report_title})>"
 
 
+class ReportBatch(Base):
+    """
+    Report batch table - one batch generation request (all clusters of a
+    task or the top-N doctors of a cluster). Progress is aggregated from the
+    batch's ai_reports rows.
+    """
+    __tablename__ = "report_batches"
+    
+    # Primary key
+    batch_id = Column(Integer, primary_key=True, autoincrement=True)
+    
+    target = Column(String(20), nullable=False, comment="批量目标: clusters / top_doctors")
+    report_type = Column(String(50), nullable=False, comment="报告类型")
+    parameters = Column(JSON, nullable=True, comment="批量参数 (JSON)")
+    total = Column(Integer, nullable=False, comment="报告数量")
+    
+    created_by = Column(Integer, ForeignKey("users.id"), nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    finished_at = Column(DateTime(timezone=True), nullable=True, comment="全部报告结束时间")
+    
+    def __repr__(self):
+        return f"<ReportBatch(id={self.batch_id}, target={self.target}, total={self.total})>"
+
+
+class ReportCache(Base):
+    """
+    Report response cache - Dify answers keyed by report type, canonical
+    context JSON and prompt/app version, so identical reports skip the LLM.
+    Entries expire after report_cache_ttl; least recently used entries are
+    evicted beyond report_cache_max_bytes.
+    """
+    __tablename__ = "report_cache"
+    
+    # sha1 of (report_type, canonical context JSON, app version)
+    cache_key = Column(String(40), primary_key=True, comment="缓存键")
+    report_type = Column(String(50), nullable=False, comment="报告类型")
+    app_version = Column(String(100), nullable=False, comment="提示词/应用版本")
+    
+    content = Column(Text, nullable=False, comment="报告内容 (Markdown)")
+    content_bytes = Column(Integer, nullable=False, comment="内容大小 (字节)")
+    hit_count = Column(Integer, default=0, comment="命中次数")
+    
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    last_used_at = Column(DateTime(timezone=True), nullable=False, comment="最近使用时间")
+    expires_at = Column(DateTime(timezone=True), nullable=False, comment="过期时间")
+    
+    def __repr__(self):
+        return f"<ReportCache(key={self.cache_key}, type={self.report_type})>"
+
+
 class SystemLog(Base):
     """
     System log table - audit trail for all API operations.
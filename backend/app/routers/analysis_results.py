@@ -0,0 +1,230 @@
+"""
+Analysis Results API Router.
+Handles clustering result versions: listing, switching the current result, deletion,
+assigning doctors to a result's clusters, comparing two results and level-of-detail
+visualization data.
+"""
+from fastapi import APIRouter, Depends, HTTPException, Query
+import json
+import time
+import numpy as np
+from sqlalchemy.orm import Session
+from sqlalchemy import desc
+from typing import List, Optional
+
+from ..database import get_db
+from ..models import ClusterResult, User
+from ..schemas import (
+    ClusterResultResponse, ClusterPredictRequest, ClusterPredictResponse, ClusterVizResponse,
+    ClusterComparisonResponse
+)
+from ..core.security import get_current_active_user
+from ..services.cluster_result_service import cluster_result_service
+from ..services import cluster_comparison, cluster_model, viz_service
+from ..services.analysis_service import LOG_FEATURES
+from ..services.clustering_algorithms import ALGORITHMS
+
+# Mounted at /api/v1/analysis/results by main.py
+router = APIRouter()
+
+
+@router.get("", response_model=List[ClusterResultResponse])
+async def get_results(
+    task_id: Optional[int] = Query(None, description="Results of one task, including segmented clustering children"),
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """
+    List clustering results, newest first. Per-segment results of segmented
+    clustering tasks are only listed for their task_id.
+    """
+    query = db.query(ClusterResult).filter(ClusterResult.is_active == True)
+    if task_id is not None:
+        query = query.filter(ClusterResult.task_id == task_id)
+    else:
+        query = query.filter(ClusterResult.segment_by.is_(None))
+    return query.order_by(desc(ClusterResult.cluster_id)).all()
+
+
+@router.get("/current", response_model=Optional[ClusterResultResponse])
+async def get_current_result(
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Get the result doctor clusters currently resolve through (null if none).
+    """
+    return cluster_result_service.current_result(db)
+
+
+@router.post("/{result_id}/activate", response_model=ClusterResultResponse)
+async def activate_result(
+    result_id: int,
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Make a result current. Only result metadata changes; assignments stay in place.
+    """
+    try:
+        result = cluster_result_service.activate(db, result_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    db.commit()
+    return result
+
+
+@router.delete("/{result_id}")
+async def delete_result(
+    result_id: int,
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Delete a result's assignments and hide it. Deleting the current result
+    leaves no result current.
+    """
+    result = db.query(ClusterResult)\
+        .filter(ClusterResult.cluster_id == result_id, ClusterResult.is_active == True)\
+        .first()
+    if not result:
+        raise HTTPException(status_code=404, detail="Cluster result not found")
+    cluster_result_service.delete_result(db, result_id)
+    db.commit()
+    return {"message": "Cluster result deleted successfully"}
+
+
+@router.post("/{result_id}/predict", response_model=ClusterPredictResponse)
+async def predict_clusters(
+    result_id: int,
+    request: ClusterPredictRequest,
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Assign doctors to the clusters of a result without refitting.
+    
+    - **npis**: stored doctors, using their current feature values
+    - **records**: raw feature values (every feature of the result is required)
+    
+    Only results of nearest-centroid algorithms (k-means, minibatch-kmeans) have a model.
+    
+    Nothing is written; the ETL updates stored assignments of changed doctors.
+    """
+    result = db.query(ClusterResult.cluster_id, ClusterResult.algorithm)\
+        .filter(ClusterResult.cluster_id == result_id, ClusterResult.is_active == True)\
+        .first()
+    if result is None:
+        raise HTTPException(status_code=404, detail="Cluster result not found")
+    model = cluster_model.get_model(db, result_id)
+    if model is None:
+        algorithm = result.algorithm or "k-means"
+        if algorithm in ALGORITHMS and not ALGORITHMS[algorithm].centroid_model:
+            raise HTTPException(status_code=400, detail=f"Predict is not supported for {algorithm} results")
+        raise HTTPException(status_code=400, detail="Cluster result has no stored model; rerun the clustering")
+    if not request.npis and not request.records:
+        raise HTTPException(status_code=400, detail="Provide npis or records")
+    
+    npis, not_found, raw = [], [], []
+    if request.npis:
+        df = cluster_model.load_doctor_features(db, model, request.npis)
+        npis = df['npi'].tolist()
+        found = set(npis)
+        not_found = [npi for npi in request.npis if npi not in found]
+        raw.append(df[model.features].values)
+    if request.records:
+        try:
+            raw.append(np.array([[record[f] for f in model.features] for record in request.records], dtype=np.float64))
+        except KeyError as e:
+            raise HTTPException(status_code=400, detail=f"Record is missing feature {e.args[0]}")
+        npis += [None] * len(request.records)
+    
+    X = np.vstack(raw)
+    labels, distances = model.predict(X) if len(X) else (np.array([], dtype=int), np.array([]))
+    return {
+        "result_id": result_id,
+        "predictions": [
+            {"npi": npi, "cluster": int(label), "distance": float(dist)}
+            for npi, label, dist in zip(npis, labels, distances)
+        ],
+        "not_found": not_found
+    }
+
+
+@router.get("/{result_id}/viz", response_model=ClusterVizResponse)
+async def get_result_viz(
+    result_id: int,
+    level: int = Query(0, ge=0, lt=len(viz_service.GRID_BINS), description="Detail level, 0 = coarsest"),
+    x: Optional[str] = Query(None, description="Feature on the x axis (default: first feature)"),
+    y: Optional[str] = Query(None, description="Feature on the y axis (default: second feature)"),
+    z: Optional[str] = Query(None, description="Feature on the z axis: returns the 3D grid (three-feature results)"),
+    x_min: Optional[float] = None,
+    x_max: Optional[float] = None,
+    y_min: Optional[float] = None,
+    y_max: Optional[float] = None,
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Per-cluster density grid and cluster-stratified sample of a result at one
+    level of detail, as typed arrays.
+    
+    Bounds (x_min..y_max) are in display coordinates (see axes[].transform) and
+    crop the 2D grid and the sample, so zooming in can fetch a finer level
+    for the visible window only.
+    """
+    result = db.query(ClusterResult.features_used)\
+        .filter(ClusterResult.cluster_id == result_id, ClusterResult.is_active == True)\
+        .first()
+    if result is None:
+        raise HTTPException(status_code=404, detail="Cluster result not found")
+    features = json.loads(result.features_used) if result.features_used else []
+    if len(features) < 2:
+        raise HTTPException(status_code=400, detail="Visualization needs at least two features")
+    x = x or features[0]
+    y = y or features[1]
+    bounds = {'x_min': x_min, 'x_max': x_max, 'y_min': y_min, 'y_max': y_max}
+    try:
+        viz = viz_service.load_level(db, result_id, features, LOG_FEATURES, level, x, y, z, bounds)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if viz is None:
+        raise HTTPException(status_code=404, detail="Cluster result has no visualization data; rerun the clustering")
+    return viz
+
+
+@router.get("/{result_id}/compare/{other_id}", response_model=ClusterComparisonResponse)
+def compare_results(
+    result_id: int,
+    other_id: int,
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Compare the assignments of two results over the doctors both assign:
+    ARI, NMI, the contingency table and each cluster's best Jaccard match.
+    A sync handler, so reading both assignment sets runs in the threadpool.
+    """
+    start = time.perf_counter()
+    found = db.query(ClusterResult.cluster_id)\
+        .filter(ClusterResult.cluster_id.in_([result_id, other_id]), ClusterResult.is_active == True)\
+        .count()
+    if found < len({result_id, other_id}):
+        raise HTTPException(status_code=404, detail="Cluster result not found")
+    
+    npis, labels = cluster_result_service.load_assignments(db, result_id)
+    other_npis, other_labels = cluster_result_service.load_assignments(db, other_id)
+    common, index, other_index = np.intersect1d(npis, other_npis, assume_unique=True, return_indices=True)
+    if len(common) == 0:
+        raise HTTPException(status_code=400, detail="The results have no doctors in common")
+    
+    comparison = cluster_comparison.compare(labels[index], other_labels[other_index])
+    return {
+        'result_id': result_id,
+        'other_id': other_id,
+        'common_doctors': int(len(common)),
+        'only_in_result': int(len(npis) - len(common)),
+        'only_in_other': int(len(other_npis) - len(common)),
+        **comparison,
+        'seconds': round(time.perf_counter() - start, 3),
+    }
@@ -1,50 +1,87 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from sqlalchemy import desc
 from typing import Optional, List
+from datetime import datetime
+import asyncio
 import json
 
 from ..database import get_db
 from ..models import AnalysisTask, User, SystemLog
-from ..schemas import AnalysisTaskCreate, AnalysisTaskResponse
+from ..schemas import AnalysisTaskCreate, AnalysisTaskResponse, KSweepResponse, ClusteringAlgorithmInfo
 from ..core.security import get_current_active_user
-from ..services.analysis_service import analysis_service
+from ..services.task_runner import task_runner, TASK_HANDLERS
+from ..services.analysis_service import analysis_service, SWEEP_SAMPLE_SIZE, SEGMENT_COLUMNS
+from ..services.task_events import task_event_broker, TERMINAL_STATUSES
+from ..services.cluster_result_service import cluster_result_service
+from ..services.clustering_algorithms import ALGORITHMS
 
-router = APIRouter(
-    prefix="/analysis/tasks",
-    tags=["Analysis Tasks"]
-)
+# Comment line sent on idle SSE streams so proxies keep the connection open
+SSE_KEEPALIVE_SECONDS = 15
+
+# Mounted at /api/v1/analysis/tasks by main.py
+router = APIRouter()
 
 @router.post("", response_model=AnalysisTaskResponse)
 async def create_analysis_task(
     task_in: AnalysisTaskCreate,
-    background_tasks: BackgroundTasks,
     current_user: User = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
     """
     Create a new analysis task (e.g., Clustering).
-    The task will be executed in the background.
+    The task is queued and executed by the task runner in a worker process.
+    
+    Identical requests (same type, normalized parameters and data version)
+    are deduplicated unless force is set: an in-flight task is returned to
+    follow, and a completed one is returned with its result.
     """
-    # 1. Create Task Record
+    if task_in.task_type not in TASK_HANDLERS:
+        raise HTTPException(status_code=400, detail=f"Unsupported task type: {task_in.task_type}")
+    algorithm = (task_in.parameters or {}).get("algorithm", "k-means")
+    if task_in.task_type == "clustering" and algorithm not in ALGORITHMS:
+        raise HTTPException(status_code=400, detail=f"Unknown clustering algorithm: {algorithm}")
+    segment_by = (task_in.parameters or {}).get("segment_by", "specialty")
+    if task_in.task_type == "segmented_clustering" and segment_by not in SEGMENT_COLUMNS:
+        raise HTTPException(status_code=400, detail=f"Cannot segment by {segment_by}, choose one of {SEGMENT_COLUMNS}")
+    
+    try:
+        fingerprint = analysis_service.task_fingerprint(db, task_in.task_type, task_in.parameters or {})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not task_in.force:
+        existing = analysis_service.find_duplicate_task(db, fingerprint)
+        if existing:
+            if existing.task_type == "clustering" and existing.status == "completed" \
+                    and existing.result_id is not None and (task_in.parameters or {}).get("activate", True):
+                # A new run would have made its result current
+                cluster_result_service.activate(db, existing.result_id)
+            db.add(SystemLog(
+                user_id=current_user.id,
+                action="dedupe_task",
+                module="analysis",
+                request_data=json.dumps({**task_in.model_dump(), "task_id": existing.task_id})
+            ))
+            db.commit()
+            db.refresh(existing)
+            return AnalysisTaskResponse.model_validate(existing).model_copy(update={"deduplicated": True})
+    
+    # 1. Create Task Record (queued as pending)
     db_task = AnalysisTask(
         task_name=task_in.task_name,
         task_type=task_in.task_type,
         parameters=json.dumps(task_in.parameters) if task_in.parameters else None,
         status="pending",
+        fingerprint=fingerprint,
         created_by=current_user.id
     )
     db.add(db_task)
     db.commit()
     db.refresh(db_task)
     
-    # 2. Trigger Background Task
-    if task_in.task_type == "clustering":
-        background_tasks.add_task(
-            analysis_service.perform_clustering,
-            db, 
-            db_task.task_id
-        )
+    # 2. Notify the task runner
+    task_runner.wake()
     
     # 3. Log Action
     log = SystemLog(
@@ -87,6 +124,38 @@ async def get_tasks(
         "items": tasks
     }
 
+@router.get("/algorithms", response_model=List[ClusteringAlgorithmInfo])
+async def get_algorithms(
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    List the clustering algorithms accepted as the algorithm task parameter.
+    """
+    return [algorithm.describe() for algorithm in ALGORITHMS.values()]
+
+@router.get("/k-sweep", response_model=Optional[KSweepResponse])
+async def get_k_sweep(
+    features: List[str] = Query(["recency_days", "frequency", "monetary"]),
+    k_min: int = Query(2, ge=2),
+    max_k: int = Query(10, ge=2, le=20),
+    sample_size: int = Query(SWEEP_SAMPLE_SIZE, ge=1000),
+    window_start: Optional[str] = Query(None, description="RFM window start (ISO date)"),
+    window_end: Optional[str] = Query(None, description="RFM window end (ISO date)"),
+    reference_date: Optional[str] = Query(None, description="Recency reference date (ISO date)"),
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Get the cached optimal K sweep for the current data.
+    Returns null when there is none yet; create a k_sweep task to compute it.
+    """
+    params = {
+        "window_start": window_start,
+        "window_end": window_end,
+        "reference_date": reference_date
+    }
+    return analysis_service.find_k_sweep(db, features, k_min, max_k, sample_size, params)
+
 @router.get("/{task_id}", response_model=AnalysisTaskResponse)
 async def get_task(
     task_id: int,
@@ -99,8 +168,73 @@ async def get_task(
     task = db.query(AnalysisTask).filter(AnalysisTask.task_id == task_id).first()
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
+    
+    # Progress of running tasks is reported as events, not committed
+    latest = task_event_broker.latest(task_id) if task.status == "running" else None
+    if latest:
+        return AnalysisTaskResponse.model_validate(task).model_copy(update={"progress": latest["progress"]})
     return task
 
+def _sse(event: dict) -> str:
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+@router.get("/{task_id}/events")
+async def stream_task_events(
+    task_id: int,
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Stream task progress as Server-Sent Events (progress, fit, segment, stage, status).
+    
+    Starts with a status event (plus the latest progress of a running task)
+    and ends after a completed/failed/cancelled status event.
+    """
+    task = db.query(AnalysisTask).filter(AnalysisTask.task_id == task_id).first()
+    if not task:
+        raise HTTPException(status_code=404, detail="Task not found")
+    
+    # Subscribe before reading the status so no transition is missed
+    queue = task_event_broker.subscribe(task_id)
+    initial = [{
+        "task_id": task_id,
+        "type": "status",
+        "status": task.status,
+        "progress": task.progress,
+        "result_id": task.result_id,
+        "error_message": task.error_message
+    }]
+    latest = task_event_broker.latest(task_id)
+    if latest and task.status == "running":
+        initial.append(latest)
+    finished = task.status in TERMINAL_STATUSES
+    # Don't hold a pooled connection for the lifetime of the stream
+    db.close()
+    
+    async def events():
+        try:
+            for event in initial:
+                yield _sse(event)
+            if finished:
+                return
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield _sse(event)
+                if event["type"] == "status" and event.get("status") in TERMINAL_STATUSES:
+                    return
+        finally:
+            task_event_broker.unsubscribe(task_id, queue)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.delete("/{task_id}")
 async def delete_task(
     task_id: int,
@@ -108,11 +242,24 @@ async def delete_task(
     db: Session = Depends(get_db)
 ):
     """
-    Delete a task.
+    Cancel a pending or running task, or delete a finished one.
+    Running tasks have their worker process terminated.
     """
     task = db.query(AnalysisTask).filter(AnalysisTask.task_id == task_id).first()
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
+    
+    if task.status in ("pending", "running"):
+        # Conditional: the worker may have completed the task since it was read
+        cancelled = db.query(AnalysisTask)\
+            .filter(AnalysisTask.task_id == task_id, AnalysisTask.status.in_(["pending", "running"]))\
+            .update({"status": "cancelled", "completed_at": datetime.now()}, synchronize_session=False)
+        db.commit()
+        if not cancelled:
+            raise HTTPException(status_code=409, detail="Task finished before it could be cancelled")
+        task_event_broker.publish_status(task_id, "cancelled")
+        task_runner.wake()
+        return {"message": "Task cancelled"}
         
     db.delete(task)
     db.commit()
@@ -129,5 +276,8 @@ async def get_clustering_results(
     """
     Get existing clustering results.
     """
-    results = db.query(ClusterResult).filter(ClusterResult.is_active == True).order_by(desc(ClusterResult.cluster_id)).all()
+    results = db.query(ClusterResult)\
+        .filter(ClusterResult.is_active == True, ClusterResult.segment_by.is_(None))\
+        .order_by(desc(ClusterResult.cluster_id))\
+        .all()
     return results
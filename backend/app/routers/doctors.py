@@ -3,15 +3,18 @@ Doctors API Router.
 Handles doctor data queries, statistics, and details.
 """
 from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy import func, true, select, bindparam
 from typing import Optional, List
+from datetime import date
 from pydantic import BaseModel
 
 from ..database import get_db
 from ..models import Doctor, PaymentRecord
 from ..core.security import get_current_user
-from ..schemas import DoctorResponse, DoctorList, PaymentRecordResponse
+from ..schemas import DoctorResponse, DoctorList, PaymentRecordResponse, DoctorMonthlyHistory
+from ..services.rollup_service import rollup_service
+from ..services.cluster_result_service import cluster_result_service
 
 router = APIRouter()
 
@@ -32,6 +35,11 @@ class DoctorDetailResponse(BaseModel):
     recent_payments: List[PaymentRecordResponse]
 
 
+def _with_cluster(doctor: Doctor, cluster: Optional[int]) -> DoctorResponse:
+    """Doctor response with cluster_id resolved through cluster_assignments."""
+    return DoctorResponse.model_validate(doctor).model_copy(update={"cluster_id": cluster})
+
+
 # ============== Endpoints ==============
 
 @router.get("", response_model=DoctorList)
@@ -41,6 +49,7 @@ async def get_doctors(
     specialty: Optional[str] = Query(None, description="Filter by specialty"),
     state: Optional[str] = Query(None, description="Filter by state"),
     cluster_id: Optional[int] = Query(None, description="Filter by cluster ID"),
+    result_id: Optional[int] = Query(None, description="Resolve clusters through this result instead of the current one"),
     min_monetary: Optional[float] = Query(None, description="Minimum monetary value"),
     max_monetary: Optional[float] = Query(None, description="Maximum monetary value"),
     search: Optional[str] = Query(None, description="Search by name or NPI"),
@@ -57,7 +66,7 @@ async def get_doctors(
     if state:
         query = query.filter(Doctor.state == state)
     if cluster_id is not None:
-        query = query.filter(Doctor.cluster_id == cluster_id)
+        query = query.filter(Doctor.npi.in_(cluster_result_service.cluster_members(cluster_id, result_id)))
     if min_monetary is not None:
         query = query.filter(Doctor.monetary >= min_monetary)
     if max_monetary is not None:
@@ -79,9 +88,12 @@ async def get_doctors(
         .limit(page_size)\
         .all()
     
+    # Clusters of this page only, from the selected result's assignments
+    clusters = cluster_result_service.clusters_for(db, [d.npi for d in doctors], result_id)
+    
     return {
         "total": total,
-        "items": doctors
+        "items": [_with_cluster(d, clusters.get(d.npi)) for d in doctors]
     }
 
 
@@ -149,25 +161,52 @@ async def get_states(db: Session = Depends(get_db)):
     return {"states": [s[0] for s in states if s[0]]}
 
 
+# Doctor row (with their cluster in the current result) outer-joined to one
+# LIMIT/OFFSET page of their payments (newest first). The page subquery is
+# served by idx_payment_records_npi_date without a sort step, and the outer
+# join keeps doctors without payments resolvable.
+# Built once at import time, since constructing the aliased statement costs
+# more than executing it on SQLite.
+_payment_page = select(PaymentRecord)\
+    .where(PaymentRecord.npi == bindparam("npi"))\
+    .order_by(PaymentRecord.payment_date.desc())\
+    .limit(bindparam("limit"))\
+    .offset(bindparam("offset"))\
+    .subquery()
+_page_payment = aliased(PaymentRecord, _payment_page)
+_doctor_with_payments = select(Doctor, cluster_result_service.cluster_of(Doctor.npi), _page_payment)\
+    .outerjoin(_page_payment, true())\
+    .where(Doctor.npi == bindparam("npi"))\
+    .order_by(_page_payment.payment_date.desc())
+
+
+def _load_doctor_with_payments(db: Session, npi: str, limit: int, offset: int = 0):
+    """
+    Load a doctor, their current cluster and one page of their payments in a
+    single round trip. Returns (None, None, []) if the doctor does not exist.
+    """
+    rows = db.execute(
+        _doctor_with_payments,
+        {"npi": npi, "limit": limit, "offset": offset}
+    ).all()
+    
+    if not rows:
+        return None, None, []
+    return rows[0][0], rows[0][1], [p for _, _, p in rows if p is not None]
+
+
 @router.get("/{npi}", response_model=DoctorDetailResponse)
 async def get_doctor_detail(npi: str, db: Session = Depends(get_db)):
     """
     Get detailed information for a specific doctor.
     Includes RFM values and recent payment history.
     """
-    doctor = db.query(Doctor).filter(Doctor.npi == npi).first()
+    doctor, cluster, recent_payments = _load_doctor_with_payments(db, npi, limit=10)
     if not doctor:
         raise HTTPException(status_code=404, detail="Doctor not found")
     
-    # Get recent payments (last 10)
-    recent_payments = db.query(PaymentRecord)\
-        .filter(PaymentRecord.npi == npi)\
-        .order_by(PaymentRecord.payment_date.desc())\
-        .limit(10)\
-        .all()
-    
     return {
-        "doctor": doctor,
+        "doctor": _with_cluster(doctor, cluster),
         "recent_payments": recent_payments
     }
 
@@ -180,19 +219,42 @@ async def get_doctor_payments(
     db: Session = Depends(get_db)
 ):
     """Get paginated payment history for a doctor."""
-    doctor = db.query(Doctor).filter(Doctor.npi == npi).first()
+    doctor, _, payments = _load_doctor_with_payments(
+        db, npi, limit=page_size, offset=(page - 1) * page_size
+    )
     if not doctor:
         raise HTTPException(status_code=404, detail="Doctor not found")
     
-    query = db.query(PaymentRecord).filter(PaymentRecord.npi == npi)
-    total = query.count()
-    
-    payments = query.order_by(PaymentRecord.payment_date.desc())\
-        .offset((page - 1) * page_size)\
-        .limit(page_size)\
-        .all()
+    # F value is the doctor's payment count, so no COUNT(*) over payment_records
+    total = doctor.frequency
+    if total is None:
+        total = db.query(func.count(PaymentRecord.id))\
+            .filter(PaymentRecord.npi == npi)\
+            .scalar()
     
     return {
         "total": total,
         "items": payments
     }
+
+
+@router.get("/{npi}/monthly", response_model=DoctorMonthlyHistory)
+async def get_doctor_monthly(
+    npi: str,
+    start: Optional[date] = Query(None, description="Window start (month-aligned)"),
+    end: Optional[date] = Query(None, description="Window end (month-aligned, inclusive)"),
+    db: Session = Depends(get_db)
+):
+    """
+    Get monthly payment rollups for a doctor within a time window.
+    Reads doctor_monthly_rollups instead of the raw payment records.
+    """
+    rollups = rollup_service.doctor_monthly(db, npi, start, end)
+    if not rollups and not db.query(Doctor.npi).filter(Doctor.npi == npi).first():
+        raise HTTPException(status_code=404, detail="Doctor not found")
+    
+    return {
+        "npi": npi,
+        "summary": rollup_service.summarize_window(rollups),
+        "items": rollups
+    }
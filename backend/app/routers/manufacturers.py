@@ -0,0 +1,43 @@
+"""
+Manufacturers API Router.
+Handles time-windowed manufacturer analytics backed by the monthly rollups.
+"""
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.orm import Session
+from typing import Optional, List
+from datetime import date
+
+from ..database import get_db
+from ..schemas import ManufacturerSummary, ManufacturerTrend
+from ..services.rollup_service import rollup_service
+
+router = APIRouter()
+
+
+@router.get("", response_model=List[ManufacturerSummary])
+async def get_top_manufacturers(
+    start: Optional[date] = Query(None, description="Window start (month-aligned)"),
+    end: Optional[date] = Query(None, description="Window end (month-aligned, inclusive)"),
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_db)
+):
+    """
+    Get manufacturers ranked by total payment amount within a time window.
+    """
+    return rollup_service.top_manufacturers(db, start, end, limit)
+
+
+@router.get("/monthly", response_model=ManufacturerTrend)
+async def get_manufacturer_trend(
+    name: str = Query(..., description="Manufacturer name"),
+    start: Optional[date] = Query(None, description="Window start (month-aligned)"),
+    end: Optional[date] = Query(None, description="Window end (month-aligned, inclusive)"),
+    db: Session = Depends(get_db)
+):
+    """
+    Get the monthly payment trend of a manufacturer within a time window.
+    """
+    return {
+        "manufacturer_name": name,
+        "items": rollup_service.manufacturer_monthly(db, name, start, end)
+    }
@@ -2,26 +2,41 @@
 Reports API Router.
 Handles AI report generation, listing, and retrieval.
 """
+import asyncio
+import json
+import time
 from fastapi import APIRouter, Depends, HTTPException, Query, BackgroundTasks
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from sqlalchemy import desc
 from typing import Optional, List
 from datetime import datetime
 
 from ..database import get_db
-from ..models import User, AIReport, ClusterResult, Doctor
-from ..schemas import AIReportResponse, AIReportCreate, AIReportList
+from ..models import User, AIReport, ClusterResult, Doctor, ReportBatch
+from ..schemas import (
+    AIReportResponse, AIReportCreate, AIReportList, ReportBatchCreate, ReportBatchResponse, ReportTimingStats
+)
 from ..core.security import get_current_user
+from ..config import get_settings
+from ..database import SessionLocal
 from ..services.dify_service import dify_service
+from ..services.report_batch_service import report_batch_service
+from ..services.report_streams import report_streams
+from ..services.report_timing import report_timing
 
 router = APIRouter()
 
+SSE_KEEPALIVE_SECONDS = 15
+
 @router.get("", response_model=AIReportList)
 async def get_reports(
     page: int = Query(1, ge=1),
     page_size: int = Query(10, ge=1, le=100),
     report_type: Optional[str] = None,
     status: Optional[str] = None,
+    batch_id: Optional[int] = Query(None, description="Only reports of this batch"),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -34,6 +49,8 @@ async def get_reports(
         query = query.filter(AIReport.report_type == report_type)
     if status:
         query = query.filter(AIReport.status == status)
+    if batch_id is not None:
+        query = query.filter(AIReport.batch_id == batch_id)
         
     total = query.count()
     items = query.order_by(desc(AIReport.created_at))\
@@ -47,6 +64,38 @@ async def get_reports(
     }
 
 
+@router.get("/batches/{batch_id}", response_model=ReportBatchResponse)
+async def get_report_batch(
+    batch_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Aggregate progress of a report batch (reports per status, cached hits).
+    List its reports with GET /reports?batch_id=.
+    """
+    batch = db.query(ReportBatch).filter(ReportBatch.batch_id == batch_id).first()
+    if not batch:
+        raise HTTPException(status_code=404, detail="Report batch not found")
+    return report_batch_service.progress(db, batch)
+
+
+@router.get("/timing/stats", response_model=ReportTimingStats)
+async def get_report_timing_stats(
+    report_type: Optional[str] = None,
+    batch_id: Optional[int] = Query(None, description="Only reports of this batch"),
+    limit: int = Query(1000, ge=1, le=10000, description="Most recent reports to aggregate"),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Where report generation time goes: percentiles per stage (context,
+    queueing, Dify time to first byte and total, retries, database writes)
+    and the share of the total spent in Dify.
+    """
+    return await run_in_threadpool(report_timing.stats, db, report_type, batch_id, limit)
+
+
 @router.get("/{report_id}", response_model=AIReportResponse)
 async def get_report(
     report_id: int,
@@ -77,6 +126,7 @@ async def generate_report(
     """
     Generate a new AI report (async task).
     Returns report_id immediately, actual generation happens in background.
+    With use_cache an identical cached Dify answer is served instead.
     """
     # Create new report record
     new_report = AIReport(
@@ -93,17 +143,134 @@ async def generate_report(
     db.add(new_report)
     db.commit()
     db.refresh(new_report)
+    report_id = new_report.report_id
+    # Background tasks run before the get_db teardown: don't hold a pooled
+    # connection while the report is generated
+    db.close()
+    
+    # Open the live stream now so subscribers arriving before the task starts see it
+    report_streams.open(report_id)
     
-    # Trigger Background Task
-    background_tasks.add_task(dify_service.generate_report, db, new_report.report_id)
+    # Trigger Background Task (a coroutine: waits on Dify without holding a threadpool thread)
+    background_tasks.add_task(dify_service.generate_report, report_id, request.use_cache, queued_at=time.monotonic())
     
     return {
         "code": 201,
         "message": "Report generation started",
-        "report_id": new_report.report_id
+        "report_id": report_id
     }
 
 
+@router.post("/batch", response_model=ReportBatchResponse, status_code=201)
+async def generate_report_batch(
+    request: ReportBatchCreate,
+    background_tasks: BackgroundTasks,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Generate reports for all clusters of a task or the top-N doctors of a cluster.
+    
+    All reports are created at once (status generating) and generated in the
+    background under report_batch_concurrency / report_batch_rate. Returns the
+    batch with its aggregate progress; poll GET /reports/batches/{batch_id}.
+    """
+    try:
+        batch, report_ids = report_batch_service.create_batch(
+            db,
+            current_user.id,
+            request.target,
+            cluster_ids=request.cluster_ids,
+            task_id=request.task_id,
+            cluster=request.cluster,
+            result_id=request.result_id,
+            top_n=request.top_n
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    db.commit()
+    
+    for report_id in report_ids:
+        report_streams.open(report_id)
+    background_tasks.add_task(dify_service.generate_batch, batch.batch_id, request.use_cache, queued_at=time.monotonic())
+    
+    progress = report_batch_service.progress(db, batch)
+    # Release the connection before the batch runs (see generate_report)
+    db.close()
+    return progress
+
+
+def _sse(event: dict) -> str:
+    return f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+def _read_report(report_id: int):
+    db = SessionLocal()
+    try:
+        report = db.query(AIReport).filter(AIReport.report_id == report_id).first()
+        return (report.status, report.report_content) if report else (None, None)
+    finally:
+        db.close()
+
+@router.get("/{report_id}/stream")
+async def stream_report(
+    report_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Stream report content as Server-Sent Events while it is generated.
+    
+    Starts with a snapshot of the content so far, then delta (appended text)
+    and replace events, and ends with a done event. A report generated by
+    another API process is followed through its batched database writes
+    instead (snapshot events every report_flush_interval seconds).
+    """
+    report = db.query(AIReport).filter(AIReport.report_id == report_id).first()
+    if not report:
+        raise HTTPException(status_code=404, detail="Report not found")
+    status, content = report.status, report.report_content
+    # Don't hold a pooled connection for the lifetime of the stream
+    db.close()
+    
+    subscription = report_streams.subscribe(report_id)
+    
+    async def live():
+        content, queue = subscription
+        try:
+            yield _sse({"report_id": report_id, "type": "snapshot", "content": content})
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield _sse({"report_id": report_id, **event})
+                if event["type"] == "done":
+                    return
+        finally:
+            report_streams.unsubscribe(report_id, queue)
+    
+    async def polled():
+        current_status, current = status, content
+        yield _sse({"report_id": report_id, "type": "snapshot", "content": current})
+        interval = get_settings().report_flush_interval
+        while current_status == "generating":
+            await asyncio.sleep(interval)
+            previous = current
+            current_status, current = await run_in_threadpool(_read_report, report_id)
+            if current_status is None:
+                current_status = "failed"
+            elif current != previous:
+                yield _sse({"report_id": report_id, "type": "replace", "content": current})
+        yield _sse({"report_id": report_id, "type": "done", "status": current_status, "error_message": None})
+    
+    return StreamingResponse(
+        live() if subscription else polled(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @router.delete("/{report_id}")
 async def delete_report(
     report_id: int,
@@ -3,7 +3,8 @@ Pydantic schemas for API request/response validation.
 """
 from datetime import date, datetime
 from typing import Optional, List, Dict, Any
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, field_validator
+import json
 
 
 # ============== Doctor Schemas ==============
@@ -72,6 +73,63 @@ class PaymentRecordResponse(PaymentRecordBase):
         from_attributes = True
 
 
+# ============== Payment Rollup Schemas ==============
+
+class DoctorMonthlyRollupResponse(BaseModel):
+    """One month of a doctor's payments."""
+    month: date
+    payment_count: int
+    total_amount: float
+    max_amount: Optional[float] = None
+    manufacturer_count: Optional[int] = None
+    last_payment_date: Optional[date] = None
+    
+    class Config:
+        from_attributes = True
+
+
+class PaymentWindowSummary(BaseModel):
+    """Totals over a month-aligned time window."""
+    payment_count: int = 0
+    total_amount: float = 0.0
+    max_amount: Optional[float] = None
+    last_payment_date: Optional[date] = None
+    active_months: int = 0
+
+
+class DoctorMonthlyHistory(BaseModel):
+    """Monthly payment history of a doctor within a time window."""
+    npi: str
+    summary: PaymentWindowSummary
+    items: List[DoctorMonthlyRollupResponse]
+
+
+class ManufacturerMonthlyRollupResponse(BaseModel):
+    """One month of a manufacturer's payments."""
+    month: date
+    payment_count: int
+    total_amount: float
+    max_amount: Optional[float] = None
+    doctor_count: Optional[int] = None
+    
+    class Config:
+        from_attributes = True
+
+
+class ManufacturerTrend(BaseModel):
+    """Monthly payment trend of a manufacturer."""
+    manufacturer_name: str
+    items: List[ManufacturerMonthlyRollupResponse]
+
+
+class ManufacturerSummary(BaseModel):
+    """Manufacturer totals within a time window."""
+    manufacturer_name: str
+    payment_count: int
+    total_amount: float
+    max_amount: Optional[float] = None
+
+
 # ============== Cluster Schemas ==============
 
 class ClusterKPISummary(BaseModel):
@@ -101,10 +159,108 @@ class ClusterResultCreate(ClusterResultBase):
 
 class ClusterResultResponse(ClusterResultBase):
     """Cluster result response."""
+    task_id: Optional[int] = None
+    algorithm: Optional[str] = None
+    silhouette_score: Optional[float] = None
+    inertia: Optional[float] = None
+    quality_metrics: Optional[Dict[str, Any]] = None
+    is_current: Optional[bool] = None
+    segment_by: Optional[str] = Field(None, description="Partition attribute of a segmented clustering child result")
+    segment_value: Optional[str] = None
+
+    @field_validator("kpi_summary", mode="before")
+    @classmethod
+    def parse_kpi_summary(cls, value):
+        """Older results stored the summary as JSON text inside the JSON column."""
+        if isinstance(value, str):
+            return json.loads(value)
+        return value
+
     class Config:
         from_attributes = True
 
 
+class ClusterPredictRequest(BaseModel):
+    """Doctors to assign to a result's clusters: stored doctors by NPI and/or raw feature records."""
+    npis: Optional[List[str]] = Field(default=None, max_length=10000, description="NPIs of stored doctors")
+    records: Optional[List[Dict[str, float]]] = Field(
+        default=None,
+        max_length=10000,
+        description="Raw feature values keyed by feature name, e.g. {\"recency_days\": 30, ...}"
+    )
+
+
+class ClusterPrediction(BaseModel):
+    """Nearest cluster of one doctor or record."""
+    npi: Optional[str] = None
+    cluster: int
+    distance: float
+
+
+class ClusterPredictResponse(BaseModel):
+    """Predicted clusters; stored doctors are listed first, then records in request order."""
+    result_id: int
+    predictions: List[ClusterPrediction]
+    not_found: List[str] = []
+
+
+class TypedArray(BaseModel):
+    """Array as base64 little-endian bytes; decode with e.g. new Float32Array(buffer)."""
+    dtype: str = Field(..., description="NumPy dtype name: uint8, uint16, uint32 or float32")
+    shape: List[int]
+    data: str
+
+
+class VizAxis(BaseModel):
+    """Display axis of a viz level; grid bin i spans min + i·(max-min)/bins."""
+    feature: str
+    transform: str = Field(..., description="log1p or linear (display coordinate = transform(raw value))")
+    min: float
+    max: float
+    bins: int
+
+
+class ClusterVizResponse(BaseModel):
+    """
+    One level of detail of a result's visualization data.
+    grid: sparse per-cluster density cells (columns cluster, x, y[, z] bin indices, count);
+    sample: cluster-stratified points (cluster, coords of shape n x axes).
+    """
+    result_id: int
+    level: int
+    levels: int
+    features: List[str] = Field(..., description="All features of the result (axis choices)")
+    axes: List[VizAxis]
+    grid: Dict[str, TypedArray]
+    sample: Dict[str, TypedArray]
+    sample_size: int = Field(..., description="Points in the level's sample before cropping to bounds")
+
+
+class ClusterMatch(BaseModel):
+    """Best-matching cluster of the other result (highest Jaccard similarity)."""
+    cluster: int
+    size: int = Field(..., description="Doctors of the cluster among the compared doctors")
+    best_match: int
+    jaccard: float
+
+
+class ClusterComparisonResponse(BaseModel):
+    """Agreement of two results' assignments over the doctors both assign."""
+    result_id: int
+    other_id: int
+    common_doctors: int
+    only_in_result: int
+    only_in_other: int
+    adjusted_rand_index: float
+    normalized_mutual_info: float
+    clusters: List[int]
+    other_clusters: List[int]
+    contingency: List[List[int]] = Field(..., description="Doctors per (cluster, other cluster) pair")
+    matches: List[ClusterMatch]
+    other_matches: List[ClusterMatch]
+    seconds: float
+
+
 # ============== Analysis Schemas ==============
 
 class ClusteringRequest(BaseModel):
@@ -117,6 +273,16 @@ class ClusteringRequest(BaseModel):
 
 
 
+class ClusteringAlgorithmInfo(BaseModel):
+    """A clustering algorithm available as the algorithm task parameter."""
+    name: str
+    label: str
+    scaling: str = Field(..., description="Time / memory scaling characteristics")
+    streaming: bool = Field(..., description="Streams from the database instead of loading all features")
+    uses_k: bool = Field(..., description="Whether k sets the number of clusters")
+    centroid_model: bool = Field(..., description="Results support the predict API")
+
+
 class ClusteringResponse(BaseModel):
     """Response after clustering is complete."""
     success: bool
@@ -124,6 +290,42 @@ class ClusteringResponse(BaseModel):
     clusters: List[ClusterResultResponse]
 
 
+class KSweepPoint(BaseModel):
+    """Clustering quality metrics for one K."""
+    k: int
+    inertia: float
+    silhouette: float
+    calinski_harabasz: float
+    davies_bouldin: float
+    fit_seconds: float
+
+
+class KSweepResponse(BaseModel):
+    """Optimal K sweep (elbow / silhouette analysis)."""
+    sweep_id: int
+    task_id: Optional[int] = None
+    dataset_version: str
+    features_used: List[str]
+    k_min: int
+    k_max: int
+    sample_size: int
+    recommended_k: Optional[int] = None
+    elbow_k: Optional[int] = None
+    metrics: List[KSweepPoint]
+    created_at: Optional[datetime] = None
+
+    @field_validator("features_used", mode="before")
+    @classmethod
+    def parse_features(cls, value):
+        """Features are stored as JSON text on the model."""
+        if isinstance(value, str):
+            return json.loads(value)
+        return value
+
+    class Config:
+        from_attributes = True
+
+
 # ============== Analysis Task Schemas ==============
 
 class AnalysisTaskBase(BaseModel):
@@ -132,18 +334,34 @@ class AnalysisTaskBase(BaseModel):
     parameters: Optional[Dict[str, Any]] = None
 
 class AnalysisTaskCreate(AnalysisTaskBase):
-    pass
+    force: bool = Field(
+        default=False,
+        description="Run even if an identical task is in flight or already completed on the same data"
+    )
 
 class AnalysisTaskResponse(AnalysisTaskBase):
     task_id: int
     status: str
     progress: int
+    progress_detail: Optional[Dict[str, Any]] = None
     error_message: Optional[str] = None
     created_by: Optional[int] = None
     started_at: Optional[datetime] = None
     completed_at: Optional[datetime] = None
     created_at: datetime
     result_id: Optional[int] = None
+    deduplicated: bool = Field(
+        default=False,
+        description="An existing identical task was returned instead of creating one"
+    )
+    
+    @field_validator("parameters", mode="before")
+    @classmethod
+    def parse_parameters(cls, value):
+        """Parameters are stored as JSON text on the model."""
+        if isinstance(value, str):
+            return json.loads(value)
+        return value
     
     class Config:
         from_attributes = True
@@ -161,6 +379,7 @@ class AIReportBase(BaseModel):
 class AIReportCreate(AIReportBase):
     report_content: Optional[str] = "" # Optional on create, filled by AI
     dify_conversation_id: Optional[str] = None
+    use_cache: bool = True # False regenerates even if an identical report is cached
 
 class AIReportResponse(AIReportBase):
     report_id: int
@@ -168,6 +387,8 @@ class AIReportResponse(AIReportBase):
     generated_by: int
     dify_conversation_id: Optional[str] = None
     generation_time: Optional[float] = None
+    timing: Optional[Dict[str, Any]] = Field(None, description="Seconds per generation stage")
+    cached: Optional[bool] = False
     status: str
     view_count: int
     created_at: datetime
@@ -194,3 +415,34 @@ class SystemLogResponse(BaseModel):
 class AIReportList(BaseModel):
     total: int
     items: List[AIReportResponse]
+
+class ReportBatchCreate(BaseModel):
+    target: str = Field(..., description="clusters (cluster_analysis reports) or top_doctors (doctor_profile reports)")
+    cluster_ids: Optional[List[int]] = Field(default=None, max_length=1000, description="clusters: these results")
+    task_id: Optional[int] = Field(None, description="clusters: the results of this task (default: all whole-population results)")
+    cluster: Optional[int] = Field(None, description="top_doctors: only doctors of this cluster")
+    result_id: Optional[int] = Field(None, description="top_doctors: resolve the cluster through this result instead of the current one")
+    top_n: int = Field(100, ge=1, le=1000, description="top_doctors: number of doctors by monetary value")
+    use_cache: bool = True
+
+class ReportBatchResponse(BaseModel):
+    batch_id: int
+    target: str
+    report_type: str
+    parameters: Optional[Dict[str, Any]] = None
+    total: int
+    status: str
+    progress: int
+    counts: Dict[str, int] = Field(default_factory=dict, description="Reports per status")
+    cached: int = 0
+    created_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+
+class ReportTimingStats(BaseModel):
+    reports: int = Field(..., description="Reports aggregated (most recent first)")
+    cached: int = Field(0, description="Of which served from the response cache")
+    failed: int = 0
+    stages: Dict[str, Dict[str, Any]] = Field(default_factory=dict, description="count, mean, p50, p95, p99, max seconds per stage")
+    dify_share: Optional[float] = Field(None, description="Fraction of the total generation time spent in Dify HTTP calls")
+    retries: int = 0
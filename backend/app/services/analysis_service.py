@@ -6,20 +6,98 @@ import numpy as np
 from sqlalchemy.orm import Session
 from sqlalchemy import func
 from sklearn.preprocessing import StandardScaler
-from sklearn.cluster import KMeans
-from sklearn.metrics import silhouette_score
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.metrics import silhouette_score, calinski_harabasz_score, davies_bouldin_score
+from threadpoolctl import threadpool_limits
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Optional
+import hashlib
 import json
-from datetime import datetime
+import multiprocessing
+import time
+from datetime import datetime, date
 import traceback
 
-from ..models import Doctor, ClusterResult, AnalysisTask
+from ..config import get_settings
+from ..models import Doctor, ClusterResult, AnalysisTask, KSweepResult
 from ..database import engine
+from . import rfm_window
+from .feature_store import feature_store, FeatureMatrix
+from .cluster_result_service import cluster_result_service
+from .cluster_model import ClusterModel
+from .clustering_algorithms import ALGORITHMS, ClusteringAlgorithm, get_algorithm
+from . import cluster_metrics
+from . import cluster_comparison
+from . import cpu_governor
+from . import task_events
+from . import viz_service
+from . import payment_mix
+from .payment_mix import payment_mix_store
+
+DEFAULT_FEATURES = ['recency_days', 'frequency', 'monetary']
+
+# Skewed features are log-transformed before scaling
+LOG_FEATURES = ['frequency', 'monetary', 'total_payments', 'avg_payment_amount']
+
+# Points in ClusterResult.visualization_data (cluster-stratified)
+VIZ_SAMPLE_SIZE = 2000
+
+# Streaming fits: rows kept for silhouette subsampling and visualization samples
+METRIC_POOL_SIZE = 50000
+
+# Optimal K sweep: rows each K is fitted on, rows silhouette is scored on
+SWEEP_SAMPLE_SIZE = 20000
+SILHOUETTE_SAMPLE_SIZE = 5000
+SWEEP_SEED = 42
+
+# Stability: rows per bootstrap resample, rows the runs' labellings are compared on
+STABILITY_SAMPLE_SIZE = 50000
+STABILITY_EVAL_SIZE = 100000
+
+# Segmented clustering: Doctor attributes doctors can be partitioned by, and
+# the segments pooled rows fall into (rare values, missing values)
+SEGMENT_COLUMNS = ['specialty', 'state']
+OTHER_SEGMENT = '其他'
+UNKNOWN_SEGMENT = '未知'
+
+# Task fingerprints: parameter defaults per task type, integer parameters
+# (with their minimum), and parameters that don't change a task's result
+TASK_DEFAULTS = {
+    'clustering': {'k': 5, 'features': DEFAULT_FEATURES, 'algorithm': 'k-means'},
+    'k_sweep': {'k_min': 2, 'max_k': 10, 'features': DEFAULT_FEATURES, 'sample_size': SWEEP_SAMPLE_SIZE},
+    'segmented_clustering': {
+        'segment_by': 'specialty', 'k_min': 2, 'max_k': 8, 'features': DEFAULT_FEATURES,
+        'sample_size': SWEEP_SAMPLE_SIZE, 'min_segment_size': 1000, 'max_segments': 50,
+    },
+    'stability': {
+        'k': 5, 'features': DEFAULT_FEATURES, 'n_bootstrap': 20,
+        'sample_size': STABILITY_SAMPLE_SIZE, 'eval_size': STABILITY_EVAL_SIZE,
+    },
+}
+INT_PARAMS = {
+    'k': 2, 'k_min': 2, 'max_k': 2, 'sample_size': 1, 'batch_size': 1, 'epochs': 1,
+    'min_segment_size': 1, 'max_segments': 1, 'n_bootstrap': 2, 'eval_size': 1, 'result_id': 1,
+}
+NON_RESULT_PARAMS = {'force', 'timeout_seconds', 'activate', 'use_feature_cache'}
+
 
 class AnalysisService:
     
     def perform_clustering(self, db: Session, task_id: int):
         """
-        Execute K-Means clustering analysis workflow for a specific task.
+        Execute the clustering analysis workflow for a specific task.
+        
+        Task parameters:
+            k, features: Number of clusters and Doctor features to use
+            algorithm: Name in clustering_algorithms.ALGORITHMS: "k-means"
+                (default, in memory), "minibatch-kmeans" (streams feature batches
+                from the database, see _fit_minibatch_streaming), "gmm", "birch",
+                "hdbscan" or "dbscan"; algorithm-specific parameters are passed on
+            window_start, window_end, reference_date: Optional RFM time window
+            activate: Make the new result current (default true)
+            use_feature_cache: Reuse the cached feature matrix for the same
+                features and data (default true; in-memory algorithms, the
+                streaming minibatch-kmeans always reads the database)
         
         Args:
             db: Database session
@@ -31,9 +109,11 @@ class AnalysisService:
         task = db.query(AnalysisTask).filter(AnalysisTask.task_id == task_id).first()
         if not task:
             raise ValueError(f"Task {task_id} not found")
+        if task.status == "cancelled":
+            return {"task_id": task_id, "status": "cancelled"}
             
         try:
-            # 1. Update Task Status
+            # 1. Update Task Status (progress below is reported as events, not committed)
             task.status = "running"
             task.started_at = datetime.now()
             task.progress = 10
@@ -42,109 +122,95 @@ class AnalysisService:
             # Parse parameters
             params = json.loads(task.parameters) if task.parameters else {}
             k = params.get('k', 5)
-            features = params.get('features', ['recency_days', 'frequency', 'monetary'])
-            
-            # 2. Load Data
-            task.progress = 20
-            db.commit()
-            print(f"Loading data for clustering task {task_id}...")
-            
-            # Use explicit column selection for performance
-            # Note: We use existing RFM columns from Doctor table
-            query_cols = [Doctor.npi] + [getattr(Doctor, f) for f in features if hasattr(Doctor, f)]
-            query = db.query(*query_cols)
-            df = pd.read_sql(query.statement, db.bind)
-            
-            if df.empty:
-                raise ValueError("No doctor data available for clustering")
-                
-            # 3. Preprocessing
-            task.progress = 30
-            db.commit()
-            
-            df_clean = df.copy().dropna()
-            
-            # Log transform for skewed features (Frequency and Monetary are typically skewed)
-            model_features = []
-            for f in features:
-                if f in ['frequency', 'monetary', 'total_payments', 'avg_payment_amount']:
-                    col_name = f"{f}_log"
-                    df_clean[col_name] = np.log1p(df_clean[f])
-                    model_features.append(col_name)
-                else:
-                    model_features.append(f)
-            
-            # Standardization
-            scaler = StandardScaler()
-            X_scaled = scaler.fit_transform(df_clean[model_features])
+            features = payment_mix.expand_features(params.get('features', DEFAULT_FEATURES))
+            algorithm = params.get('algorithm', 'k-means')
             
-            # 4. K-Means Clustering
-            task.progress = 50
-            db.commit()
-            print(f"Running K-Means with K={k}...")
+            # Wall time per stage, reported in task.progress_detail
+            timings = {}
+            stage_start = time.perf_counter()
             
-            kmeans = KMeans(
-                n_clusters=k, 
-                random_state=42, 
-                n_init=10,
-                max_iter=300
-            )
-            cluster_labels = kmeans.fit_predict(X_scaled)
-            df_clean['cluster_id'] = cluster_labels
+            # 2-4. Load, preprocess and fit
+            print(f"Loading data for clustering task {task_id}...")
+            clusterer = get_algorithm(algorithm)
+            if clusterer.streaming:
+                fit = self._fit_minibatch_streaming(db, task, features, k, params)
+            else:
+                fit = self._fit_in_memory(db, task, features, k, params, clusterer)
+            timings['fit'] = time.perf_counter() - stage_start
+            task_events.report(task_id, "stage", stage="fit", seconds=round(timings['fit'], 3))
             
             # 5. Calculate Metrics
-            task.progress = 70
-            db.commit()
+            self._progress(task, 70, "metrics")
+            stage_start = time.perf_counter()
             
-            inertia = kmeans.inertia_
-            # Silhouette score is expensive for large datasets, sample if needed
-            if len(df_clean) > 10000:
-                # Calculate on a random sample for validation speed
-                indices = np.random.choice(len(X_scaled), 10000, replace=False)
-                silhouette = silhouette_score(X_scaled[indices], cluster_labels[indices])
-            else:
-                silhouette = silhouette_score(X_scaled, cluster_labels)
+            # Sampled silhouette (with CI) plus O(n·k) centroid metrics on all rows
+            quality = cluster_metrics.quality_metrics(
+                fit['metric_X'], fit['metric_labels'], fit['n_clusters'], params,
+                population=fit.get('population_metrics')
+            )
                 
             # 6. Analyze Clusters and Auto-label
-            summary_stats, cluster_labels_map, strategies_map = self._analyze_clusters(
-                df_clean, k, features, global_means=df_clean[features].mean()
+            summary_stats, cluster_labels_map, strategies_map = self._summarize_clusters(
+                fit['cluster_means'], fit['cluster_counts'], fit['n_clusters'], fit['global_means']
             )
             
+            timings['metrics'] = time.perf_counter() - stage_start
+            task_events.report(task_id, "stage", stage="metrics", seconds=round(timings['metrics'], 3))
+            
+            # Level-of-detail density grids and stratified samples
+            stage_start = time.perf_counter()
+            viz_levels = fit['viz'].build(fit['viz_raw'], fit['viz_labels'])
+            timings['viz'] = time.perf_counter() - stage_start
+            task_events.report(task_id, "stage", stage="viz", seconds=round(timings['viz'], 3))
+            
             # 7. Save Result
-            task.progress = 80
-            db.commit()
+            self._progress(task, 80, "save")
             
             # Create ClusterResult
             result = ClusterResult(
                 cluster_name=f"{task.task_name} Result",
                 task_id=task.task_id,
-                algorithm="k-means",
+                algorithm=algorithm,
                 features_used=json.dumps(features),
                 cluster_labels=json.dumps(cluster_labels_map),
-                silhouette_score=float(silhouette),
-                inertia=float(inertia),
-                kpi_summary=json.dumps(summary_stats), # JSON serializable
-                visualization_data=self._prepare_viz_data(df_clean, features, k),
+                silhouette_score=quality['silhouette']['mean'],
+                quality_metrics=quality,
+                inertia=float(fit['inertia']),
+                kpi_summary=summary_stats,
+                visualization_data=self._prepare_viz_data(fit['viz_raw'], fit['viz_labels'], features),
+                model_params=self._model_params(fit, features, params),
                 is_active=True
             )
             db.add(result)
             db.flush() # Get result_id
+            viz_service.save_levels(db, result.cluster_id, viz_levels)
             
-            # 8. Update Doctor Records (Batch)
-            task.progress = 90
-            db.commit()
-            print("Updating Doctor records...")
+            # 8. Store Assignments (same transaction as the result)
+            self._progress(task, 90, "assignment_write")
+            print("Storing cluster assignments...")
             
-            self._batch_update_doctors(db, df_clean[['npi', 'cluster_id']])
+            timings['assignment_write'] = cluster_result_service.write_assignments(
+                db, result.cluster_id, fit['npi'], fit['labels']
+            )
+            print(f"Stored {len(fit['npi']):,} assignments in {timings['assignment_write']:.2f}s")
+            if params.get('activate', True):
+                cluster_result_service.activate(db, result.cluster_id)
             
             # 9. Complete Task
-            task.status = "completed"
-            task.progress = 100
-            task.completed_at = datetime.now()
-            task.result_id = result.cluster_id
-            
-            db.commit()
-            return {"task_id": task_id, "cluster_id": result.cluster_id, "status": "completed"}
+            result_id = result.cluster_id
+            progress_detail = self._stage_detail(
+                timings, assigned_rows=len(fit['npi']), n_clusters=fit['n_clusters'], algorithm=fit['detail']
+            )
+            if not self._complete(db, task, progress_detail=progress_detail, result_id=result_id):
+                return {"task_id": task_id, "status": "cancelled"}
+            task_events.report(
+                task_id, "stage", stage="assignment_write", seconds=round(timings['assignment_write'], 3)
+            )
+            task_events.report(
+                task_id, "status", status="completed", result_id=result_id,
+                progress_detail=progress_detail
+            )
+            return {"task_id": task_id, "cluster_id": result_id, "status": "completed"}
             
         except Exception as e:
             db.rollback()
@@ -154,22 +220,396 @@ class AnalysisService:
             task.error_message = str(e)
             task.completed_at = datetime.now()
             db.commit()
+            task_events.report(task_id, "status", status="failed", error_message=str(e))
             raise e
 
-    def _analyze_clusters(self, df, k, features, global_means):
-        """Analyze cluster characteristics and generate labels."""
+    def task_fingerprint(self, db: Session, task_type: str, params: dict) -> str:
+        """
+        Identity of a task's result: task type, parameters with defaults filled
+        in (minus NON_RESULT_PARAMS, and k for clustering algorithms that
+        don't use it) and the version of the data it reads.
+        Raises ValueError for an INT_PARAMS parameter that isn't an integer
+        (bools and floats included) or is below its minimum, and for
+        k_min > max_k, so that the parameters stored with the task are the
+        ones fingerprinted.
+        """
+        ignored = set(NON_RESULT_PARAMS)
+        if task_type == 'clustering':
+            algorithm = ALGORITHMS.get((params or {}).get('algorithm', 'k-means'))
+            if algorithm is not None and not algorithm.uses_k:
+                ignored.add('k')
+        normalized = {name: value for name, value in TASK_DEFAULTS.get(task_type, {}).items() if name not in ignored}
+        for name, value in (params or {}).items():
+            if name in ignored or value is None:
+                continue
+            if name in INT_PARAMS:
+                if isinstance(value, bool) or not isinstance(value, int):
+                    raise ValueError(f"Parameter '{name}' must be an integer, got {value!r}")
+                if value < INT_PARAMS[name]:
+                    raise ValueError(f"Parameter '{name}' must be at least {INT_PARAMS[name]}, got {value}")
+            normalized[name] = value
+        if 'k_min' in normalized and 'max_k' in normalized and normalized['k_min'] > normalized['max_k']:
+            raise ValueError(f"Invalid K range: {normalized['k_min']}..{normalized['max_k']}")
+        normalized['features'] = payment_mix.expand_features(normalized.get('features', DEFAULT_FEATURES))
+        version = feature_store.dataset_version(db, normalized['features'], normalized)
+        payload = {'task_type': task_type, 'params': normalized, 'version': version}
+        return hashlib.sha1(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+    def find_duplicate_task(self, db: Session, fingerprint: str) -> Optional[AnalysisTask]:
+        """
+        Task with the same fingerprint that is in flight (pending/running), or
+        else the latest completed one whose result is still available.
+        """
+        same = db.query(AnalysisTask).filter(AnalysisTask.fingerprint == fingerprint)
+        in_flight = same.filter(AnalysisTask.status.in_(["pending", "running"]))\
+            .order_by(AnalysisTask.task_id)\
+            .first()
+        if in_flight:
+            return in_flight
+        
+        completed = same.filter(AnalysisTask.status == "completed")\
+            .order_by(AnalysisTask.task_id.desc())\
+            .first()
+        if completed and completed.result_id is not None:
+            result_active = db.query(ClusterResult.is_active)\
+                .filter(ClusterResult.cluster_id == completed.result_id)\
+                .scalar()
+            if not result_active:
+                return None
+        return completed
+
+    def _load_features(self, db: Session, features, params) -> pd.DataFrame:
+        """
+        Load npi + feature columns, from the Doctor table or a time window,
+        joined with payment-mix components (doctors with payments only).
+        """
+        if params.get('window_start') or params.get('window_end'):
+            # RFM recomputed over the requested time window
+            return self._load_window_rfm(db, features, params)
+        
+        # Use explicit column selection for performance
+        # Note: We use existing RFM columns from Doctor table
+        query_cols = [Doctor.npi] + [getattr(Doctor, f) for f in features if hasattr(Doctor, f)]
+        query = db.query(*query_cols)
+        return payment_mix_store.attach(db, pd.read_sql(query.statement, db.bind), features)
+
+    def _iter_feature_chunks(self, db: Session, features, params, chunk_size: int):
+        """Yield npi + feature columns in chunks of at most chunk_size rows."""
+        if params.get('window_start') or params.get('window_end'):
+            # Window RFM is computed in memory by the prefix-sum engine already
+            df = self._load_window_rfm(db, features, params)
+            for start in range(0, len(df), chunk_size):
+                yield df.iloc[start:start + chunk_size]
+            return
+        
+        query_cols = [Doctor.npi] + [getattr(Doctor, f) for f in features if hasattr(Doctor, f)]
+        query = db.query(*query_cols)
+        columns = [col.key for col in query_cols]
+        mix = payment_mix_store.get(db) if payment_mix.mix_features(features) else None
+        
+        # Plain DBAPI cursor: ORM / read_sql row processing dominates a full pass
+        cursor = db.connection().connection.cursor()
+        try:
+            cursor.execute(str(query.statement.compile(db.bind)))
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                chunk = pd.DataFrame.from_records(rows, columns=columns)
+                yield mix.attach(chunk, payment_mix.mix_features(features)) if mix else chunk
+        finally:
+            cursor.close()
+
+    def _model_matrix(self, df: pd.DataFrame, features) -> np.ndarray:
+        """Feature matrix before scaling, with skewed features log-transformed."""
+        columns = [
+            np.log1p(df[f].values) if f in LOG_FEATURES else df[f].values
+            for f in features
+        ]
+        return np.column_stack(columns).astype(np.float64)
+
+    def _transform_name(self, features) -> str:
+        """Describes _model_matrix + scaling, part of the feature cache key."""
+        logged = [f for f in features if f in LOG_FEATURES]
+        return f"log1p({','.join(logged)})+standard"
+
+    def _prepare_features(self, db: Session, task: AnalysisTask, features, params) -> FeatureMatrix:
+        """
+        Scaled feature matrix for the task, from the feature cache when possible.
+        
+        On a miss, loads the features, drops incomplete rows, log-transforms
+        skewed features, standardizes and stores the result (see feature_store).
+        Set the use_feature_cache parameter to false to always rebuild.
+        """
+        key = feature_store.make_key(db, features, self._transform_name(features), params)
+        if params.get('use_feature_cache', True):
+            cached = feature_store.load(key)
+            if cached is not None:
+                print(f"Using cached features ({len(cached):,} rows)")
+                return cached
+        
+        # 2. Load Data
+        self._progress(task, 20, "load")
+        
+        df = self._load_features(db, features, params)
+        if df.empty:
+            raise ValueError("No doctor data available for clustering")
+            
+        # 3. Preprocessing
+        self._progress(task, 30, "preprocess")
+        
+        df_clean = df.dropna()
+        
+        # Standardization (after log transform of skewed features)
+        scaler = StandardScaler()
+        X_scaled = scaler.fit_transform(self._model_matrix(df_clean, features))
+        
+        return feature_store.save(
+            key, df_clean['npi'].values, df_clean[features].values, X_scaled,
+            scaler.mean_, scaler.scale_
+        )
+
+    def _fit_in_memory(self, db: Session, task: AnalysisTask, features, k, params,
+                       clusterer: ClusteringAlgorithm = None):
+        """
+        Run an in-memory algorithm (default K-Means) over every doctor, using
+        the cached feature matrix.
+        
+        Returns:
+            dict: npi, labels, n_clusters, inertia, cluster_means, cluster_counts,
+                global_means, metric_X and metric_labels (scaled rows for quality
+                metrics, here all rows), viz (accumulated viz_service.VizBuilder),
+                viz_raw and viz_labels (rows the visualization samples are drawn from),
+                scaler_mean, scaler_scale, centroids (None unless the algorithm
+                assigns by nearest centroid) and detail
+        """
+        clusterer = clusterer or get_algorithm('k-means')
+        matrix = self._prepare_features(db, task, features, params)
+        if len(matrix) == 0:
+            raise ValueError("No doctor data available for clustering")
+        
+        # 4. Clustering
+        self._progress(task, 50, "fit")
+        print(f"Running {clusterer.label} with K={k}..." if clusterer.uses_k else f"Running {clusterer.label}...")
+        
+        def report(fraction, **event):
+            task_events.report(task.task_id, "fit", **event)
+            self._progress(task, 50 + int(20 * fraction), "fit")
+        
+        output = clusterer.fit(matrix.X, k, params, report)
+        cluster_labels = output.labels
+        
+        labelled = pd.DataFrame(np.asarray(matrix.raw), columns=features).assign(cluster_id=cluster_labels)
+        log_features = [f for f in features if f in LOG_FEATURES]
+        
+        return {
+            'npi': matrix.npi.astype(str),
+            'labels': cluster_labels,
+            'n_clusters': output.n_clusters,
+            'inertia': output.inertia,
+            'cluster_means': labelled.groupby('cluster_id')[features].mean(),
+            'cluster_counts': labelled['cluster_id'].value_counts(),
+            'global_means': labelled[features].mean(),
+            'metric_X': matrix.X,
+            'metric_labels': cluster_labels,
+            'viz': viz_service.population_builder(features, log_features, output.n_clusters, matrix.raw, cluster_labels),
+            'viz_raw': matrix.raw,
+            'viz_labels': cluster_labels,
+            'scaler_mean': matrix.mean,
+            'scaler_scale': matrix.scale,
+            'centroids': output.centroids,
+            'detail': output.detail,
+        }
+
+    def _fit_minibatch_streaming(self, db: Session, task: AnalysisTask, features, k, params):
+        """
+        Out-of-core MiniBatch K-Means over feature batches streamed from the database.
+        
+        Pass 1 fits the scaler incrementally, pass 2 runs `epochs` passes of
+        MiniBatchKMeans.partial_fit, pass 3 predicts labels batch by batch while
+        accumulating per-cluster sums, centroid quality metrics, density grids
+        and a seeded pool of rows for silhouette and visualization samples. Only the NPIs
+        (fixed-width bytes) and int16 labels are kept for the whole population.
+        
+        Task parameters:
+            batch_size: Rows per streamed batch (default 10000)
+            epochs: Passes over the data for partial_fit (default 3)
+            
+        Returns:
+            dict: Same structure as _fit_in_memory, with metric_X / metric_labels
+                and viz_raw / viz_labels holding the pool and population_metrics
+                the centroid metrics
+        """
+        batch_size = int(params.get('batch_size', 10000))
+        epochs = int(params.get('epochs', 3))
+        
+        def batches():
+            for chunk in self._iter_feature_chunks(db, features, params, batch_size):
+                chunk = chunk.dropna()
+                if not chunk.empty:
+                    yield chunk
+        
+        # Pass 1: scaler statistics, global means and the range of the density grids
+        self._progress(task, 20, "load")
+        
+        log_features = [f for f in features if f in LOG_FEATURES]
+        scaler = StandardScaler()
+        feature_sums = np.zeros(len(features))
+        viz_lower = np.full(len(features), np.inf)
+        viz_upper = np.full(len(features), -np.inf)
+        n_rows = 0
+        for chunk in batches():
+            scaler.partial_fit(self._model_matrix(chunk, features))
+            feature_sums += chunk[features].sum().values
+            display = viz_service.display_transform(chunk[features].values, features, log_features)
+            viz_lower = np.minimum(viz_lower, display.min(axis=0))
+            viz_upper = np.maximum(viz_upper, display.max(axis=0))
+            n_rows += len(chunk)
+        if n_rows == 0:
+            raise ValueError("No doctor data available for clustering")
+        
+        # Pass 2: incremental fit
+        self._progress(task, 30, "fit")
+        print(f"Running MiniBatch K-Means with K={k} over {n_rows:,} rows...")
+        
+        kmeans = MiniBatchKMeans(
+            n_clusters=k,
+            random_state=42,
+            batch_size=batch_size,
+            n_init=3
+        )
+        for epoch in range(epochs):
+            epoch_inertia = 0.0
+            for chunk in batches():
+                # The first partial_fit call initializes centroids and needs >= k rows
+                if len(chunk) >= k or hasattr(kmeans, 'cluster_centers_'):
+                    kmeans.partial_fit(scaler.transform(self._model_matrix(chunk, features)))
+                    epoch_inertia += float(kmeans.inertia_)
+            task_events.report(
+                task.task_id, "fit", epoch=epoch + 1, epochs=epochs,
+                n_steps=int(kmeans.n_steps_), inertia=epoch_inertia
+            )
+            self._progress(task, 30 + int(20 * (epoch + 1) / epochs), "fit")
+        
+        # Pass 3: streaming predict
+        centers = kmeans.cluster_centers_
+        rng = np.random.default_rng(42)
+        pool_rate = min(1.0, METRIC_POOL_SIZE / n_rows)
+        population = cluster_metrics.CentroidMetrics(centers)
+        viz = viz_service.VizBuilder(features, log_features, k, viz_lower, viz_upper)
+        
+        npis, labels, pool_raw, pool_X, pool_labels = [], [], [], [], []
+        cluster_sums = np.zeros((k, len(features)))
+        cluster_counts = np.zeros(k, dtype=np.int64)
+        inertia = 0.0
+        for chunk in batches():
+            X = scaler.transform(self._model_matrix(chunk, features))
+            chunk_labels = kmeans.predict(X)
+            
+            inertia += float(((X - centers[chunk_labels]) ** 2).sum())
+            population.update(X, chunk_labels)
+            viz.update(chunk[features].values, chunk_labels)
+            cluster_counts += np.bincount(chunk_labels, minlength=k)
+            for j, f in enumerate(features):
+                cluster_sums[:, j] += np.bincount(chunk_labels, weights=chunk[f].values, minlength=k)
+            
+            npis.append(chunk['npi'].values.astype('S10'))
+            labels.append(chunk_labels.astype(np.int16))
+            
+            pooled = rng.random(len(chunk)) < pool_rate
+            pool_raw.append(chunk[features].values[pooled])
+            pool_X.append(X[pooled])
+            pool_labels.append(chunk_labels[pooled])
+        
+        present = cluster_counts > 0
+        cluster_means = pd.DataFrame(
+            cluster_sums[present] / cluster_counts[present, None],
+            index=np.flatnonzero(present),
+            columns=features
+        )
+        
+        return {
+            'npi': np.concatenate(npis).astype(str),
+            'labels': np.concatenate(labels),
+            'n_clusters': k,
+            'inertia': inertia,
+            'cluster_means': cluster_means,
+            'cluster_counts': pd.Series(cluster_counts[present], index=np.flatnonzero(present)),
+            'global_means': pd.Series(feature_sums / n_rows, index=features),
+            'metric_X': np.vstack(pool_X),
+            'metric_labels': np.concatenate(pool_labels),
+            'viz': viz,
+            'viz_raw': np.vstack(pool_raw),
+            'viz_labels': np.concatenate(pool_labels),
+            'population_metrics': population.result(),
+            'scaler_mean': scaler.mean_,
+            'scaler_scale': scaler.scale_,
+            'centroids': centers,
+            'detail': {'epochs': epochs, 'n_steps': int(kmeans.n_steps_)},
+        }
+
+    def _model_params(self, fit, features, params) -> Optional[dict]:
+        """
+        Persisted preprocessing and centroids of a fit (see cluster_model), or
+        None if the algorithm doesn't assign by nearest centroid.
+        """
+        if fit['centroids'] is None:
+            return None
+        window = None
+        if params.get('window_start') or params.get('window_end'):
+            window = {name: params.get(name) for name in ('window_start', 'window_end', 'reference_date')}
+        model = ClusterModel(
+            features,
+            [f for f in features if f in LOG_FEATURES],
+            fit['scaler_mean'],
+            fit['scaler_scale'],
+            fit['centroids'],
+            window
+        )
+        return model.to_params()
+
+    def _load_window_rfm(self, db: Session, features, params):
+        """
+        Load RFM features recomputed over a time window.
+        
+        Parameters window_start / window_end / reference_date are ISO dates;
+        windows are month-aligned and Recency defaults to window_end.
+        """
+        unsupported = [f for f in features if f not in rfm_window.RFM_FEATURES]
+        if unsupported:
+            raise ValueError(f"Features not available for time windows: {unsupported}")
+        
+        def parse(name):
+            value = params.get(name)
+            return date.fromisoformat(value) if value else None
+        
+        rfm_engine = rfm_window.get_engine(db)
+        df = rfm_engine.compute(parse('window_start'), parse('window_end'), parse('reference_date'))
+        return df[['npi'] + list(features)]
+
+    def _summarize_clusters(self, cluster_means, cluster_counts, k, global_means):
+        """
+        Summarize cluster characteristics and generate labels.
+        
+        Args:
+            cluster_means: DataFrame of per-cluster means of the original
+                (not log transformed) features, indexed by cluster id
+            cluster_counts: Series of cluster sizes indexed by cluster id
+            k: Number of clusters requested
+            global_means: Series of population means per feature
+        """
         stats = {}
         labels_map = {}
         strategies_map = {}
-        
-        # Calculate summary per cluster using original values (not log transformed)
-        grouped = df.groupby('cluster_id')[features].mean()
-        counts = df['cluster_id'].value_counts()
+        total = int(cluster_counts.sum())
         
         for i in range(k):
-            cluster_stat = grouped.loc[i].to_dict()
-            count = int(counts[i])
-            percentage = round((count / len(df)) * 100, 2)
+            # MiniBatch K-Means can leave a cluster empty
+            if i not in cluster_means.index:
+                continue
+            cluster_stat = cluster_means.loc[i].to_dict()
+            count = int(cluster_counts[i])
+            percentage = round((count / total) * 100, 2)
             
             stats[str(i)] = {
                 "count": count,
@@ -214,39 +654,642 @@ class AnalysisService:
         else:
             return "常规跟进：保持数字化触达。"
 
-    def _prepare_viz_data(self, df, features, k):
-        """Prepare simplified data for frontend charts (e.g. scatter plot)."""
-        # Sampling for visualization to keep JSON size manageable
-        sample_size = min(len(df), 2000)
-        sample = df.sample(n=sample_size, random_state=42)
-        
-        data = []
-        for _, row in sample.iterrows():
-            item = {"cluster": int(row['cluster_id'])}
-            for f in features:
-                item[f] = float(row[f])
-            data.append(item)
-            
-        return json.dumps(data)
-
-    def _batch_update_doctors(self, db: Session, updates_df):
-        """Update doctor cluster IDs in batches."""
-        # Convert to list of dicts for SQLAlchemy bulk update
-        updates = []
-        for _, row in updates_df.iterrows():
-            updates.append({
-                "npi": row['npi'],
-                "cluster_id": int(row['cluster_id'])
-            })
-            
-        chunk_size = 5000
-        for i in range(0, len(updates), chunk_size):
-            db.bulk_update_mappings(Doctor, updates[i:i + chunk_size])
+    def _prepare_viz_data(self, raw, labels, features):
+        """
+        Small cluster-stratified sample as JSON records for simple charts;
+        the level-of-detail data is served by GET /analysis/results/{id}/viz.
+        """
+        idx = cluster_metrics.stratified_sample(labels, VIZ_SAMPLE_SIZE, viz_service.SAMPLE_SEED)
+        sample = pd.DataFrame(np.asarray(raw[idx], dtype=np.float64), columns=features)
+        sample.insert(0, 'cluster', np.asarray(labels)[idx].astype(int))
+        return sample.to_json(orient='records')
+
+    def _progress(self, task: AnalysisTask, progress: int, stage: str):
+        """Report task progress as an event; the value is persisted with the next status commit."""
+        task.progress = progress
+        task_events.report(task.task_id, "progress", progress=progress, stage=stage)
+
+    def _complete(self, db: Session, task: AnalysisTask, **values) -> bool:
+        """
+        Mark a task completed (plus the given column values) and commit it
+        together with the results written in the same session.
+        
+        Conditional on the task still running: a cancellation (or timeout)
+        committed meanwhile wins, and the task's results, assignments and
+        activation are rolled back.
+        
+        Returns:
+            bool: Whether the task was completed
+        """
+        # Write pending attribute changes (_progress) first, or the commit would
+        # write them over this UPDATE (the session doesn't autoflush)
+        db.flush()
+        completed = db.query(AnalysisTask)\
+            .filter(AnalysisTask.task_id == task.task_id, AnalysisTask.status == "running")\
+            .update({"status": "completed", "progress": 100, "completed_at": datetime.now(), **values},
+                    synchronize_session=False)
+        if not completed:
+            db.rollback()
+            print(f"Task {task.task_id} was cancelled before it completed; its results were discarded.")
+            return False
+        db.commit()
+        return True
+
+    def _stage_detail(self, timings: dict, **extra) -> dict:
+        """progress_detail payload: stage durations in seconds plus extra fields."""
+        detail = {'stage_seconds': {stage: round(seconds, 3) for stage, seconds in timings.items()}}
+        detail.update(extra)
+        return detail
+
+    def perform_k_sweep(self, db: Session, task_id: int):
+        """
+        Execute an optimal K sweep for a specific task.
+        
+        Task parameters:
+            features, window_start, window_end, reference_date: As for clustering
+            k_min, max_k: Range of K to evaluate (default 2..10)
+            sample_size: Rows the sweep is fitted on (default SWEEP_SAMPLE_SIZE)
+        
+        Returns:
+            dict: Result summary
+        """
+        task = db.query(AnalysisTask).filter(AnalysisTask.task_id == task_id).first()
+        if not task:
+            raise ValueError(f"Task {task_id} not found")
+        if task.status == "cancelled":
+            return {"task_id": task_id, "status": "cancelled"}
+        
+        try:
+            task.status = "running"
+            task.started_at = datetime.now()
+            task.progress = 10
+            db.commit()
+            
+            params = json.loads(task.parameters) if task.parameters else {}
+            sweep = self.determine_optimal_k(
+                db,
+                max_k=int(params.get('max_k', 10)),
+                k_min=int(params.get('k_min', 2)),
+                features=params.get('features', DEFAULT_FEATURES),
+                sample_size=int(params.get('sample_size', SWEEP_SAMPLE_SIZE)),
+                params=params,
+                task=task
+            )
+            
+            sweep_id = sweep.sweep_id
+            if not self._complete(db, task):
+                return {"task_id": task_id, "status": "cancelled"}
+            task_events.report(task_id, "status", status="completed", sweep_id=sweep_id)
+            return {"task_id": task_id, "sweep_id": sweep_id, "status": "completed"}
+        
+        except Exception as e:
+            db.rollback()
+            print(f"K Sweep Error: {str(e)}")
+            traceback.print_exc()
+            task.status = "failed"
+            task.error_message = str(e)
+            task.completed_at = datetime.now()
+            db.commit()
+            task_events.report(task_id, "status", status="failed", error_message=str(e))
+            raise e
+
+    def perform_segmented_clustering(self, db: Session, task_id: int):
+        """
+        Cluster each partition of the doctors separately (e.g. per specialty).
+        
+        Doctors are partitioned by a Doctor attribute; segments are clustered
+        in a process pool, each picking its own K, and stored as child
+        ClusterResults of the task (segment_by / segment_value set). Children
+        are never made current. A "segment" event is reported per finished
+        segment.
+        
+        Task parameters:
+            segment_by: Attribute in SEGMENT_COLUMNS (default "specialty")
+            features, window_start, window_end, reference_date: As for clustering
+            k_min, max_k: K range evaluated per segment (default 2..8)
+            sample_size: Rows per segment K selection is fitted on (default SWEEP_SAMPLE_SIZE)
+            min_segment_size: Smaller segments are pooled into OTHER_SEGMENT (default 1000)
+            max_segments: At most this many segments, the smallest are pooled (default 50)
+        
+        Returns:
+            dict: Result summary
+        """
+        task = db.query(AnalysisTask).filter(AnalysisTask.task_id == task_id).first()
+        if not task:
+            raise ValueError(f"Task {task_id} not found")
+        if task.status == "cancelled":
+            return {"task_id": task_id, "status": "cancelled"}
+        
+        try:
+            task.status = "running"
+            task.started_at = datetime.now()
+            task.progress = 10
+            db.commit()
+            
+            params = {**TASK_DEFAULTS['segmented_clustering'], **json.loads(task.parameters or '{}')}
+            features = payment_mix.expand_features(params['features'])
+            segment_by = params['segment_by']
+            k_min, max_k = int(params['k_min']), int(params['max_k'])
+            min_size = int(params['min_segment_size'])
+            if segment_by not in SEGMENT_COLUMNS:
+                raise ValueError(f"Cannot segment by {segment_by}, choose one of {SEGMENT_COLUMNS}")
+            if k_min < 2 or max_k < k_min:
+                raise ValueError(f"Invalid K range: {k_min}..{max_k}")
+            if min_size <= max_k:
+                raise ValueError(f"min_segment_size must exceed max_k ({max_k})")
+            
+            timings = {}
+            stage_start = time.perf_counter()
+            matrix = self._prepare_features(db, task, features, params)
+            segments, skipped = self._partition(db, matrix.npi, segment_by, min_size, int(params['max_segments']))
+            if not segments:
+                raise ValueError(f"No {segment_by} segment has at least {min_size} doctors")
+            timings['partition'] = time.perf_counter() - stage_start
+            
+            # Largest segments first, so the pool doesn't end on a long fit
+            self._progress(task, 35, "segments")
+            stage_start = time.perf_counter()
+            x_path = str(matrix.path / 'X.npy')
+            workers = cpu_governor.pool_size(get_settings().analysis_sweep_workers, len(segments))
+            print(f"Clustering {len(segments)} {segment_by} segments with {workers} workers...")
+            
+            fits = {}
+            ctx = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+                futures = {
+                    pool.submit(_segment_fit, x_path, idx, k_min, max_k, int(params['sample_size']), SWEEP_SEED, params): value
+                    for value, idx in segments
+                }
+                for done, future in enumerate(as_completed(futures), start=1):
+                    value = futures[future]
+                    fit = future.result()
+                    fits[value] = fit
+                    task_events.report(
+                        task_id, "segment", segment=value, done=done, total=len(segments), rows=fit['rows'],
+                        k=fit['k'], silhouette=fit['quality']['silhouette']['mean'], fit_seconds=fit['fit_seconds']
+                    )
+                    self._progress(task, 35 + int(50 * done / len(segments)), "segments")
+            timings['fit'] = time.perf_counter() - stage_start
+            task_events.report(task_id, "stage", stage="fit", seconds=round(timings['fit'], 3))
+            
+            # One transaction for all children, after the pool: no write lock held while fitting
+            self._progress(task, 85, "save")
+            stage_start = time.perf_counter()
+            log_features = [f for f in features if f in LOG_FEATURES]
+            summary = []
+            for value, idx in segments:
+                fit = fits[value]
+                raw = np.asarray(matrix.raw[idx], dtype=np.float64)
+                labelled = pd.DataFrame(raw, columns=features).assign(cluster_id=fit['labels'])
+                summary_stats, cluster_labels_map, _ = self._summarize_clusters(
+                    labelled.groupby('cluster_id')[features].mean(),
+                    labelled['cluster_id'].value_counts(),
+                    fit['k'],
+                    labelled[features].mean()
+                )
+                model = {'scaler_mean': matrix.mean, 'scaler_scale': matrix.scale, 'centroids': fit['centroids']}
+                result = ClusterResult(
+                    cluster_name=f"{task.task_name} - {value}",
+                    task_id=task.task_id,
+                    algorithm='k-means',
+                    segment_by=segment_by,
+                    segment_value=value,
+                    features_used=json.dumps(features),
+                    cluster_labels=json.dumps(cluster_labels_map),
+                    silhouette_score=fit['quality']['silhouette']['mean'],
+                    quality_metrics=fit['quality'],
+                    inertia=fit['inertia'],
+                    kpi_summary=summary_stats,
+                    visualization_data=self._prepare_viz_data(raw, fit['labels'], features),
+                    model_params=self._model_params(model, features, params),
+                    is_active=True
+                )
+                db.add(result)
+                db.flush()
+                viz = viz_service.population_builder(features, log_features, fit['k'], raw, fit['labels'])
+                viz_service.save_levels(db, result.cluster_id, viz.build(raw, fit['labels']))
+                cluster_result_service.write_assignments(db, result.cluster_id, matrix.npi[idx].astype(str), fit['labels'])
+                summary.append({
+                    'segment': value,
+                    'result_id': result.cluster_id,
+                    'rows': fit['rows'],
+                    'k': fit['k'],
+                    'silhouette': round(fit['quality']['silhouette']['mean'], 4),
+                    'k_scores': fit['k_scores'],
+                    'fit_seconds': fit['fit_seconds'],
+                })
+            timings['save'] = time.perf_counter() - stage_start
+            
+            progress_detail = self._stage_detail(
+                timings, segment_by=segment_by, segments=summary, skipped=skipped, workers=workers
+            )
+            if not self._complete(db, task, progress_detail=progress_detail):
+                return {"task_id": task_id, "status": "cancelled"}
+            task_events.report(task_id, "stage", stage="save", seconds=round(timings['save'], 3))
+            task_events.report(task_id, "status", status="completed", progress_detail=progress_detail)
+            return {"task_id": task_id, "result_ids": [s['result_id'] for s in summary], "status": "completed"}
+            
+        except Exception as e:
+            db.rollback()
+            print(f"Segmented Clustering Error: {str(e)}")
+            traceback.print_exc()
+            task.status = "failed"
+            task.error_message = str(e)
+            task.completed_at = datetime.now()
             db.commit()
+            task_events.report(task_id, "status", status="failed", error_message=str(e))
+            raise e
+    
+    def _partition(self, db: Session, npi, segment_by: str, min_size: int, max_segments: int):
+        """
+        Row indices of the feature matrix per value of a Doctor attribute,
+        largest first. Missing values form UNKNOWN_SEGMENT; values with fewer
+        than min_size doctors, and those beyond max_segments, are pooled into
+        OTHER_SEGMENT, which is skipped if it is still too small.
+        
+        Returns:
+            tuple: ([(value, indices)], {"segments": n, "rows": n} skipped)
+        """
+        column = getattr(Doctor, segment_by)
+        attrs = pd.read_sql(db.query(Doctor.npi, column).statement, db.bind)
+        values = attrs.set_index('npi')[segment_by].reindex(np.asarray(npi).astype(str))
+        values = values.str.strip().replace('', np.nan).fillna(UNKNOWN_SEGMENT).values
+        
+        counts = pd.Series(values).value_counts()
+        kept = counts[counts >= min_size]
+        if len(kept) > max_segments:
+            kept = kept.head(max_segments - 1)
+        
+        segments = [(str(value), np.flatnonzero(values == value)) for value in kept.index]
+        rest = np.flatnonzero(~np.isin(values, kept.index))
+        if len(rest) >= min_size and len(segments) < max_segments:
+            segments.append((OTHER_SEGMENT, rest))
+            segments.sort(key=lambda segment: -len(segment[1]))
+            return segments, {'segments': 0, 'rows': 0}
+        return segments, {'segments': int(len(counts) - len(kept)), 'rows': int(len(rest))}
+    
+    def perform_stability(self, db: Session, task_id: int):
+        """
+        Bootstrap stability of a K-Means segmentation.
+        
+        K-Means (n_init=10, a different random_state per run) is refitted on
+        n_bootstrap resamples (with replacement) in a process pool. Every run
+        labels the same seeded evaluation rows by nearest centroid, and the
+        labellings are compared through contingency tables (cluster_comparison):
+        per reference cluster the best-match Jaccard over runs (clusterwise
+        stability), and ARI / NMI between runs and against the reference.
+        
+        The reference is the stored result_id (its assignments and features),
+        or else K-Means with the clustering task's settings on all rows.
+        
+        Task parameters:
+            k, features, window_start, window_end, reference_date: As for clustering
+            result_id: Stored result to assess (k and features are taken from it)
+            n_bootstrap: Number of refits (default 20)
+            sample_size: Rows per bootstrap resample (default STABILITY_SAMPLE_SIZE)
+            eval_size: Rows the labellings are compared on (default STABILITY_EVAL_SIZE)
+        
+        Returns:
+            dict: Result summary
+        """
+        task = db.query(AnalysisTask).filter(AnalysisTask.task_id == task_id).first()
+        if not task:
+            raise ValueError(f"Task {task_id} not found")
+        if task.status == "cancelled":
+            return {"task_id": task_id, "status": "cancelled"}
+        
+        try:
+            task.status = "running"
+            task.started_at = datetime.now()
+            task.progress = 10
+            db.commit()
+            
+            params = {**TASK_DEFAULTS['stability'], **json.loads(task.parameters or '{}')}
+            reference = None
+            if params.get('result_id') is not None:
+                reference = db.query(ClusterResult)\
+                    .filter(ClusterResult.cluster_id == int(params['result_id']), ClusterResult.is_active == True)\
+                    .first()
+                if not reference:
+                    raise ValueError(f"Cluster result {params['result_id']} not found")
+                params['features'] = json.loads(reference.features_used)
+            features = payment_mix.expand_features(params['features'])
+            n_bootstrap = int(params['n_bootstrap'])
+            if n_bootstrap < 2:
+                raise ValueError("n_bootstrap must be at least 2")
+            
+            timings = {}
+            stage_start = time.perf_counter()
+            matrix = self._prepare_features(db, task, features, params)
+            eval_idx = _sample_indices(len(matrix), int(params['eval_size']), SWEEP_SEED)
+            reference_labels = None
+            if reference is not None:
+                # Stored assignments of the evaluation doctors (some may be missing)
+                npis, clusters = cluster_result_service.load_assignments(db, reference.cluster_id)
+                eval_npis = np.asarray(matrix.npi[eval_idx]).astype('S10')
+                pos = np.clip(np.searchsorted(npis, eval_npis), 0, max(len(npis) - 1, 0))
+                found = (npis[pos] == eval_npis) if len(npis) else np.zeros(len(eval_idx), dtype=bool)
+                eval_idx, reference_labels = eval_idx[found], clusters[pos[found]]
+                k = len(np.unique(reference_labels))
+                if k < 2:
+                    raise ValueError(f"Cluster result {reference.cluster_id} has no assignments to compare")
+            else:
+                k = int(params['k'])
+            timings['load'] = time.perf_counter() - stage_start
+            
+            self._progress(task, 30, "bootstrap")
+            stage_start = time.perf_counter()
+            x_path = str(matrix.path / 'X.npy')
+            sample_size = min(int(params['sample_size']), len(matrix))
+            # seed None: the reference fit on all rows with the clustering task's random_state
+            jobs = [(x_path, k, sample_size, SWEEP_SEED + run, eval_idx) for run in range(n_bootstrap)]
+            if reference_labels is None:
+                jobs.insert(0, (x_path, k, len(matrix), None, eval_idx))
+            workers = cpu_governor.pool_size(get_settings().analysis_sweep_workers, len(jobs))
+            print(f"Fitting {n_bootstrap} bootstrap runs of K={k} on {sample_size:,} rows with {workers} workers...")
+            
+            runs = []
+            ctx = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+                futures = [pool.submit(_stability_fit, *job) for job in jobs]
+                for done, future in enumerate(as_completed(futures), start=1):
+                    run = future.result()
+                    if run['seed'] is None:
+                        reference_labels = run['labels']
+                    else:
+                        runs.append(run)
+                    task_events.report(
+                        task_id, "fit", done=done, total=len(jobs), seed=run['seed'], fit_seconds=run['fit_seconds']
+                    )
+                    self._progress(task, 30 + int(55 * done / len(jobs)), "bootstrap")
+            timings['fit'] = time.perf_counter() - stage_start
+            task_events.report(task_id, "stage", stage="fit", seconds=round(timings['fit'], 3))
+            
+            # Contingency tables of every run against the reference and of every pair of runs
+            self._progress(task, 90, "compare")
+            stage_start = time.perf_counter()
+            runs.sort(key=lambda run: run['seed'])
+            ref_values = np.unique(reference_labels)
+            jaccard = np.empty((len(runs), len(ref_values)))
+            vs_reference = {'ari': [], 'nmi': []}
+            for row, run in enumerate(runs):
+                table, values, _ = cluster_comparison.contingency(reference_labels, run['labels'])
+                jaccard[row] = cluster_comparison.jaccard_matrix(table).max(axis=1)
+                vs_reference['ari'].append(cluster_comparison.adjusted_rand_index(table))
+                vs_reference['nmi'].append(cluster_comparison.normalized_mutual_info(table))
+            between_runs = {'ari': [], 'nmi': []}
+            for i in range(len(runs)):
+                for j in range(i + 1, len(runs)):
+                    table, _, _ = cluster_comparison.contingency(runs[i]['labels'], runs[j]['labels'])
+                    between_runs['ari'].append(cluster_comparison.adjusted_rand_index(table))
+                    between_runs['nmi'].append(cluster_comparison.normalized_mutual_info(table))
+            
+            names = json.loads(reference.cluster_labels or '{}') if reference is not None else {}
+            sizes = np.bincount(np.searchsorted(ref_values, reference_labels), minlength=len(ref_values))
+            clusters = []
+            for col, value in enumerate(ref_values):
+                scores = jaccard[:, col]
+                clusters.append({
+                    'cluster': int(value),
+                    'label': names.get(str(int(value))),
+                    'eval_rows': int(sizes[col]),
+                    'jaccard': cluster_comparison.describe(scores),
+                    'dissolved_rate': float((scores < cluster_comparison.DISSOLVED_JACCARD).mean()),
+                    'stable': bool(scores.mean() >= cluster_comparison.STABLE_JACCARD),
+                })
+            timings['compare'] = time.perf_counter() - stage_start
+            
+            stability = {
+                'reference_result_id': reference.cluster_id if reference is not None else None,
+                'k': k,
+                'features': features,
+                'n_bootstrap': len(runs),
+                'sample_size': sample_size,
+                'eval_rows': int(len(eval_idx)),
+                'clusters': clusters,
+                'between_runs': {name: cluster_comparison.describe(v) for name, v in between_runs.items()},
+                'vs_reference': {name: cluster_comparison.describe(v) for name, v in vs_reference.items()},
+            }
+            if reference is not None:
+                # Reassign so the JSON column is flagged as changed
+                reference.quality_metrics = {**(reference.quality_metrics or {}), 'stability': stability}
+            
+            progress_detail = self._stage_detail(timings, stability=stability)
+            if not self._complete(
+                db, task, progress_detail=progress_detail,
+                result_id=reference.cluster_id if reference is not None else None
+            ):
+                return {"task_id": task_id, "status": "cancelled"}
+            task_events.report(task_id, "stage", stage="compare", seconds=round(timings['compare'], 3))
+            task_events.report(task_id, "status", status="completed", progress_detail=progress_detail)
+            return {"task_id": task_id, "status": "completed"}
+            
+        except Exception as e:
+            db.rollback()
+            print(f"Stability Error: {str(e)}")
+            traceback.print_exc()
+            task.status = "failed"
+            task.error_message = str(e)
+            task.completed_at = datetime.now()
+            db.commit()
+            task_events.report(task_id, "status", status="failed", error_message=str(e))
+            raise e
+    
+    def _sweep_key(self, db: Session, features, k_min, max_k, sample_size, params):
+        """(cache_key, dataset_version) of a sweep."""
+        key = feature_store.make_key(db, features, self._transform_name(features), params)
+        key.update({'k_min': k_min, 'max_k': max_k, 'sample_size': sample_size, 'seed': SWEEP_SEED})
+        cache_key = hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()
+        return cache_key, key['version']
+
+    def find_k_sweep(self, db: Session, features, k_min: int = 2, max_k: int = 10,
+                     sample_size: int = SWEEP_SAMPLE_SIZE, params: dict = None) -> Optional[KSweepResult]:
+        """Cached sweep for the current dataset version, or None."""
+        features = payment_mix.expand_features(features)
+        cache_key, _ = self._sweep_key(db, features, k_min, max_k, sample_size, params or {})
+        return db.query(KSweepResult)\
+            .filter(KSweepResult.cache_key == cache_key)\
+            .order_by(KSweepResult.sweep_id.desc())\
+            .first()
+
+    def determine_optimal_k(self, db: Session, max_k: int = 10, k_min: int = 2, features=None,
+                            sample_size: int = SWEEP_SAMPLE_SIZE, params: dict = None,
+                            task: AnalysisTask = None) -> KSweepResult:
+        """
+        Evaluate K = k_min..max_k and recommend a K.
+        
+        Each K is fitted (K-Means, n_init=10) in a process pool on the same
+        seeded sample of the cached feature matrix; workers memory-map the
+        matrix instead of receiving a copy. Reports inertia, sampled
+        silhouette, Calinski-Harabasz and Davies-Bouldin per K. The recommended
+        K maximizes silhouette (as in the exploration notebook); elbow_k is the
+        knee of the inertia curve. Results are cached per dataset version.
+        """
+        features = payment_mix.expand_features(features or DEFAULT_FEATURES)
+        params = params or {}
+        if k_min < 2 or max_k < k_min:
+            raise ValueError(f"Invalid K range: {k_min}..{max_k}")
+        
+        cache_key, version = self._sweep_key(db, features, k_min, max_k, sample_size, params)
+        cached = db.query(KSweepResult)\
+            .filter(KSweepResult.cache_key == cache_key)\
+            .order_by(KSweepResult.sweep_id.desc())\
+            .first()
+        if cached is not None:
+            print(f"Using cached K sweep {cached.sweep_id}")
+            return cached
+        
+        if task is None:
+            task = AnalysisTask(task_name="K sweep", task_type="k_sweep")
+        matrix = self._prepare_features(db, task, features, params)
+        n_rows = len(matrix)
+        if n_rows <= max_k:
+            raise ValueError(f"Not enough doctors ({n_rows}) for K up to {max_k}")
+        
+        ks = list(range(k_min, max_k + 1))
+        jobs = [(str(matrix.path / 'X.npy'), sample_size, SWEEP_SEED, k) for k in ks]
+        workers = cpu_governor.pool_size(get_settings().analysis_sweep_workers, len(ks))
+        print(f"Sweeping K={k_min}..{max_k} on {min(sample_size, n_rows):,} rows with {workers} workers...")
+        
+        points = []
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+            futures = [pool.submit(_sweep_fit, *job) for job in jobs]
+            for done, future in enumerate(as_completed(futures), start=1):
+                point = future.result()
+                points.append(point)
+                task_events.report(task.task_id, "fit", done=done, total=len(ks), **point)
+                self._progress(task, 30 + int(60 * done / len(ks)), "sweep")
+        points.sort(key=lambda p: p['k'])
+        
+        sweep = KSweepResult(
+            cache_key=cache_key,
+            dataset_version=version,
+            task_id=task.task_id,
+            features_used=json.dumps(list(features)),
+            k_min=k_min,
+            k_max=max_k,
+            sample_size=min(sample_size, n_rows),
+            metrics=points,
+            recommended_k=max(points, key=lambda p: p['silhouette'])['k'],
+            elbow_k=_elbow_k([p['k'] for p in points], [p['inertia'] for p in points])
+        )
+        db.add(sweep)
+        db.commit()
+        return sweep
+
+
+def _sample_indices(n_rows: int, sample_size: int, seed: int) -> np.ndarray:
+    """Sorted indices of a seeded sample without replacement."""
+    if n_rows <= sample_size:
+        return np.arange(n_rows)
+    return np.sort(np.random.default_rng(seed).choice(n_rows, sample_size, replace=False))
+
+
+def _single_threaded():
+    """
+    Context of the pool workers' fits: parallelism comes from the pool, so
+    each worker keeps its BLAS / OpenMP thread pools to one thread.
+    """
+    return threadpool_limits(limits=1)
+
+
+def _sweep_fit(x_path: str, sample_size: int, seed: int, k: int) -> dict:
+    """Process pool worker: fit one K on the shared sample and score it."""
+    X = np.load(x_path, mmap_mode='r')
+    sample = np.asarray(X[_sample_indices(len(X), sample_size, seed)], dtype=np.float64)
+    
+    with _single_threaded():
+        start = time.perf_counter()
+        kmeans = KMeans(n_clusters=k, random_state=42, n_init=10).fit(sample)
+        fit_seconds = time.perf_counter() - start
+        labels = kmeans.labels_
+        silhouette = silhouette_score(
+            sample, labels, sample_size=min(SILHOUETTE_SAMPLE_SIZE, len(sample)), random_state=seed
+        )
+    
+    return {
+        'k': k,
+        'inertia': float(kmeans.inertia_),
+        'silhouette': float(silhouette),
+        'calinski_harabasz': float(calinski_harabasz_score(sample, labels)),
+        'davies_bouldin': float(davies_bouldin_score(sample, labels)),
+        'fit_seconds': round(fit_seconds, 3)
+    }
+
+
+def _segment_fit(x_path: str, indices: np.ndarray, k_min: int, max_k: int, sample_size: int,
+                 seed: int, params: dict) -> dict:
+    """
+    Process pool worker: pick K for one segment by silhouette on a seeded
+    sample, fit it on every row of the segment and score it.
+    """
+    X = np.load(x_path, mmap_mode='r')
+    rows = np.asarray(X[indices], dtype=np.float64)
+    sample = rows[_sample_indices(len(rows), sample_size, seed)]
+    
+    with _single_threaded():
+        start = time.perf_counter()
+        k_scores = {}
+        for k in range(k_min, min(max_k, len(sample) - 1) + 1):
+            labels = KMeans(n_clusters=k, random_state=42, n_init=4).fit_predict(sample)
+            k_scores[k] = round(float(silhouette_score(
+                sample, labels, sample_size=min(SILHOUETTE_SAMPLE_SIZE, len(sample)), random_state=seed
+            )), 4)
+        k = max(k_scores, key=k_scores.get)
+        kmeans = KMeans(n_clusters=k, random_state=42, n_init=10).fit(rows)
+        quality = cluster_metrics.quality_metrics(rows, kmeans.labels_, k, params, workers=1)
+        fit_seconds = time.perf_counter() - start
+    
+    return {
+        'rows': len(rows),
+        'k': int(k),
+        'k_scores': {str(k): score for k, score in k_scores.items()},
+        'labels': kmeans.labels_,
+        'inertia': float(kmeans.inertia_),
+        'centroids': kmeans.cluster_centers_,
+        'quality': quality,
+        'fit_seconds': round(fit_seconds, 3),
+    }
+
+
+def _stability_fit(x_path: str, k: int, sample_size: int, seed: Optional[int], eval_idx: np.ndarray) -> dict:
+    """
+    Process pool worker: fit K-Means on a bootstrap resample drawn with `seed`
+    (seed None: all rows, random_state 42 as in clustering tasks) and label
+    the evaluation rows by nearest centroid.
+    """
+    X = np.load(x_path, mmap_mode='r')
+    
+    with _single_threaded():
+        start = time.perf_counter()
+        if seed is None:
+            kmeans = KMeans(n_clusters=k, random_state=42, n_init=10).fit(np.asarray(X, dtype=np.float64))
+        else:
+            idx = np.sort(np.random.default_rng(seed).integers(0, len(X), sample_size))
+            kmeans = KMeans(n_clusters=k, random_state=seed, n_init=10).fit(np.asarray(X[idx], dtype=np.float64))
+        labels = kmeans.predict(np.asarray(X[eval_idx], dtype=np.float64))
+        fit_seconds = time.perf_counter() - start
+    
+    return {
+        'seed': seed,
+        'labels': labels.astype(np.int16),
+        'inertia': float(kmeans.inertia_),
+        'fit_seconds': round(fit_seconds, 3),
+    }
+
 
-    def determine_optimal_k(self, db: Session, max_k: int = 10):
-        """Compute Inertia for K=1 to max_k to help find Elbow."""
-        # Logic similar to clustering but loop K and return inertia list
-        pass # To be implemented if creating a dedicated "suggest K" API endpoint
+def _elbow_k(ks, inertias) -> Optional[int]:
+    """Knee of a decreasing inertia curve: farthest point below the first-last chord."""
+    if len(ks) < 3:
+        return None
+    x = np.asarray(ks, dtype=float)
+    y = np.asarray(inertias, dtype=float)
+    x = (x - x[0]) / (x[-1] - x[0])
+    span = y[0] - y[-1]
+    if span <= 0:
+        return None
+    y = (y - y[-1]) / span
+    return int(ks[int(np.argmax((1 - x) - y))])
 
 analysis_service = AnalysisService()
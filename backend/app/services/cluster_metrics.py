@@ -0,0 +1,192 @@
+"""
+Cluster quality metrics.
+
+Silhouette is O(n²), so it is estimated on repeated seeded subsamples,
+stratified by cluster (proportional allocation, at least MIN_PER_CLUSTER rows
+per cluster), scored in parallel and reported as a mean with a 95% confidence
+interval. Centroid-based metrics are O(n·k) and computed on the full
+population: simplified silhouette (distance to the own centroid vs. the
+nearest other centroid), Davies-Bouldin and Calinski-Harabasz.
+
+Results are stored in ClusterResult.quality_metrics.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import numpy as np
+from scipy import stats
+from sklearn.metrics import silhouette_score
+
+from ..config import get_settings
+from . import cpu_governor
+
+SILHOUETTE_REPEATS = 5
+SILHOUETTE_SAMPLE_SIZE = 4000
+MIN_PER_CLUSTER = 20
+METRICS_SEED = 42
+
+# Rows per chunk of the O(n·k) pass (bounds the n x k distance matrix)
+CHUNK_SIZE = 100000
+
+
+def stratified_sample(labels: np.ndarray, size: int, seed: int) -> np.ndarray:
+    """
+    Sorted indices of a seeded sample with each cluster represented in
+    proportion to its size (and at least MIN_PER_CLUSTER rows where possible).
+    """
+    labels = np.asarray(labels)
+    if len(labels) <= size:
+        return np.arange(len(labels))
+    rng = np.random.default_rng(seed)
+    order = np.argsort(labels, kind='stable')
+    clusters, starts, counts = np.unique(labels[order], return_index=True, return_counts=True)
+    allocation = np.minimum(counts, np.maximum(MIN_PER_CLUSTER, np.round(size * counts / len(labels)).astype(int)))
+    picked = [
+        order[start + rng.choice(count, n, replace=False)]
+        for start, count, n in zip(starts, counts, allocation)
+    ]
+    return np.sort(np.concatenate(picked))
+
+
+def sampled_silhouette(X, labels, repeats: int = SILHOUETTE_REPEATS,
+                       sample_size: int = SILHOUETTE_SAMPLE_SIZE, seed: int = METRICS_SEED,
+                       workers: Optional[int] = None) -> dict:
+    """
+    Silhouette over `repeats` stratified subsamples scored in parallel.
+
+    Returns:
+        dict: mean, std, ci95 (t-interval of the mean), per-repeat scores,
+            repeats, sample_size and seed
+    """
+    labels = np.asarray(labels)
+
+    def score(repeat):
+        idx = stratified_sample(labels, sample_size, seed + repeat)
+        return float(silhouette_score(np.asarray(X[idx], dtype=np.float64), labels[idx]))
+
+    workers = workers or cpu_governor.pool_size(get_settings().analysis_sweep_workers)
+    # Pairwise distance work runs in NumPy/BLAS and releases the GIL
+    with ThreadPoolExecutor(max_workers=min(workers, repeats)) as pool:
+        scores = np.array(list(pool.map(score, range(repeats))))
+
+    mean = float(scores.mean())
+    std = float(scores.std(ddof=1)) if repeats > 1 else 0.0
+    half_width = float(stats.t.ppf(0.975, repeats - 1) * std / np.sqrt(repeats)) if repeats > 1 else 0.0
+    return {
+        'mean': mean,
+        'std': std,
+        'ci95': [mean - half_width, mean + half_width],
+        'scores': scores.round(6).tolist(),
+        'repeats': repeats,
+        'sample_size': int(min(sample_size, len(labels))),
+        'seed': seed,
+    }
+
+
+class CentroidMetrics:
+    """
+    Accumulates O(n·k) centroid-based metrics over chunks of (X, labels).
+
+    Centroids are fixed up front: cluster means for an in-memory population,
+    the fitted centers when streaming. Calinski-Harabasz uses the exact
+    cluster means from the accumulated sums either way.
+    """
+
+    def __init__(self, centroids):
+        self.centroids = np.asarray(centroids, dtype=np.float64)
+        k, d = self.centroids.shape
+        self.counts = np.zeros(k, dtype=np.int64)
+        self.sums = np.zeros((k, d))
+        self.square_sums = np.zeros(k)
+        self.distance_sums = np.zeros(k)
+        self.simplified_silhouette_sum = 0.0
+
+    def update(self, X, labels):
+        X = np.asarray(X, dtype=np.float64)
+        k = len(self.centroids)
+        sq = (X ** 2).sum(axis=1)[:, None] - 2 * X @ self.centroids.T + (self.centroids ** 2).sum(axis=1)
+        distances = np.sqrt(np.maximum(sq, 0))
+        rows = np.arange(len(X))
+        a = distances[rows, labels]
+        distances[rows, labels] = np.inf
+        b = distances.min(axis=1) if k > 1 else a
+        denominator = np.maximum(a, b)
+        self.simplified_silhouette_sum += float(np.divide(b - a, denominator, out=np.zeros_like(a), where=denominator > 0).sum())
+
+        self.counts += np.bincount(labels, minlength=k)
+        self.distance_sums += np.bincount(labels, weights=a, minlength=k)
+        self.square_sums += np.bincount(labels, weights=(X ** 2).sum(axis=1), minlength=k)
+        for j in range(X.shape[1]):
+            self.sums[:, j] += np.bincount(labels, weights=X[:, j], minlength=k)
+
+    def result(self) -> dict:
+        present = self.counts > 0
+        counts = self.counts[present]
+        n, k = int(counts.sum()), int(present.sum())
+        means = self.sums[present] / counts[:, None]
+        global_mean = self.sums[present].sum(axis=0) / n
+
+        within = float((self.square_sums[present] - (self.sums[present] ** 2).sum(axis=1) / counts).sum())
+        between = float((counts * ((means - global_mean) ** 2).sum(axis=1)).sum())
+        calinski_harabasz = between * (n - k) / (within * (k - 1)) if k > 1 and within > 0 else None
+
+        # Davies-Bouldin: mean over clusters of max_j (S_i + S_j) / d(c_i, c_j)
+        scatter = self.distance_sums[present] / counts
+        centroids = self.centroids[present]
+        separation = np.sqrt(((centroids[:, None, :] - centroids[None, :, :]) ** 2).sum(axis=2))
+        np.fill_diagonal(separation, np.inf)
+        davies_bouldin = float(((scatter[:, None] + scatter[None, :]) / separation).max(axis=1).mean()) if k > 1 else None
+
+        return {
+            'simplified_silhouette': self.simplified_silhouette_sum / n,
+            'davies_bouldin': davies_bouldin,
+            'calinski_harabasz': calinski_harabasz,
+            'population': n,
+        }
+
+
+def centroid_metrics(X, labels, n_clusters: int) -> dict:
+    """Centroid-based metrics over a full in-memory population, centroids = cluster means."""
+    labels = np.asarray(labels)
+    counts = np.bincount(labels, minlength=n_clusters)
+    sums = np.zeros((n_clusters, X.shape[1]))
+    for start in range(0, len(X), CHUNK_SIZE):
+        chunk = np.asarray(X[start:start + CHUNK_SIZE], dtype=np.float64)
+        chunk_labels = labels[start:start + CHUNK_SIZE]
+        for j in range(X.shape[1]):
+            sums[:, j] += np.bincount(chunk_labels, weights=chunk[:, j], minlength=n_clusters)
+    means = sums / np.maximum(counts, 1)[:, None]
+
+    accumulator = CentroidMetrics(means)
+    for start in range(0, len(X), CHUNK_SIZE):
+        accumulator.update(X[start:start + CHUNK_SIZE], labels[start:start + CHUNK_SIZE])
+    return accumulator.result()
+
+
+def quality_metrics(X, labels, n_clusters: int, params: dict, population: Optional[dict] = None,
+                    workers: Optional[int] = None) -> dict:
+    """
+    All quality metrics of a clustering.
+
+    Args:
+        X, labels: Scaled rows and labels the silhouette is sampled from
+            (the full population, or a sample pool when streaming)
+        n_clusters: Number of clusters
+        params: Task parameters; silhouette_repeats / silhouette_sample_size override the defaults
+        population: Centroid metrics already accumulated over the population
+            (streaming); computed from X otherwise
+        workers: Threads scoring silhouette repeats (default: the task's cores)
+
+    Returns:
+        dict: silhouette (sampled, with CI) plus the centroid-based metrics
+    """
+    silhouette = sampled_silhouette(
+        X, labels,
+        repeats=int(params.get('silhouette_repeats', SILHOUETTE_REPEATS)),
+        sample_size=int(params.get('silhouette_sample_size', SILHOUETTE_SAMPLE_SIZE)),
+        workers=workers,
+    )
+    silhouette['stratified'] = True
+    silhouette['pool_size'] = len(labels)
+    metrics = population or centroid_metrics(X, labels, n_clusters)
+    return {'silhouette': silhouette, **metrics}
@@ -0,0 +1,161 @@
+"""
+Persisted clustering models.
+
+A ClusterResult keeps the fitted preprocessing (log-transformed features,
+StandardScaler means and scales) and the centroids in model_params, so doctors
+can be assigned to its clusters without refitting: transform the raw features
+the same way and pick the nearest centroid. Used by the predict API and by the
+ETL to place new or changed doctors into the current result.
+"""
+from datetime import date
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy.orm import Session
+
+from ..models import ClusterResult, Doctor
+from . import rfm_window
+from .cluster_result_service import cluster_result_service
+from .payment_mix import payment_mix_store
+
+# NPIs per IN (...) query; SQLite binds at most 32766 parameters per statement
+NPI_BATCH_SIZE = 30000
+
+
+class ClusterModel:
+    """
+    Nearest-centroid model in scaled feature space.
+
+    Attributes:
+        features: Feature names, in model column order
+        log_features: Features log1p-transformed before scaling
+        mean, scale: StandardScaler statistics
+        centroids: (k, n_features) cluster centers in scaled space
+        window: RFM window parameters if the result was fitted on one, else None
+    """
+
+    def __init__(self, features: List[str], log_features: List[str], mean, scale, centroids,
+                 window: Optional[dict] = None):
+        self.features = list(features)
+        self.log_features = list(log_features)
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.scale = np.asarray(scale, dtype=np.float64)
+        self.centroids = np.asarray(centroids, dtype=np.float64)
+        self.window = window
+        self._log_mask = np.array([f in self.log_features for f in self.features])
+        self._centroid_norms = (self.centroids ** 2).sum(axis=1)
+
+    @classmethod
+    def from_params(cls, params: dict) -> "ClusterModel":
+        return cls(
+            params['features'], params['log_features'], params['scaler_mean'],
+            params['scaler_scale'], params['centroids'], params.get('window')
+        )
+
+    def to_params(self) -> dict:
+        """JSON-serializable form stored in ClusterResult.model_params."""
+        return {
+            'features': self.features,
+            'log_features': self.log_features,
+            'scaler_mean': self.mean.tolist(),
+            'scaler_scale': self.scale.tolist(),
+            'centroids': self.centroids.tolist(),
+            'window': self.window
+        }
+
+    def transform(self, raw: np.ndarray) -> np.ndarray:
+        """Raw (n, n_features) values -> scaled model space."""
+        X = np.array(raw, dtype=np.float64, ndmin=2)
+        X[:, self._log_mask] = np.log1p(X[:, self._log_mask])
+        return (X - self.mean) / self.scale
+
+    def predict(self, raw: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Nearest centroid of each row.
+
+        Returns:
+            (labels, distances): int labels and Euclidean distances in scaled space
+        """
+        X = self.transform(raw)
+        # ||x - c||^2 = ||x||^2 - 2 x.c + ||c||^2, one matrix product for all rows
+        sq = (X ** 2).sum(axis=1)[:, None] - 2 * X @ self.centroids.T + self._centroid_norms
+        labels = sq.argmin(axis=1)
+        distances = np.sqrt(np.maximum(sq[np.arange(len(X)), labels], 0))
+        return labels, distances
+
+
+_models: Dict[int, ClusterModel] = {}
+_models_lock = Lock()
+
+
+def get_model(db: Session, result_id: int) -> Optional[ClusterModel]:
+    """
+    Model of a result, or None if the result has no persisted model.
+    Results are immutable, so models are cached per process.
+    """
+    with _models_lock:
+        model = _models.get(result_id)
+    if model is not None:
+        return model
+
+    params = db.query(ClusterResult.model_params)\
+        .filter(ClusterResult.cluster_id == result_id, ClusterResult.is_active == True)\
+        .scalar()
+    if not params:
+        return None
+    model = ClusterModel.from_params(params)
+    with _models_lock:
+        _models[result_id] = model
+    return model
+
+
+def load_doctor_features(db: Session, model: ClusterModel, npis: List[str]) -> pd.DataFrame:
+    """
+    Raw model features of the given doctors (npi + features, complete rows only),
+    from the doctors table (plus payment-mix components) or, for window
+    results, recomputed over the window.
+    """
+    if model.window:
+        def parse(name):
+            value = model.window.get(name)
+            return date.fromisoformat(value) if value else None
+        df = rfm_window.get_engine(db).compute(
+            parse('window_start'), parse('window_end'), parse('reference_date')
+        )
+        df = df[df['npi'].isin(set(npis))]
+    else:
+        columns = [Doctor.npi] + [getattr(Doctor, f) for f in model.features if hasattr(Doctor, f)]
+        rows = []
+        for start in range(0, len(npis), NPI_BATCH_SIZE):
+            rows += db.query(*columns).filter(Doctor.npi.in_(npis[start:start + NPI_BATCH_SIZE])).all()
+        df = pd.DataFrame(rows, columns=[column.key for column in columns])
+        df = payment_mix_store.attach(db, df, model.features)
+    return df[['npi'] + model.features].dropna()
+
+
+def assign_doctors(db: Session, npis: List[str], result_id: Optional[int] = None) -> int:
+    """
+    Assign doctors to the clusters of a result (default: the current one) with
+    a vectorized nearest-centroid pass, replacing their previous assignments.
+    Doctors with incomplete features are skipped. The caller commits.
+
+    Returns:
+        int: Number of doctors assigned (0 if there is no result with a model)
+    """
+    if result_id is None:
+        current = cluster_result_service.current_result(db)
+        if current is None:
+            return 0
+        result_id = current.cluster_id
+    model = get_model(db, result_id)
+    if model is None or not npis:
+        return 0
+
+    df = load_doctor_features(db, model, list(npis))
+    if df.empty:
+        return 0
+    labels, _ = model.predict(df[model.features].values)
+    cluster_result_service.write_assignments(db, result_id, df['npi'].values, labels, replace=True)
+    return len(df)
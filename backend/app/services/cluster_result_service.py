@@ -0,0 +1,129 @@
+"""
+Cluster Result Service for versioned cluster assignments.
+
+Every clustering run stores the cluster of each doctor under its own result id
+in cluster_assignments, and exactly one ClusterResult is current (is_current).
+Doctor cluster lookups and filters resolve through the current result (or an
+explicitly requested one), so switching results or rolling back to an earlier
+run is a single metadata update instead of a rewrite of the doctors table.
+"""
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from ..models import ClusterResult, ClusterAssignment, ClusterVizLevel
+
+
+class ClusterResultService:
+
+    def _result_id_expr(self, result_id: Optional[int]):
+        """The given result id, or a scalar subquery selecting the current result."""
+        if result_id is not None:
+            return result_id
+        return select(ClusterResult.cluster_id)\
+            .where(ClusterResult.is_current == True)\
+            .limit(1)\
+            .scalar_subquery()
+
+    def current_result(self, db: Session) -> Optional[ClusterResult]:
+        return db.query(ClusterResult).filter(ClusterResult.is_current == True).first()
+
+    def activate(self, db: Session, result_id: int) -> ClusterResult:
+        """
+        Make a result current. Only cluster_results rows are touched.
+        The caller commits.
+        """
+        result = db.query(ClusterResult)\
+            .filter(ClusterResult.cluster_id == result_id, ClusterResult.is_active == True)\
+            .first()
+        if not result:
+            raise ValueError(f"Cluster result {result_id} not found")
+        db.query(ClusterResult)\
+            .filter((ClusterResult.is_current == True) | (ClusterResult.cluster_id == result_id))\
+            .update({ClusterResult.is_current: ClusterResult.cluster_id == result_id}, synchronize_session=False)
+        db.expire(result, ["is_current"])
+        return result
+
+    def write_assignments(self, db: Session, result_id: int, npis, labels, replace: bool = False) -> float:
+        """
+        Store the cluster of each doctor for a result in one executemany.
+        Rows are inserted in primary key order; with replace, existing
+        assignments of these doctors are overwritten. The caller commits.
+
+        Returns:
+            float: Seconds spent writing
+        """
+        start = time.perf_counter()
+        npis = np.asarray(npis).astype('S10')
+        order = np.argsort(npis, kind='stable')
+        cursor = db.connection().connection.cursor()
+        try:
+            verb = "INSERT OR REPLACE" if replace else "INSERT"
+            cursor.executemany(
+                f"{verb} INTO cluster_assignments (result_id, npi, cluster) VALUES (?, ?, ?)",
+                zip(
+                    [result_id] * len(order),
+                    np.char.decode(npis[order], 'ascii').tolist(),
+                    np.asarray(labels)[order].tolist()
+                )
+            )
+        finally:
+            cursor.close()
+        return time.perf_counter() - start
+
+    def load_assignments(self, db: Session, result_id: int):
+        """
+        All assignments of a result in NPI order, read with a plain cursor.
+
+        Returns:
+            tuple: (npis as 'S10' array, clusters as int array)
+        """
+        cursor = db.connection().connection.cursor()
+        try:
+            cursor.execute(
+                "SELECT npi, cluster FROM cluster_assignments WHERE result_id = ? ORDER BY npi", (result_id,)
+            )
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+        if not rows:
+            return np.empty(0, dtype='S10'), np.empty(0, dtype=np.int64)
+        npis, clusters = zip(*rows)
+        return np.array(npis, dtype='S10'), np.array(clusters, dtype=np.int64)
+
+    def delete_result(self, db: Session, result_id: int):
+        """Hide a result and drop its assignments and visualization data. The caller commits."""
+        db.query(ClusterAssignment).filter(ClusterAssignment.result_id == result_id).delete(synchronize_session=False)
+        db.query(ClusterVizLevel).filter(ClusterVizLevel.result_id == result_id).delete(synchronize_session=False)
+        db.query(ClusterResult)\
+            .filter(ClusterResult.cluster_id == result_id)\
+            .update({"is_active": False, "is_current": False}, synchronize_session=False)
+
+    def cluster_members(self, cluster: int, result_id: Optional[int] = None):
+        """SELECT of the NPIs in a cluster of a result (default: the current one)."""
+        return select(ClusterAssignment.npi).where(
+            ClusterAssignment.result_id == self._result_id_expr(result_id),
+            ClusterAssignment.cluster == cluster
+        )
+
+    def cluster_of(self, npi_column, result_id: Optional[int] = None):
+        """Correlated scalar subquery: cluster of the doctor in npi_column."""
+        return select(ClusterAssignment.cluster).where(
+            ClusterAssignment.result_id == self._result_id_expr(result_id),
+            ClusterAssignment.npi == npi_column
+        ).scalar_subquery()
+
+    def clusters_for(self, db: Session, npis: List[str], result_id: Optional[int] = None) -> Dict[str, int]:
+        """Cluster of each of the given doctors; doctors outside the result are omitted."""
+        if not npis:
+            return {}
+        rows = db.query(ClusterAssignment.npi, ClusterAssignment.cluster).filter(
+            ClusterAssignment.result_id == self._result_id_expr(result_id),
+            ClusterAssignment.npi.in_(npis)
+        ).all()
+        return dict(rows)
+
+cluster_result_service = ClusterResultService()
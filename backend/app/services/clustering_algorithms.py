@@ -0,0 +1,309 @@
+"""
+Clustering algorithm registry.
+
+perform_clustering looks the `algorithm` task parameter up in ALGORITHMS.
+In-memory algorithms fit the scaled feature matrix (from the feature cache)
+and label every row 0..n_clusters-1; streaming ones (minibatch-kmeans) are
+run by analysis_service over database batches instead. Each algorithm
+declares how it scales; measured numbers come from
+scripts/benchmark_clustering.py (see scripts/README.md).
+"""
+import warnings
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, Optional
+
+import numpy as np
+from sklearn.cluster import KMeans, Birch, DBSCAN, HDBSCAN
+from sklearn.exceptions import ConvergenceWarning
+from sklearn.mixture import GaussianMixture
+from sklearn.neighbors import NearestNeighbors
+
+# report(fraction_done, **event_fields), see task_events "fit" events
+Reporter = Callable[..., None]
+
+# Rows per predict / assignment chunk (bounds temporary memory, paces progress events)
+ASSIGN_CHUNK_SIZE = 50000
+
+# Density algorithms: rows the density model is fitted on, and the most
+# clusters a result may have before the parameters are considered wrong
+DENSITY_SAMPLE_SIZE = 20000
+MAX_DENSITY_CLUSTERS = 20
+
+
+class FitOutput:
+    """
+    Labels of every row plus what the fit knows about its clusters.
+
+    Attributes:
+        labels: Cluster of each row, 0..n_clusters-1
+        n_clusters: Number of clusters
+        inertia: Within-cluster sum of squares in scaled space
+        centroids: (n_clusters, n_features) centers if labels are nearest-centroid
+            assignments (persisted as a ClusterModel), else None
+        detail: Algorithm-specific facts for progress_detail
+    """
+
+    def __init__(self, labels, n_clusters: int, inertia: float,
+                 centroids: Optional[np.ndarray] = None, detail: Optional[dict] = None):
+        self.labels = labels
+        self.n_clusters = n_clusters
+        self.inertia = inertia
+        self.centroids = centroids
+        self.detail = detail or {}
+
+
+def within_cluster_ss(X, labels, n_clusters: int) -> float:
+    """Sum of squared distances of rows to the mean of their cluster."""
+    X = np.asarray(X, dtype=np.float64)
+    counts = np.bincount(labels, minlength=n_clusters)
+    total = 0.0
+    for j in range(X.shape[1]):
+        sums = np.bincount(labels, weights=X[:, j], minlength=n_clusters)
+        squares = np.bincount(labels, weights=X[:, j] ** 2, minlength=n_clusters)
+        present = counts > 0
+        total += float((squares[present] - sums[present] ** 2 / counts[present]).sum())
+    return total
+
+
+class ClusteringAlgorithm(ABC):
+    """Base class: registry metadata plus fit()."""
+
+    name = ""
+    label = ""
+    scaling = ""
+    # Fitted by analysis_service over database batches instead of fit()
+    streaming = False
+    # Whether the k parameter sets the number of clusters
+    uses_k = True
+    # Labels are nearest-centroid assignments, persisted as a ClusterModel
+    centroid_model = False
+
+    @abstractmethod
+    def fit(self, X, k: int, params: dict, report: Reporter) -> FitOutput:
+        """Cluster the scaled feature matrix X (rows x features)."""
+
+    def describe(self) -> dict:
+        return {
+            "name": self.name,
+            "label": self.label,
+            "scaling": self.scaling,
+            "streaming": self.streaming,
+            "uses_k": self.uses_k,
+            "centroid_model": self.centroid_model,
+        }
+
+
+class KMeansAlgorithm(ClusteringAlgorithm):
+    name = "k-means"
+    label = "K-Means"
+    scaling = "O(n·k·d·iterations·n_init) time, full feature matrix in memory"
+    centroid_model = True
+
+    N_INIT = 10
+
+    def fit(self, X, k, params, report):
+        # The n_init runs are fitted one at a time to report each one. Sharing
+        # one RandomState gives the same inits as KMeans(n_init=N_INIT, random_state=42).
+        random_state = np.random.RandomState(42)
+        best = None
+        for run in range(1, self.N_INIT + 1):
+            candidate = KMeans(
+                n_clusters=k,
+                random_state=random_state,
+                n_init=1,
+                max_iter=300
+            ).fit(X)
+            if best is None or candidate.inertia_ < best.inertia_:
+                best = candidate
+            report(
+                run / self.N_INIT, run=run, n_init=self.N_INIT,
+                n_iter=int(candidate.n_iter_), inertia=float(candidate.inertia_),
+                best_inertia=float(best.inertia_)
+            )
+        return FitOutput(best.labels_, k, float(best.inertia_), best.cluster_centers_)
+
+
+class MiniBatchKMeansAlgorithm(ClusteringAlgorithm):
+    name = "minibatch-kmeans"
+    label = "MiniBatch K-Means (streaming)"
+    scaling = "O(n·k·d·epochs) time, O(batch_size·d) memory; streams from the database"
+    streaming = True
+    centroid_model = True
+
+    def fit(self, X, k, params, report):
+        raise TypeError(
+            f"{self.name} streams from the database and has no in-memory fit; "
+            "it is run by AnalysisService._fit_minibatch_streaming"
+        )
+
+
+class GaussianMixtureAlgorithm(ClusteringAlgorithm):
+    name = "gmm"
+    label = "Gaussian Mixture"
+    scaling = "O(n·k·d²) per EM iteration, O(n·k) memory for responsibilities; elliptical clusters"
+
+    MAX_ITER = 100
+    # EM iterations between progress reports (fitted with warm_start)
+    REPORT_EVERY = 10
+
+    def fit(self, X, k, params, report):
+        gmm = GaussianMixture(
+            n_components=k,
+            covariance_type=params.get('covariance_type', 'full'),
+            max_iter=self.REPORT_EVERY,
+            warm_start=True,
+            random_state=42
+        )
+        iterations = 0
+        with warnings.catch_warnings():
+            # Each warm-started chunk of iterations "fails" to converge until the last
+            warnings.simplefilter('ignore', ConvergenceWarning)
+            while iterations < self.MAX_ITER:
+                gmm.fit(X)
+                iterations += gmm.n_iter_
+                report(
+                    min(1.0, iterations / self.MAX_ITER), n_iter=iterations,
+                    lower_bound=float(gmm.lower_bound_), converged=bool(gmm.converged_)
+                )
+                if gmm.converged_:
+                    break
+
+        labels = np.concatenate([
+            gmm.predict(X[start:start + ASSIGN_CHUNK_SIZE])
+            for start in range(0, len(X), ASSIGN_CHUNK_SIZE)
+        ])
+        return FitOutput(
+            labels, k, within_cluster_ss(X, labels, k),
+            detail={'n_iter': iterations, 'converged': bool(gmm.converged_),
+                    'lower_bound': float(gmm.lower_bound_)}
+        )
+
+
+class BirchAlgorithm(ClusteringAlgorithm):
+    name = "birch"
+    label = "BIRCH"
+    scaling = "single pass, O(n·log m) time for m subclusters; memory bounded by the CF-tree (threshold)"
+
+    # Subcluster radius in scaled space; smaller keeps more subclusters
+    DEFAULT_THRESHOLD = 0.5
+
+    def fit(self, X, k, params, report):
+        birch = Birch(
+            threshold=float(params.get('threshold', self.DEFAULT_THRESHOLD)),
+            branching_factor=int(params.get('branching_factor', 50)),
+            n_clusters=None
+        )
+        # Pass 1: build the CF-tree, one chunk at a time
+        for start in range(0, len(X), ASSIGN_CHUNK_SIZE):
+            birch.partial_fit(X[start:start + ASSIGN_CHUNK_SIZE])
+            done = min(len(X), start + ASSIGN_CHUNK_SIZE)
+            report(0.5 * done / len(X), rows=done, subclusters=len(birch.subcluster_centers_))
+
+        # Global step: agglomerate the subclusters into k clusters
+        n_subclusters = len(birch.subcluster_centers_)
+        if n_subclusters < k:
+            raise ValueError(f"BIRCH found {n_subclusters} subclusters for K={k}; lower the threshold")
+        birch.set_params(n_clusters=k)
+        birch.partial_fit()
+
+        labels = []
+        for start in range(0, len(X), ASSIGN_CHUNK_SIZE):
+            labels.append(birch.predict(X[start:start + ASSIGN_CHUNK_SIZE]))
+            done = min(len(X), start + ASSIGN_CHUNK_SIZE)
+            report(0.5 + 0.5 * done / len(X), rows=done, subclusters=n_subclusters)
+        labels = np.concatenate(labels)
+        return FitOutput(labels, k, within_cluster_ss(X, labels, k), detail={'subclusters': n_subclusters})
+
+
+class DensitySampleAlgorithm(ClusteringAlgorithm):
+    """
+    Sample-then-assign: fit a density model on a seeded sample, then give
+    every row the cluster of its nearest non-noise sample point. All rows,
+    including sample noise, end up in a cluster.
+    """
+
+    uses_k = False
+
+    @abstractmethod
+    def _fit_sample(self, sample, params) -> np.ndarray:
+        """Labels of the sample rows, -1 for noise."""
+
+    def fit(self, X, k, params, report):
+        sample_size = int(params.get('sample_size', DENSITY_SAMPLE_SIZE))
+        rng = np.random.default_rng(42)
+        idx = np.sort(rng.choice(len(X), sample_size, replace=False)) if len(X) > sample_size else np.arange(len(X))
+        sample = np.asarray(X[idx], dtype=np.float64)
+
+        sample_labels = self._fit_sample(sample, params)
+        core = sample_labels >= 0
+        n_clusters = int(sample_labels.max()) + 1 if core.any() else 0
+        report(0.3, sample_size=len(sample), n_clusters=n_clusters, noise_fraction=float(1 - core.mean()))
+        if n_clusters < 2:
+            raise ValueError(f"{self.label} found {n_clusters} clusters on the sample; adjust its parameters")
+        if n_clusters > MAX_DENSITY_CLUSTERS:
+            raise ValueError(
+                f"{self.label} found {n_clusters} clusters (max {MAX_DENSITY_CLUSTERS}); adjust its parameters"
+            )
+
+        # Assign every row to its nearest clustered sample point
+        neighbors = NearestNeighbors(n_neighbors=1).fit(sample[core])
+        core_labels = sample_labels[core]
+        labels = []
+        for start in range(0, len(X), ASSIGN_CHUNK_SIZE):
+            _, nearest = neighbors.kneighbors(X[start:start + ASSIGN_CHUNK_SIZE])
+            labels.append(core_labels[nearest[:, 0]])
+            done = min(len(X), start + ASSIGN_CHUNK_SIZE)
+            report(0.3 + 0.7 * done / len(X), rows=done)
+        labels = np.concatenate(labels)
+        return FitOutput(
+            labels, n_clusters, within_cluster_ss(X, labels, n_clusters),
+            detail={'sample_size': len(sample), 'sample_noise_fraction': round(float(1 - core.mean()), 4)}
+        )
+
+
+class HDBSCANAlgorithm(DensitySampleAlgorithm):
+    name = "hdbscan"
+    label = "HDBSCAN (sample + assign)"
+    scaling = "O(s log s) on an s-row sample (low dimensions), then O(n log s) nearest-neighbour assignment"
+
+    def _fit_sample(self, sample, params):
+        min_cluster_size = int(params.get('min_cluster_size', max(50, len(sample) // 100)))
+        # min_samples defaults to min_cluster_size in HDBSCAN, which marks most
+        # of a smooth RFM distribution as noise
+        return HDBSCAN(
+            min_cluster_size=min_cluster_size,
+            min_samples=int(params.get('min_samples', 10)),
+            copy=True
+        ).fit_predict(sample)
+
+
+class DBSCANAlgorithm(DensitySampleAlgorithm):
+    name = "dbscan"
+    label = "DBSCAN (sample + assign)"
+    scaling = "O(s log s) to O(s²) on an s-row sample depending on eps, then O(n log s) assignment"
+
+    def _fit_sample(self, sample, params):
+        return DBSCAN(
+            eps=float(params.get('eps', 0.3)),
+            min_samples=int(params.get('min_samples', 20))
+        ).fit_predict(sample)
+
+
+ALGORITHMS: Dict[str, ClusteringAlgorithm] = {
+    algorithm.name: algorithm
+    for algorithm in (
+        KMeansAlgorithm(),
+        MiniBatchKMeansAlgorithm(),
+        GaussianMixtureAlgorithm(),
+        BirchAlgorithm(),
+        HDBSCANAlgorithm(),
+        DBSCANAlgorithm(),
+    )
+}
+
+
+def get_algorithm(name: str) -> ClusteringAlgorithm:
+    algorithm = ALGORITHMS.get(name)
+    if algorithm is None:
+        raise ValueError(f"Unknown clustering algorithm: {name}")
+    return algorithm
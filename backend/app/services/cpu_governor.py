@@ -0,0 +1,91 @@
+"""
+CPU governance of analysis work on the API host.
+
+BLAS (NumPy/SciPy) and OpenMP (scikit-learn) default to one thread per core,
+so a single clustering would occupy every core, including the ones serving
+API requests. Analysis tasks therefore share a CPU budget:
+
+- analysis_cpu_budget cores (0 = all cores but analysis_reserved_cores) are
+  shared by the running tasks; the dispatcher grants a task
+  analysis_task_threads cores (0 = budget / analysis_max_workers), or what is
+  left of the budget, and keeps tasks pending while it is used up
+- a worker process applies its grant before running the task: BLAS/OpenMP
+  pools are capped with threadpoolctl, *_NUM_THREADS is set for processes it
+  spawns, its priority is lowered by analysis_worker_nice and, with
+  analysis_pin_workers, it is pinned to the cores not reserved for the API
+- process and thread pools inside a task are sized with pool_size()
+"""
+import os
+from typing import Dict, List, Optional
+
+from threadpoolctl import threadpool_limits
+
+from ..config import get_settings
+
+# Read by OpenBLAS / MKL / OpenMP when a (pool) process starts
+THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS')
+
+# Worker side: set by apply_worker_limits()
+_granted: Optional[int] = None
+_limiter = None
+
+
+def available_cores() -> List[int]:
+    """Cores this process may run on."""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+class CpuBudget:
+    """Cores granted to running tasks; used by the task runner's dispatcher thread."""
+
+    def __init__(self):
+        settings = get_settings()
+        cores = len(available_cores())
+        self.total = settings.analysis_cpu_budget or max(1, cores - settings.analysis_reserved_cores)
+        self.per_task = settings.analysis_task_threads or max(1, self.total // max(1, settings.analysis_max_workers))
+        self._grants: Dict[int, int] = {}
+
+    def grant(self, task_id: int) -> int:
+        """Cores for a task, 0 if the budget is used up."""
+        threads = min(self.per_task, self.total - sum(self._grants.values()))
+        if threads <= 0:
+            return 0
+        self._grants[task_id] = threads
+        return threads
+
+    def release(self, task_id: int):
+        self._grants.pop(task_id, None)
+
+
+def apply_worker_limits(threads: int):
+    """Confine the current (worker) process to a grant of `threads` cores."""
+    global _granted, _limiter
+    settings = get_settings()
+
+    for name in THREAD_ENV_VARS:
+        os.environ[name] = str(threads)
+    _limiter = threadpool_limits(limits=threads)
+
+    if settings.analysis_worker_nice and hasattr(os, 'nice'):
+        os.nice(settings.analysis_worker_nice)
+    if settings.analysis_pin_workers and hasattr(os, 'sched_setaffinity'):
+        cores = available_cores()[settings.analysis_reserved_cores:]
+        if cores:
+            os.sched_setaffinity(0, cores)
+    _granted = threads
+
+
+def granted_threads() -> int:
+    """Cores granted to this worker process (all cores outside a worker)."""
+    return _granted or len(available_cores())
+
+
+def pool_size(configured: int = 0, jobs: Optional[int] = None) -> int:
+    """
+    Workers of a process / thread pool inside a task: the configured size
+    (0 = the grant), capped by the grant and the number of jobs.
+    """
+    size = min(configured or granted_threads(), granted_threads())
+    return max(1, min(size, jobs) if jobs else size)
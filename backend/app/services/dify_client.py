@@ -0,0 +1,214 @@
+"""
+Async Dify API client.
+
+One httpx.AsyncClient per API process (per event loop) keeps connections to
+Dify alive across reports instead of a new TLS handshake per call, and LLM
+calls wait on the event loop instead of occupying a threadpool thread.
+
+- dify_max_concurrency bounds in-flight requests (further calls queue on a
+  semaphore), dify_max_connections bounds the connection pool
+- dify_timeout / dify_connect_timeout apply per request attempt
+- 429, 5xx and connection errors / timeouts are retried up to
+  dify_max_retries times with full-jitter exponential backoff
+  (uniform(0, min(dify_retry_backoff_max, dify_retry_backoff · 2^attempt)));
+  a Retry-After header on 429/503 is honored as the minimum wait
+- streaming completions (completion_stream) yield Dify's SSE events as they
+  arrive; they are retried like the above only until the first event, since
+  chunks already relayed can't be taken back
+- calls given a `timing` dict fill it with their stages in seconds:
+  queue_wait (for a concurrency slot), ttfb (response headers of the last
+  attempt), first_event (streaming: first event of the last attempt), http
+  (from the slot to the end of the response, retries included), attempts
+  and retry_wait (backoff sleeps)
+"""
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+from typing import AsyncIterator, Optional
+
+import httpx
+
+from ..config import get_settings
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class DifyError(Exception):
+    """A Dify request failed after all retries (or with a non-retryable status)."""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class DifyClient:
+
+    def __init__(self):
+        settings = get_settings()
+        self.api_key = settings.dify_api_key
+        self.api_url = settings.dify_api_url.rstrip('/')
+        self.max_concurrency = settings.dify_max_concurrency
+        self.max_retries = settings.dify_max_retries
+        self.backoff = settings.dify_retry_backoff
+        self.backoff_max = settings.dify_retry_backoff_max
+        self.timeout = httpx.Timeout(settings.dify_timeout, connect=settings.dify_connect_timeout)
+        self.limits = httpx.Limits(
+            max_connections=settings.dify_max_connections,
+            max_keepalive_connections=settings.dify_max_connections
+        )
+        # requests, retries, failures
+        self.stats = Counter()
+
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop = None
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.api_key and self.api_url)
+
+    def _session(self):
+        """(client, semaphore) of the running event loop, created on first use."""
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            self._client = httpx.AsyncClient(
+                base_url=self.api_url,
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                timeout=self.timeout,
+                limits=self.limits
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._loop = loop
+        return self._client, self._semaphore
+
+    async def aclose(self):
+        """Close pooled connections (API shutdown)."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _retry_delay(self, attempt: int, response: Optional[httpx.Response]) -> float:
+        delay = random.uniform(0, min(self.backoff_max, self.backoff * 2 ** attempt))
+        if response is not None and response.headers.get("Retry-After", "").isdigit():
+            delay = max(delay, float(response.headers["Retry-After"]))
+        return delay
+
+    async def _backoff(self, attempt: int, response: Optional[httpx.Response], timing: dict):
+        self.stats['retries'] += 1
+        delay = self._retry_delay(attempt, response)
+        timing['retry_wait'] += delay
+        await asyncio.sleep(delay)
+
+    async def post(self, path: str, payload: dict, timing: Optional[dict] = None) -> dict:
+        """POST a JSON payload and return the JSON response, retrying transient failures."""
+        client, semaphore = self._session()
+        timing = {} if timing is None else timing
+        queued = time.perf_counter()
+        async with semaphore:
+            acquired = time.perf_counter()
+            timing.update(queue_wait=acquired - queued, attempts=0, retry_wait=0.0)
+            try:
+                for attempt in range(self.max_retries + 1):
+                    self.stats['requests'] += 1
+                    timing['attempts'] += 1
+                    response = None
+                    try:
+                        sent = time.perf_counter()
+                        async with client.stream("POST", path, json=payload) as response:
+                            timing['ttfb'] = time.perf_counter() - sent
+                            await response.aread()
+                        if response.status_code not in RETRY_STATUSES:
+                            response.raise_for_status()
+                            return response.json()
+                        error = DifyError(f"Dify returned HTTP {response.status_code}", response.status_code)
+                    except httpx.HTTPStatusError as e:
+                        self.stats['failures'] += 1
+                        raise DifyError(f"Dify returned HTTP {e.response.status_code}", e.response.status_code) from e
+                    except httpx.TransportError as e:
+                        error = DifyError(f"Dify request failed: {e!r}")
+
+                    if attempt == self.max_retries:
+                        self.stats['failures'] += 1
+                        raise error
+                    await self._backoff(attempt, response, timing)
+            finally:
+                timing['http'] = time.perf_counter() - acquired
+
+    async def stream(self, path: str, payload: dict, timing: Optional[dict] = None) -> AsyncIterator[dict]:
+        """
+        POST a JSON payload and yield the events of the SSE response.
+
+        The concurrency slot is held until the stream ends. Transient failures
+        are retried only before the first event; a Dify "error" event raises.
+        """
+        client, semaphore = self._session()
+        timing = {} if timing is None else timing
+        queued = time.perf_counter()
+        async with semaphore:
+            acquired = time.perf_counter()
+            timing.update(queue_wait=acquired - queued, attempts=0, retry_wait=0.0)
+            try:
+                for attempt in range(self.max_retries + 1):
+                    self.stats['requests'] += 1
+                    timing['attempts'] += 1
+                    started = False
+                    response = None
+                    try:
+                        sent = time.perf_counter()
+                        async with client.stream("POST", path, json=payload) as response:
+                            timing['ttfb'] = time.perf_counter() - sent
+                            if response.status_code not in RETRY_STATUSES:
+                                if response.is_error:
+                                    self.stats['failures'] += 1
+                                    raise DifyError(f"Dify returned HTTP {response.status_code}", response.status_code)
+                                async for line in response.aiter_lines():
+                                    # "data: {...}" lines; event:/id: lines and pings carry nothing we use
+                                    if not line.startswith("data:"):
+                                        continue
+                                    event = json.loads(line[5:])
+                                    if event.get("event") == "error":
+                                        self.stats['failures'] += 1
+                                        raise DifyError(f"Dify stream error: {event.get('message')}", event.get("status"))
+                                    if not started:
+                                        timing['first_event'] = time.perf_counter() - sent
+                                        started = True
+                                    yield event
+                                return
+                            error = DifyError(f"Dify returned HTTP {response.status_code}", response.status_code)
+                    except httpx.TransportError as e:
+                        error = DifyError(f"Dify request failed: {e!r}")
+                        if started:
+                            self.stats['failures'] += 1
+                            raise error from e
+
+                    if attempt == self.max_retries:
+                        self.stats['failures'] += 1
+                        raise error
+                    await self._backoff(attempt, response, timing)
+            finally:
+                timing['http'] = time.perf_counter() - acquired
+
+    async def completion(self, inputs: dict, user: str, timing: Optional[dict] = None) -> dict:
+        """Blocking-mode completion message (POST /completion-messages)."""
+        return await self.post("/completion-messages", {
+            "inputs": inputs,
+            "response_mode": "blocking",
+            "user": user
+        }, timing)
+
+    async def completion_stream(self, inputs: dict, user: str, timing: Optional[dict] = None) -> AsyncIterator[dict]:
+        """
+        Streaming-mode completion message: yields Dify's events ("message"
+        with an "answer" chunk, "message_replace", "message_end", ...).
+        """
+        async for event in self.stream("/completion-messages", {
+            "inputs": inputs,
+            "response_mode": "streaming",
+            "user": user
+        }, timing):
+            yield event
+
+
+dify_client = DifyClient()
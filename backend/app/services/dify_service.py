@@ -1,78 +1,279 @@
 """
 Dify Service for AI Report Generation.
+
+Generation runs on the event loop: Dify is called through the pooled async
+client (dify_client), and the short database reads / writes run in the
+threadpool so a locked SQLite database never blocks the loop.
+
+With dify_streaming the completion is requested in streaming mode: chunks are
+relayed to report_streams as they arrive (GET /reports/{id}/stream) and the
+content so far is written every report_flush_interval seconds, not per chunk.
+
+Dify answers are cached by report type, context and app version
+(report_cache); a hit is served without calling Dify and marks the report
+as cached.
+
+Batches (generate_batch) resolve the contexts of all their reports in bulk
+queries and run at most report_batch_concurrency generations at a time,
+starting at most report_batch_rate per second.
+
+Each report records where its generation time went in ai_reports.timing
+(seconds per stage, see report_timing.STAGES); generation_time is the total.
 """
-import requests
+import asyncio
 import json
 import time
+from typing import Dict, List, Optional
 from sqlalchemy.orm import Session
 from datetime import datetime
+from fastapi.concurrency import run_in_threadpool
 
 from ..config import get_settings
-from ..models import AIReport, ClusterResult, Doctor
+from ..database import SessionLocal
+from ..models import AIReport, ClusterResult, Doctor, ReportBatch
+from .dify_client import DifyError, dify_client
+from .report_cache import report_cache
+from .report_streams import report_streams
 
-settings = get_settings()
+# Bound parameters per IN (...) query, below SQLite's variable limit
+IN_CHUNK_SIZE = 900
 
 class DifyService:
     
-    def __init__(self):
-        self.api_key = settings.dify_api_key
-        self.api_url = settings.dify_api_url
-        
-    def generate_report(self, db: Session, report_id: int):
+    async def generate_report(
+        self,
+        report_id: int,
+        use_cache: bool = True,
+        context: Optional[dict] = None,
+        queued_at: Optional[float] = None
+    ):
         """
         Generate report content using Dify API (or fallback to mock).
-        This method is intended to be run as a background task.
+        This coroutine is intended to be run as a background task; it uses its
+        own database sessions.
+        
+        Every database step runs start to finish in one threadpool call, so
+        no pooled connection is held while waiting on Dify or on the event
+        loop (request handlers query synchronously on the loop; a connection
+        held across an await could leave them waiting on an exhausted pool).
         
         Args:
-            db: Database session
             report_id: ID of the report to generate
+            use_cache: Serve an identical cached answer instead of calling Dify
+            context: Context already resolved in bulk (generate_batch)
+            queued_at: time.monotonic() when the report was queued
         """
-        report = db.query(AIReport).filter(AIReport.report_id == report_id).first()
-        if not report:
-            print(f"Report {report_id} not found")
-            return
-            
+        started_at = time.monotonic()
+        timing = {}
+        if queued_at is not None:
+            timing['pending'] = started_at - queued_at
         try:
-            # 1. Prepare Context
-            context = self._prepare_context(db, report)
+            # 1. Prepare Context (and look up the cache)
+            started = await run_in_threadpool(self._start, report_id, use_cache, context, timing)
+            if started is None:
+                print(f"Report {report_id} not found")
+                return
+            report_type, context, cache_key, cached = started
             
-            # 2. Call Dify API
-            if self.api_key and self.api_url:
-                content = self._call_dify_api(context, report.report_type)
+            # 2. Call Dify API (unless the answer is cached)
+            if cached is not None:
+                content = cached
+                report_streams.append(report_id, content)
+            elif dify_client.configured and get_settings().dify_streaming:
+                content = await self._stream_dify_api(report_id, context, report_type, timing)
+            elif dify_client.configured:
+                content = await self._call_dify_api(context, report_type, timing)
+                report_streams.append(report_id, content)
             else:
                 # Fallback to Mock
                 print("Dify API key not configured, using mock generation.")
-                time.sleep(2) # Simulate delay
-                content = self._mock_generation(context, report.report_type)
+                await asyncio.sleep(2) # Simulate delay
+                content = self._mock_generation(context, report_type)
+                report_streams.append(report_id, content)
             
             # 3. Update Report
-            report.report_content = content
-            report.status = "published"
-            report.generation_time = 2.5 # Mock time or calculation
-            report.updated_at = datetime.now()
-            
-            db.commit()
+            await run_in_threadpool(self._finish, report_id, {
+                AIReport.report_content: content,
+                AIReport.status: "published",
+                AIReport.cached: cached is not None,
+                AIReport.updated_at: datetime.now()
+            }, timing, started_at, (cache_key, report_type, content) if cache_key and cached is None else None)
+            report_streams.close(report_id, "published")
             print(f"Report {report_id} generated successfully.")
             
         except Exception as e:
             print(f"Error generating report {report_id}: {e}")
-            report.status = "failed"
-            report.report_content = f"Generation failed: {str(e)}"
+            await run_in_threadpool(self._finish, report_id, {
+                AIReport.status: "failed",
+                AIReport.report_content: f"Generation failed: {str(e)}",
+                AIReport.updated_at: datetime.now()
+            }, timing, started_at)
+            report_streams.close(report_id, "failed", str(e))
+        finally:
+            # No-op unless generation ended without a final write
+            report_streams.close(report_id, "failed", "Generation interrupted")
+
+    def _start(self, report_id: int, use_cache: bool, context: Optional[dict], timing: dict):
+        """
+        Load a report, its context and any cached answer (threadpool, own session).
+        The time taken is recorded as timing['context'].
+        
+        Returns:
+            tuple: (report_type, context, cache key or None, cached content or None), or None if the report is missing
+        """
+        step_started = time.monotonic()
+        db = SessionLocal()
+        try:
+            report = db.query(AIReport).filter(AIReport.report_id == report_id).first()
+            if not report:
+                return None
+            if context is None:
+                context = self._prepare_context(db, report)
+            cache_key = None
+            cached = None
+            if dify_client.configured and report_cache.enabled:
+                cache_key = report_cache.key(report.report_type, context)
+                if use_cache:
+                    cached = report_cache.get(db, cache_key)
             db.commit()
+            report_type = report.report_type
+        finally:
+            db.close()
+        timing['context'] = time.monotonic() - step_started
+        return report_type, context, cache_key, cached
+
+    def _finish(
+        self,
+        report_id: int,
+        values: dict,
+        timing: dict,
+        started_at: float,
+        cache_entry: Optional[tuple] = None
+    ):
+        """
+        Final write of a report, plus its new cache entry, then its timing and
+        generation_time (threadpool, own session). The timing is written after
+        the final commit so that db_write covers the commit (SQLite's lock
+        wait and WAL sync); a failure to write it is only logged, as the
+        report itself is already stored.
+        """
+        db = SessionLocal()
+        try:
+            step_started = time.monotonic()
+            report = db.query(AIReport).filter(AIReport.report_id == report_id)
+            report.update(values, synchronize_session=False)
+            if cache_entry:
+                report_cache.put(db, *cache_entry)
+            db.commit()
+            timing['db_write'] = time.monotonic() - step_started
+            timing['total'] = time.monotonic() - started_at
+            
+            try:
+                report.update({
+                    AIReport.timing: {stage: round(value, 4) for stage, value in timing.items()},
+                    AIReport.generation_time: round(timing['total'], 3)
+                }, synchronize_session=False)
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                print(f"Error saving the timing of report {report_id}: {e}")
+        finally:
+            db.close()
+
+    async def generate_batch(self, batch_id: int, use_cache: bool = True, queued_at: Optional[float] = None):
+        """
+        Generate all reports of a batch (background task): contexts in bulk,
+        then at most report_batch_concurrency generations at a time, started
+        at most report_batch_rate per second. The bulk context queries and the
+        wait for a worker count as each report's pending time.
+        """
+        settings = get_settings()
+        queued_at = time.monotonic() if queued_at is None else queued_at
+        
+        def load():
+            db = SessionLocal()
+            try:
+                reports = db.query(AIReport)\
+                    .filter(AIReport.batch_id == batch_id, AIReport.status == "generating")\
+                    .order_by(AIReport.report_id)\
+                    .all()
+                report_ids = [report.report_id for report in reports]
+                try:
+                    return report_ids, self.prepare_contexts(db, reports)
+                except Exception as e:
+                    # Each report then prepares (or fails on) its own context
+                    print(f"Error preparing the contexts of batch {batch_id}: {e}")
+                    db.rollback()
+                    return report_ids, {}
+            finally:
+                db.close()
+        
+        def finish():
+            db = SessionLocal()
+            try:
+                db.query(ReportBatch).filter(ReportBatch.batch_id == batch_id)\
+                    .update({ReportBatch.finished_at: datetime.now()}, synchronize_session=False)
+                db.commit()
+            finally:
+                db.close()
+        
+        report_ids = []
+        try:
+            report_ids, contexts = await run_in_threadpool(load)
+            
+            pending = iter(report_ids)
+            interval = 1.0 / settings.report_batch_rate if settings.report_batch_rate > 0 else 0.0
+            next_start = time.monotonic()
+            
+            async def worker():
+                nonlocal next_start
+                # Workers share the iterator: each takes the next report when free
+                for report_id in pending:
+                    if interval:
+                        now = time.monotonic()
+                        wait = next_start - now
+                        next_start = max(now, next_start) + interval
+                        if wait > 0:
+                            await asyncio.sleep(wait)
+                    try:
+                        await self.generate_report(report_id, use_cache, contexts.get(report_id), queued_at)
+                    except Exception as e:
+                        # One report must not stop the batch
+                        print(f"Error generating report {report_id} of batch {batch_id}: {e}")
+            
+            await asyncio.gather(*[worker() for _ in range(max(1, min(settings.report_batch_concurrency, len(report_ids))))])
+        finally:
+            await run_in_threadpool(finish)
+        print(f"Report batch {batch_id} finished ({len(report_ids)} reports).")
 
     def _prepare_context(self, db: Session, report: AIReport) -> dict:
         """Prepare context data for the AI."""
-        context = {}
+        return self.prepare_contexts(db, [report])[report.report_id]
+
+    def prepare_contexts(self, db: Session, reports: List[AIReport]) -> Dict[int, dict]:
+        """Context data of many reports: one query per IN_CHUNK_SIZE clusters / doctors."""
+        cluster_ids = sorted({r.related_cluster_id for r in reports if r.related_cluster_id})
+        npis = sorted({r.related_npi for r in reports if r.related_npi})
+        clusters = {}
+        for i in range(0, len(cluster_ids), IN_CHUNK_SIZE):
+            chunk = cluster_ids[i:i + IN_CHUNK_SIZE]
+            clusters.update({c.cluster_id: c for c in db.query(ClusterResult).filter(ClusterResult.cluster_id.in_(chunk))})
+        doctors = {}
+        for i in range(0, len(npis), IN_CHUNK_SIZE):
+            chunk = npis[i:i + IN_CHUNK_SIZE]
+            doctors.update({d.npi: d for d in db.query(Doctor).filter(Doctor.npi.in_(chunk))})
         
-        if report.related_cluster_id:
-            cluster = db.query(ClusterResult).filter(ClusterResult.cluster_id == report.related_cluster_id).first()
+        contexts = {}
+        for report in reports:
+            context = {}
+            
+            cluster = clusters.get(report.related_cluster_id)
             if cluster:
                 context['cluster_name'] = cluster.cluster_name
                 context['kpi_summary'] = cluster.kpi_summary
                 context['strategy_focus'] = cluster.strategy_focus
                 
-        if report.related_npi:
-            doctor = db.query(Doctor).filter(Doctor.npi == report.related_npi).first()
+            doctor = doctors.get(report.related_npi)
             if doctor:
                 context['doctor_name'] = f"{doctor.first_name} {doctor.last_name}"
                 context['specialty'] = doctor.specialty
@@ -81,41 +282,83 @@ class DifyService:
                     'F': doctor.frequency,
                     'M': doctor.monetary
                 }
-                
-        return context
+            
+            contexts[report.report_id] = context
+        return contexts
 
-    def _call_dify_api(self, context: dict, report_type: str) -> str:
-        """Call actual Dify API."""
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        
+    async def _call_dify_api(self, context: dict, report_type: str, timing: Optional[dict] = None) -> str:
+        """Call actual Dify API (retries, timeouts and concurrency limits in dify_client)."""
         # Prepare inputs based on Dify app configuration
         inputs = {
             "report_type": report_type,
             "context": json.dumps(context, ensure_ascii=False)
         }
         
-        payload = {
-            "inputs": inputs,
-            "response_mode": "blocking",
-            "user": "pharma-system-user"
-        }
-        
         try:
-            response = requests.post(
-                f"{self.api_url}/completion-messages",
-                headers=headers,
-                json=payload,
-                timeout=60
-            )
-            response.raise_for_status()
-            result = response.json()
-            return result.get('answer', 'No answer from AI')
+            result = await dify_client.completion(inputs, user="pharma-system-user", timing=timing)
         except Exception as e:
             print(f"Dify API call failed: {e}")
             raise e
+        # An empty answer must not be published (and cached) as a report
+        if not result.get('answer'):
+            raise DifyError("Dify returned no answer")
+        return result['answer']
+
+    async def _stream_dify_api(self, report_id: int, context: dict, report_type: str, timing: Optional[dict] = None) -> str:
+        """
+        Call Dify in streaming mode, relaying chunks to report_streams and
+        writing the content so far at most every report_flush_interval seconds.
+        A write still in progress is not waited for; the next one is skipped.
+        The writes are recorded as timing['flush'] (seconds) and timing['flushes'].
+        """
+        timing = {} if timing is None else timing
+        inputs = {
+            "report_type": report_type,
+            "context": json.dumps(context, ensure_ascii=False)
+        }
+        flush_interval = get_settings().report_flush_interval
+        parts = []
+        last_flush = time.monotonic()
+        flush = None
+        
+        try:
+            async for event in dify_client.completion_stream(inputs, user="pharma-system-user", timing=timing):
+                if event.get("event") == "message":
+                    parts.append(event.get("answer", ""))
+                    report_streams.append(report_id, event.get("answer", ""))
+                elif event.get("event") == "message_replace":
+                    parts = [event.get("answer", "")]
+                    report_streams.replace(report_id, parts[0])
+                else:
+                    continue
+                
+                if time.monotonic() - last_flush >= flush_interval and (flush is None or flush.done()):
+                    flush = asyncio.ensure_future(run_in_threadpool(self._save_content, report_id, ''.join(parts), timing))
+                    last_flush = time.monotonic()
+        finally:
+            # The final write must not be overtaken by a partial one
+            if flush is not None:
+                await asyncio.gather(flush, return_exceptions=True)
+        
+        content = ''.join(parts)
+        if not content:
+            raise DifyError("Dify stream ended without an answer")
+        return content
+
+    def _save_content(self, report_id: int, content: str, timing: dict):
+        """Write the partial content of a report still generating (own session, threadpool)."""
+        step_started = time.monotonic()
+        db = SessionLocal()
+        try:
+            db.query(AIReport).filter(
+                AIReport.report_id == report_id,
+                AIReport.status == "generating"
+            ).update({AIReport.report_content: content}, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+        timing['flush'] = timing.get('flush', 0.0) + time.monotonic() - step_started
+        timing['flushes'] = timing.get('flushes', 0) + 1
 
     def _mock_generation(self, context: dict, report_type: str) -> str:
         """Mock content generation."""
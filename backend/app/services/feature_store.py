@@ -0,0 +1,166 @@
+"""
+Feature store for clustering.
+
+Caches the prepared feature matrix of a clustering run on disk so repeated
+runs over the same data (typically the same features with different K) skip
+loading, null filtering, log transform and scaling. Each entry is a directory
+of .npy files that later tasks and worker processes memory-map read-only:
+
+    npi.npy     NPI index (fixed-width bytes), one per row
+    raw.npy     Feature values before transformation (float64)
+    X.npy       Transformed and standardized features (float32)
+    meta.json   Key, scaler statistics and row count
+
+Entries are keyed by (features, transform, source, dataset version). The
+dataset version is an aggregate fingerprint of the source data, so an ETL run
+that changes the doctors table or the monthly rollups yields a new key instead
+of stale features.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from ..config import get_settings
+from ..models import Doctor
+from . import rfm_window
+from . import payment_mix
+
+
+class FeatureMatrix:
+    """
+    A cached feature matrix, memory-mapped from disk.
+
+    Attributes:
+        npi: NPIs (bytes), one per row
+        raw: Feature values before transformation, shape (n_rows, n_features)
+        X: Transformed, standardized float32 features, same shape
+        mean, scale: StandardScaler statistics used to produce X
+    """
+
+    def __init__(self, path: Path, meta: dict):
+        self.path = path
+        self.meta = meta
+        self.features = meta['features']
+        self.mean = np.asarray(meta['mean'])
+        self.scale = np.asarray(meta['scale'])
+        self.npi = np.load(path / 'npi.npy', mmap_mode='r')
+        self.raw = np.load(path / 'raw.npy', mmap_mode='r')
+        self.X = np.load(path / 'X.npy', mmap_mode='r')
+
+    def __len__(self):
+        return len(self.npi)
+
+
+class FeatureStore:
+
+    def __init__(self):
+        settings = get_settings()
+        self.cache_dir = Path(settings.feature_cache_dir)
+        self.max_entries = settings.feature_cache_max_entries
+
+    def dataset_version(self, db: Session, features, params: dict) -> str:
+        """
+        Fingerprint of the data the features are computed from.
+
+        Doctor features: row count plus non-null count and total of each
+        feature (one scan of the doctors table), plus the payment_records
+        fingerprint when payment-mix components are used. Time-windowed RFM:
+        the rollup version together with the window parameters.
+        """
+        if params.get('window_start') or params.get('window_end'):
+            parts = list(rfm_window.rollup_version(db)) + [
+                params.get('window_start'), params.get('window_end'), params.get('reference_date')
+            ]
+        else:
+            columns = [getattr(Doctor, f) for f in features if hasattr(Doctor, f)]
+            aggregates = [func.count()]
+            for column in columns:
+                aggregates += [func.count(column), func.total(column)]
+            parts = list(db.query(*aggregates).select_from(Doctor).one())
+            if payment_mix.mix_features(features):
+                parts.append(payment_mix.payment_mix_store.source_version(db))
+        return hashlib.sha1(json.dumps(parts, default=str).encode()).hexdigest()[:16]
+
+    def make_key(self, db: Session, features, transform: str, params: dict) -> dict:
+        """Cache key for a feature list, transform description and data source."""
+        return {
+            'features': list(features),
+            'transform': transform,
+            'version': self.dataset_version(db, features, params),
+        }
+
+    def _entry_path(self, key: dict) -> Path:
+        digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()[:20]
+        return self.cache_dir / digest
+
+    def load(self, key: dict) -> Optional[FeatureMatrix]:
+        """Map a cached entry, or return None on a miss."""
+        path = self._entry_path(key)
+        meta_path = path / 'meta.json'
+        if not meta_path.exists():
+            return None
+        with open(meta_path, encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('key') != key:
+            return None
+        os.utime(meta_path)  # Most recently used entries survive eviction
+        return FeatureMatrix(path, meta)
+
+    def save(self, key: dict, npi: np.ndarray, raw: np.ndarray, X: np.ndarray,
+             mean: np.ndarray, scale: np.ndarray) -> FeatureMatrix:
+        """
+        Write an entry and return it memory-mapped.
+
+        Files are written to a temporary directory that is renamed into place,
+        so concurrent readers never see a partial entry; if another process
+        stored the same key first, its entry is used.
+        """
+        path = self._entry_path(key)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp = Path(tempfile.mkdtemp(prefix='.tmp-', dir=self.cache_dir))
+        try:
+            np.save(tmp / 'npi.npy', np.asarray(npi, dtype='S'))
+            np.save(tmp / 'raw.npy', np.ascontiguousarray(raw, dtype=np.float64))
+            np.save(tmp / 'X.npy', np.ascontiguousarray(X, dtype=np.float32))
+            meta = {
+                'key': key,
+                'features': key['features'],
+                'n_rows': int(len(npi)),
+                'mean': [float(v) for v in mean],
+                'scale': [float(v) for v in scale],
+                'created_at': datetime.now().isoformat()
+            }
+            with open(tmp / 'meta.json', 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+            os.rename(tmp, path)
+        except OSError:
+            # Lost the race to another writer
+            shutil.rmtree(tmp, ignore_errors=True)
+            if not (path / 'meta.json').exists():
+                raise
+
+        self._evict()
+        return self.load(key)
+
+    def _evict(self):
+        """Remove the least recently used entries beyond feature_cache_max_entries."""
+        entries = [p for p in self.cache_dir.iterdir() if (p / 'meta.json').exists()]
+        entries.sort(key=lambda p: (p / 'meta.json').stat().st_mtime, reverse=True)
+        for stale in entries[self.max_entries:]:
+            # Processes that still map the files keep them until they unmap
+            shutil.rmtree(stale, ignore_errors=True)
+
+    def clear(self):
+        """Remove every cached entry."""
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+feature_store = FeatureStore()
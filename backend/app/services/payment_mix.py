@@ -0,0 +1,414 @@
+"""
+Payment-mix features for clustering.
+
+Doctors are described by what they are paid for, not only how much: one
+streaming pass over payment_records builds a sparse CSR doctor × term matrix
+of payment counts, where the terms are manufacturers, payment natures and
+products. The terms are TF-IDF weighted in place (sublinear tf, smoothed idf, l2 rows) and reduced
+with TruncatedSVD to a few dense components, mix_0 .. mix_{n-1}. Clustering
+tasks select them like Doctor columns; the feature "payment_mix" expands to
+all components.
+
+Memory stays within payment_mix_memory_mb regardless of the payment count:
+    - terms are hashed into payment_mix_hash_columns columns, so the matrix
+      width is fixed however many products there are
+    - payments are read payment_mix_chunk_rows at a time; their (doctor,
+      term) pairs are buffered up to 1/32 of the budget and then
+      merged into a row-blocked matrix one block at a time
+    - the matrix holds one float32 entry per distinct (doctor, term) pair;
+      the build fails with a clear error if it outgrows the budget
+    - TF-IDF rewrites the matrix data in place and TruncatedSVD works on the
+      float32 matrix, so no float64 copy is made
+
+Components are cached per payment-data version under
+<feature_cache_dir>/payment_mix/<digest>/:
+
+    npi.npy         NPIs (fixed-width bytes, sorted), doctors with payments
+    components.npy  (n_doctors, n_components) float32
+    meta.json       Key, explained variance and top terms per component
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.decomposition import TruncatedSVD
+from sklearn.utils import murmurhash3_32
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from ..config import get_settings
+from ..models import Doctor, PaymentRecord
+
+MIX_PREFIX = "mix_"
+MIX_ALIAS = "payment_mix"
+
+# (term prefix, payment_records column)
+TERM_COLUMNS = [
+    ("manufacturer", "manufacturer_name"),
+    ("type", "payment_type"),
+    ("product", "product_name"),
+]
+
+# Terms listed per component in meta.json
+TOP_TERMS = 5
+
+# float32 value + int32 column index of a CSR entry
+ENTRY_BYTES = 8
+
+
+def is_mix_feature(feature: str) -> bool:
+    return feature.startswith(MIX_PREFIX)
+
+
+def mix_features(features) -> List[str]:
+    """The payment-mix components among features."""
+    return [f for f in features if is_mix_feature(f)]
+
+
+def component_names(n_components: Optional[int] = None) -> List[str]:
+    n_components = n_components or get_settings().payment_mix_components
+    return [f"{MIX_PREFIX}{i}" for i in range(n_components)]
+
+
+def expand_features(features) -> List[str]:
+    """Replace the "payment_mix" alias with every component name."""
+    expanded = []
+    for f in features:
+        expanded += component_names() if f == MIX_ALIAS else [f]
+    return expanded
+
+
+class PaymentMix:
+    """
+    Cached components, memory-mapped from disk.
+
+    Attributes:
+        npi: Sorted NPIs (bytes) of doctors with payments
+        components: (n_doctors, n_components) float32 SVD components
+    """
+
+    def __init__(self, path: Path, meta: dict):
+        self.path = path
+        self.meta = meta
+        self.npi = np.load(path / 'npi.npy', mmap_mode='r')
+        self.components = np.load(path / 'components.npy', mmap_mode='r')
+
+    def __len__(self):
+        return len(self.npi)
+
+    def attach(self, df: pd.DataFrame, features) -> pd.DataFrame:
+        """
+        df (with an npi column) plus the requested component columns; doctors
+        without payments are dropped.
+        """
+        npis = df['npi'].values.astype('S10')
+        rows = np.minimum(np.searchsorted(self.npi, npis), len(self.npi) - 1)
+        found = self.npi[rows] == npis
+        df = df[found].copy()
+        rows = rows[found]
+        for f in features:
+            index = int(f[len(MIX_PREFIX):])
+            if index >= self.components.shape[1]:
+                raise ValueError(f"Unknown payment-mix feature {f} ({self.components.shape[1]} components)")
+            df[f] = self.components[rows, index]
+        return df
+
+
+class BlockedCounts:
+    """
+    Sparse doctor × term counts kept as row blocks. Adding a batch of
+    (row, column) pairs rewrites one block at a time, so a merge needs one
+    block of extra memory rather than a second copy of the whole matrix.
+    """
+
+    N_BLOCKS = 64
+
+    def __init__(self, n_rows: int, n_columns: int, memory_bytes: int):
+        self.n_columns = n_columns
+        self.memory_bytes = memory_bytes
+        self.bounds = np.linspace(0, n_rows, self.N_BLOCKS + 1).astype(np.int64)
+        self.blocks = [
+            sparse.csr_matrix((int(hi - lo), n_columns), dtype=np.float32)
+            for lo, hi in zip(self.bounds[:-1], self.bounds[1:])
+        ]
+
+    @property
+    def nnz(self) -> int:
+        return sum(block.nnz for block in self.blocks)
+
+    def add(self, rows: np.ndarray, cols: np.ndarray):
+        """Count one payment per (row, column) pair."""
+        order = np.argsort(rows, kind='stable')
+        rows, cols = rows[order], cols[order]
+        splits = np.searchsorted(rows, self.bounds)
+        for i, (lo, hi) in enumerate(zip(splits[:-1], splits[1:])):
+            if hi == lo:
+                continue
+            batch = sparse.csr_matrix(
+                (np.ones(hi - lo, dtype=np.float32), (rows[lo:hi] - self.bounds[i], cols[lo:hi])),
+                shape=self.blocks[i].shape
+            )
+            self.blocks[i] = self.blocks[i] + batch
+        if self.nnz * ENTRY_BYTES > self.memory_bytes:
+            raise ValueError(
+                f"Payment mix needs more than payment_mix_memory_mb ({self.memory_bytes // 2 ** 20} MB) "
+                f"at {self.nnz:,} doctor-term entries; raise the budget or lower payment_mix_hash_columns"
+            )
+
+    def to_csr(self):
+        """
+        One CSR matrix of the non-empty rows, built while releasing the blocks.
+
+        Returns:
+            (csr_matrix, indices of the non-empty rows)
+        """
+        row_counts = [np.diff(block.indptr) for block in self.blocks]
+        kept = np.concatenate([
+            self.bounds[i] + np.flatnonzero(counts) for i, counts in enumerate(row_counts)
+        ])
+        nnz = self.nnz
+        data = np.empty(nnz, dtype=np.float32)
+        indices = np.empty(nnz, dtype=np.int32)
+        indptr = np.zeros(len(kept) + 1, dtype=np.int64)
+        position, row = 0, 0
+        for i, counts in enumerate(row_counts):
+            block = self.blocks[i]
+            data[position:position + block.nnz] = block.data
+            indices[position:position + block.nnz] = block.indices
+            non_empty = counts[counts > 0]
+            indptr[row + 1:row + 1 + len(non_empty)] = position + np.cumsum(non_empty)
+            position += block.nnz
+            row += len(non_empty)
+            self.blocks[i] = None
+        return sparse.csr_matrix((data, indices, indptr), shape=(len(kept), self.n_columns)), kept
+
+
+class PaymentMixStore:
+
+    def __init__(self):
+        settings = get_settings()
+        self.cache_dir = Path(settings.feature_cache_dir) / 'payment_mix'
+        self.n_components = settings.payment_mix_components
+        self.hash_columns = settings.payment_mix_hash_columns
+        self.chunk_rows = settings.payment_mix_chunk_rows
+        self.memory_bytes = settings.payment_mix_memory_mb * 1024 * 1024
+
+    def source_version(self, db: Session) -> str:
+        """Fingerprint of payment_records (row count, last id, amount total)."""
+        parts = list(db.query(
+            func.count(), func.max(PaymentRecord.id), func.total(PaymentRecord.amount)
+        ).one())
+        return hashlib.sha1(json.dumps(parts, default=str).encode()).hexdigest()[:16]
+
+    def make_key(self, db: Session) -> dict:
+        return {
+            'version': self.source_version(db),
+            'n_components': self.n_components,
+            'hash_columns': self.hash_columns,
+        }
+
+    def _entry_path(self, key: dict) -> Path:
+        digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()[:20]
+        return self.cache_dir / digest
+
+    def load(self, key: dict) -> Optional[PaymentMix]:
+        path = self._entry_path(key)
+        meta_path = path / 'meta.json'
+        if not meta_path.exists():
+            return None
+        with open(meta_path, encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('key') != key:
+            return None
+        return PaymentMix(path, meta)
+
+    def get(self, db: Session) -> PaymentMix:
+        """Components for the current payment data, built on a cache miss."""
+        key = self.make_key(db)
+        cached = self.load(key)
+        if cached is not None:
+            return cached
+        return self.build(db, key)
+
+    def attach(self, db: Session, df: pd.DataFrame, features) -> pd.DataFrame:
+        """df plus the requested payment-mix columns (no-op without any)."""
+        features = mix_features(features)
+        if not features:
+            return df
+        return self.get(db).attach(df, features)
+
+    def _doctor_npis(self, db: Session) -> np.ndarray:
+        """Sorted NPIs (fixed-width bytes) of all doctors, read in chunks."""
+        chunks = []
+        cursor = db.connection().connection.cursor()
+        try:
+            cursor.execute(str(db.query(Doctor.npi).statement.compile(db.bind)))
+            while True:
+                rows = cursor.fetchmany(self.chunk_rows)
+                if not rows:
+                    break
+                chunks.append(np.array([row[0] for row in rows], dtype='S10'))
+        finally:
+            cursor.close()
+        return np.sort(np.concatenate(chunks)) if chunks else np.array([], dtype='S10')
+
+    def _read_counts(self, db: Session, doctor_npis: np.ndarray):
+        """
+        Streaming pass: sparse (doctor × hashed term) payment counts.
+
+        Returns:
+            (BlockedCounts, {column: most frequent term hashed to it}, payments read)
+        """
+        n_doctors = len(doctor_npis)
+        counts = BlockedCounts(n_doctors, self.hash_columns, self.memory_bytes)
+        buffered_rows, buffered_cols, buffered_entries = [], [], 0
+        # Buffered (row, column) pairs; sorting a flush takes about 4x their size
+        buffer_limit = self.memory_bytes // 32 // ENTRY_BYTES
+        term_columns: Dict[str, int] = {}
+        term_counts: Dict[str, int] = {}
+        n_payments = 0
+
+        def term_column(term: str) -> int:
+            column = term_columns.get(term)
+            if column is None:
+                column = murmurhash3_32(term, seed=0, positive=True) % self.hash_columns
+                term_columns[term] = column
+            return column
+
+        names = ['npi'] + [column for _, column in TERM_COLUMNS]
+        query = db.query(PaymentRecord.npi, *[getattr(PaymentRecord, c) for _, c in TERM_COLUMNS])
+        cursor = db.connection().connection.cursor()
+        try:
+            cursor.execute(str(query.statement.compile(db.bind)))
+            while True:
+                rows = cursor.fetchmany(self.chunk_rows)
+                if not rows:
+                    break
+                n_payments += len(rows)
+                chunk = pd.DataFrame.from_records(rows, columns=names)
+                npis = chunk['npi'].values.astype('S10')
+                doctor = np.minimum(np.searchsorted(doctor_npis, npis), n_doctors - 1).astype(np.int32)
+                known = doctor_npis[doctor] == npis
+
+                for prefix, column in TERM_COLUMNS:
+                    codes, uniques = pd.factorize(chunk[column])
+                    if not len(uniques):
+                        continue
+                    terms = [f"{prefix}:{u}" for u in uniques]
+                    hashed = np.array([term_column(term) for term in terms], dtype=np.int32)
+                    valid = known & (codes >= 0)
+                    buffered_rows.append(doctor[valid])
+                    buffered_cols.append(hashed[codes[valid]])
+                    buffered_entries += int(valid.sum())
+                    frequencies = np.bincount(codes[valid], minlength=len(uniques))
+                    for term, n in zip(terms, frequencies):
+                        term_counts[term] = term_counts.get(term, 0) + int(n)
+
+                if buffered_entries >= buffer_limit:
+                    counts.add(np.concatenate(buffered_rows), np.concatenate(buffered_cols))
+                    buffered_rows, buffered_cols, buffered_entries = [], [], 0
+                print(f"Payment mix: {n_payments:,} payments read, {counts.nnz:,} entries")
+        finally:
+            cursor.close()
+        if buffered_rows:
+            counts.add(np.concatenate(buffered_rows), np.concatenate(buffered_cols))
+
+        # Term names for meta.json: the most frequent term of each column
+        column_terms: Dict[int, str] = {}
+        for term, _ in sorted(term_counts.items(), key=lambda item: -item[1]):
+            column_terms.setdefault(term_columns[term], term)
+        return counts, column_terms, n_payments
+
+    @staticmethod
+    def _tfidf_inplace(counts):
+        """
+        TF-IDF as sklearn's TfidfTransformer(sublinear_tf=True) computes it
+        (1 + log tf, idf = ln((1 + n) / (1 + df)) + 1, l2-normalized rows),
+        rewriting counts.data instead of allocating float64 copies. Every row
+        must have an entry.
+        """
+        n_rows = counts.shape[0]
+        document_frequency = np.bincount(counts.indices, minlength=counts.shape[1])
+        idf = (np.log((1 + n_rows) / (1 + document_frequency)) + 1).astype(np.float32)
+        np.log(counts.data, out=counts.data)
+        counts.data += 1
+        counts.data *= idf[counts.indices]
+        row_norms = np.sqrt(np.add.reduceat(counts.data ** 2, counts.indptr[:-1]))
+        counts.data /= np.repeat(row_norms, np.diff(counts.indptr))
+        return counts
+
+    def build(self, db: Session, key: Optional[dict] = None) -> PaymentMix:
+        """
+        Build and cache the components: streaming count pass, TF-IDF,
+        TruncatedSVD. Files are renamed into place as in feature_store.
+        """
+        key = key or self.make_key(db)
+        start = time.perf_counter()
+        doctor_npis = self._doctor_npis(db)
+        if not len(doctor_npis):
+            raise ValueError("No doctor data available for payment-mix features")
+
+        blocked, column_terms, n_payments = self._read_counts(db, doctor_npis)
+        counts, with_payments = blocked.to_csr()
+        if len(with_payments) <= self.n_components:
+            raise ValueError(f"Not enough doctors with payments ({len(with_payments)}) for payment-mix features")
+        count_seconds = time.perf_counter() - start
+
+        tfidf = self._tfidf_inplace(counts)
+        svd = TruncatedSVD(n_components=self.n_components, random_state=42)
+        components = svd.fit_transform(tfidf).astype(np.float32)
+
+        top_terms = []
+        for weights in svd.components_:
+            order = np.argsort(-np.abs(weights))[:TOP_TERMS]
+            top_terms.append([
+                {'term': column_terms.get(int(column), f"#{column}"), 'weight': round(float(weights[column]), 4)}
+                for column in order
+            ])
+        meta = {
+            'key': key,
+            'features': component_names(self.n_components),
+            'n_rows': int(len(with_payments)),
+            'n_payments': int(n_payments),
+            'nnz': int(counts.nnz),
+            'explained_variance_ratio': [round(float(v), 6) for v in svd.explained_variance_ratio_],
+            'top_terms': top_terms,
+            'seconds': {'counts': round(count_seconds, 3), 'total': round(time.perf_counter() - start, 3)},
+            'created_at': datetime.now().isoformat(),
+        }
+
+        path = self._entry_path(key)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp = Path(tempfile.mkdtemp(prefix='.tmp-', dir=self.cache_dir))
+        try:
+            np.save(tmp / 'npi.npy', doctor_npis[with_payments])
+            np.save(tmp / 'components.npy', components)
+            with open(tmp / 'meta.json', 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False)
+            os.rename(tmp, path)
+        except OSError:
+            # Lost the race to another writer
+            shutil.rmtree(tmp, ignore_errors=True)
+            if not (path / 'meta.json').exists():
+                raise
+        self._evict(keep=path)
+        print(f"Payment mix: {meta['n_rows']:,} doctors, {meta['nnz']:,} entries in {meta['seconds']['total']}s")
+        return self.load(key)
+
+    def _evict(self, keep: Path):
+        """Entries of older payment data are never read again."""
+        for entry in self.cache_dir.iterdir():
+            if entry != keep and (entry / 'meta.json').exists():
+                shutil.rmtree(entry, ignore_errors=True)
+
+
+payment_mix_store = PaymentMixStore()
@@ -0,0 +1,136 @@
+"""
+Report Batch Service for generating many reports in one request.
+
+A batch resolves its targets in one query (the cluster results of a task, or
+the top-N doctors of a cluster by monetary value), inserts all its ai_reports
+rows in one bulk INSERT ... RETURNING and links them to a report_batches row.
+Generation is fanned out by DifyService.generate_batch; progress is
+aggregated from the batch's reports with one GROUP BY.
+"""
+from typing import List, Optional
+
+from sqlalchemy import func, insert
+from sqlalchemy.orm import Session
+
+from ..config import get_settings
+from ..models import AIReport, ClusterResult, Doctor, ReportBatch
+from .cluster_result_service import cluster_result_service
+
+BATCH_TARGETS = {
+    # target: report type of its reports
+    "clusters": "cluster_analysis",
+    "top_doctors": "doctor_profile",
+}
+
+
+class ReportBatchService:
+
+    def _cluster_targets(self, db: Session, cluster_ids: Optional[List[int]], task_id: Optional[int], limit: int):
+        """(related_cluster_id, related_npi, title) of each cluster result."""
+        query = db.query(ClusterResult.cluster_id, ClusterResult.cluster_name)\
+            .filter(ClusterResult.is_active == True)
+        if cluster_ids:
+            query = query.filter(ClusterResult.cluster_id.in_(cluster_ids))
+        elif task_id is not None:
+            query = query.filter(ClusterResult.task_id == task_id)
+        else:
+            # All whole-population results
+            query = query.filter(ClusterResult.segment_by.is_(None))
+        rows = query.order_by(ClusterResult.cluster_id).limit(limit).all()
+        return [(cluster_id, None, f"聚类分析报告 - {name or cluster_id}") for cluster_id, name in rows]
+
+    def _doctor_targets(self, db: Session, cluster: Optional[int], result_id: Optional[int], top_n: int):
+        """(related_cluster_id, related_npi, title) of the top-N doctors by monetary value."""
+        query = db.query(Doctor.npi, Doctor.full_name, Doctor.first_name, Doctor.last_name)\
+            .filter(Doctor.monetary.isnot(None))
+        if cluster is not None:
+            query = query.filter(Doctor.npi.in_(cluster_result_service.cluster_members(cluster, result_id)))
+        rows = query.order_by(Doctor.monetary.desc()).limit(top_n).all()
+        return [
+            (None, npi, f"医生画像 - {(full_name or '').strip() or ' '.join(filter(None, [first, last])) or npi}")
+            for npi, full_name, first, last in rows
+        ]
+
+    def create_batch(
+        self,
+        db: Session,
+        user_id: int,
+        target: str,
+        cluster_ids: Optional[List[int]] = None,
+        task_id: Optional[int] = None,
+        cluster: Optional[int] = None,
+        result_id: Optional[int] = None,
+        top_n: int = 100
+    ):
+        """
+        Create a batch and its reports (status generating). The caller commits.
+
+        Returns:
+            tuple: (ReportBatch, report ids)
+        """
+        if target not in BATCH_TARGETS:
+            raise ValueError(f"Unknown batch target '{target}' (expected one of {', '.join(BATCH_TARGETS)})")
+        max_size = get_settings().report_batch_max_size
+
+        if target == "clusters":
+            targets = self._cluster_targets(db, cluster_ids, task_id, max_size)
+            parameters = {"cluster_ids": cluster_ids, "task_id": task_id}
+        else:
+            targets = self._doctor_targets(db, cluster, result_id, min(top_n, max_size))
+            parameters = {"cluster": cluster, "result_id": result_id, "top_n": top_n}
+        if not targets:
+            raise ValueError("The batch matches no clusters or doctors")
+
+        report_type = BATCH_TARGETS[target]
+        batch = ReportBatch(
+            target=target,
+            report_type=report_type,
+            parameters=parameters,
+            total=len(targets),
+            created_by=user_id
+        )
+        db.add(batch)
+        db.flush()
+
+        report_ids = db.scalars(
+            insert(AIReport).returning(AIReport.report_id),
+            [
+                {
+                    "report_title": title,
+                    "report_type": report_type,
+                    "report_content": "正在生成中...",
+                    "status": "generating",
+                    "generated_by": user_id,
+                    "related_cluster_id": related_cluster_id,
+                    "related_npi": related_npi,
+                    "batch_id": batch.batch_id,
+                }
+                for related_cluster_id, related_npi, title in targets
+            ]
+        ).all()
+        return batch, list(report_ids)
+
+    def progress(self, db: Session, batch: ReportBatch) -> dict:
+        """Aggregate status of a batch's reports."""
+        rows = db.query(AIReport.status, func.count(AIReport.report_id), func.sum(AIReport.cached))\
+            .filter(AIReport.batch_id == batch.batch_id)\
+            .group_by(AIReport.status)\
+            .all()
+        counts = {status: count for status, count, _ in rows}
+        generating = counts.get("generating", 0)
+        done = sum(counts.values()) - generating
+        return {
+            "batch_id": batch.batch_id,
+            "target": batch.target,
+            "report_type": batch.report_type,
+            "parameters": batch.parameters,
+            "total": batch.total,
+            "status": "running" if generating else "completed",
+            "progress": int(100 * done / batch.total) if batch.total else 100,
+            "counts": counts,
+            "cached": int(sum(cached or 0 for _, _, cached in rows)),
+            "created_at": batch.created_at,
+            "finished_at": batch.finished_at,
+        }
+
+report_batch_service = ReportBatchService()
@@ -0,0 +1,89 @@
+"""
+Content-addressed cache of Dify report answers.
+
+A report's answer depends only on what is sent to Dify: the report type, the
+context from DifyService._prepare_context and the Dify app (its prompt). The
+cache key is the sha1 of the report type, the canonical context JSON (sorted
+keys, no whitespace) and the app version (dify_app_version plus a digest of
+the app's API URL and key), so regenerating an identical report is served
+from the report_cache table instead of the LLM.
+
+- entries expire report_cache_ttl seconds after they were stored
+- beyond report_cache_max_bytes of content the least recently used entries
+  are evicted (one window-function DELETE after every store)
+
+get() and put() don't commit: the caller commits together with the report.
+"""
+import hashlib
+import json
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from ..config import get_settings
+from ..models import ReportCache
+
+
+class ReportCacheService:
+
+    def __init__(self):
+        settings = get_settings()
+        self.enabled = settings.report_cache_enabled
+        self.ttl = settings.report_cache_ttl
+        self.max_bytes = settings.report_cache_max_bytes
+        app = hashlib.sha1(f"{settings.dify_api_url}|{settings.dify_api_key}".encode()).hexdigest()[:12]
+        self.app_version = f"{settings.dify_app_version}:{app}"
+
+    def key(self, report_type: str, context: dict) -> str:
+        """Cache key of a report type and its context."""
+        canonical = json.dumps(context, sort_keys=True, ensure_ascii=False, separators=(',', ':'), default=str)
+        return hashlib.sha1(f"{report_type}\n{canonical}\n{self.app_version}".encode()).hexdigest()
+
+    def get(self, db: Session, cache_key: str) -> Optional[str]:
+        """Cached answer, or None if missing or expired. Counts the hit."""
+        now = datetime.now()
+        entry = db.query(ReportCache).filter(
+            ReportCache.cache_key == cache_key,
+            ReportCache.expires_at > now
+        ).first()
+        if entry is None:
+            return None
+        entry.hit_count = (entry.hit_count or 0) + 1
+        entry.last_used_at = now
+        return entry.content
+
+    def put(self, db: Session, cache_key: str, report_type: str, content: str):
+        """Store an answer (replacing an expired entry of the key) and evict."""
+        now = datetime.now()
+        db.merge(ReportCache(
+            cache_key=cache_key,
+            report_type=report_type,
+            app_version=self.app_version,
+            content=content,
+            content_bytes=len(content.encode()),
+            hit_count=0,
+            last_used_at=now,
+            expires_at=now + timedelta(seconds=self.ttl)
+        ))
+        db.flush()
+        self.evict(db, now)
+
+    def evict(self, db: Session, now: Optional[datetime] = None) -> int:
+        """Delete expired entries, then least recently used ones beyond max_bytes."""
+        expired = db.query(ReportCache).filter(ReportCache.expires_at <= (now or datetime.now()))\
+            .delete(synchronize_session=False)
+        # Running total of content size from the most recently used entry down
+        evicted = db.execute(text("""
+            DELETE FROM report_cache WHERE cache_key IN (
+                SELECT cache_key FROM (
+                    SELECT cache_key,
+                           SUM(content_bytes) OVER (ORDER BY last_used_at DESC, cache_key) AS running_bytes
+                    FROM report_cache
+                ) WHERE running_bytes > :max_bytes
+            )
+        """), {"max_bytes": self.max_bytes}).rowcount
+        return expired + evicted
+
+report_cache = ReportCacheService()
@@ -0,0 +1,106 @@
+"""
+Live content of reports being generated.
+
+A streaming report's content grows chunk by chunk on the API's event loop
+(DifyService), but is only written to the database every
+report_flush_interval seconds. ReportStreamBroker keeps the full content of
+each report generated in this process and fans new chunks out to the SSE
+endpoint (GET /reports/{id}/stream), so a subscriber gets everything so far
+plus every later chunk, independent of the batched writes.
+
+Event types:
+    snapshot: {"content": ...} the content so far, first event of a stream
+    delta: {"text": ...} appended content
+    replace: {"content": ...} content replaced as a whole (Dify moderation)
+    done: {"status": "published" | "failed", "error_message": ...}; ends the stream
+"""
+import asyncio
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+class _ReportStream:
+
+    def __init__(self):
+        self.parts: List[str] = []
+        self.subscribers: List[asyncio.Queue] = []
+
+    @property
+    def content(self) -> str:
+        return ''.join(self.parts)
+
+
+class ReportStreamBroker:
+    """
+    In-process fan-out of report content to SSE subscribers.
+
+    Generation and subscribers share the API's event loop, so no locking is
+    needed. A report is open from its creation (before the background task
+    starts, so early subscribers aren't missed) until close().
+    """
+
+    # Events buffered per subscriber; a client that falls further behind is resynced with a snapshot
+    SUBSCRIBER_BUFFER = 1000
+
+    def __init__(self):
+        self._streams: Dict[int, _ReportStream] = {}
+
+    def open(self, report_id: int):
+        self._streams.setdefault(report_id, _ReportStream())
+
+    def is_open(self, report_id: int) -> bool:
+        return report_id in self._streams
+
+    def content(self, report_id: int) -> Optional[str]:
+        """Content so far of an open report, or None."""
+        stream = self._streams.get(report_id)
+        return stream.content if stream else None
+
+    def append(self, report_id: int, text: str):
+        stream = self._streams.get(report_id)
+        if stream is None or not text:
+            return
+        stream.parts.append(text)
+        self._publish(stream, {"type": "delta", "text": text})
+
+    def replace(self, report_id: int, content: str):
+        stream = self._streams.get(report_id)
+        if stream is None:
+            return
+        stream.parts = [content]
+        self._publish(stream, {"type": "replace", "content": content})
+
+    def close(self, report_id: int, status: str, error_message: Optional[str] = None):
+        """End the report's stream with a done event."""
+        stream = self._streams.pop(report_id, None)
+        if stream is not None:
+            self._publish(stream, {"type": "done", "status": status, "error_message": error_message}, force=True)
+
+    def subscribe(self, report_id: int) -> Optional[Tuple[str, asyncio.Queue]]:
+        """(content so far, queue of later events) of an open report, or None."""
+        stream = self._streams.get(report_id)
+        if stream is None:
+            return None
+        queue = asyncio.Queue(maxsize=self.SUBSCRIBER_BUFFER)
+        stream.subscribers.append(queue)
+        return stream.content, queue
+
+    def unsubscribe(self, report_id: int, queue: asyncio.Queue):
+        stream = self._streams.get(report_id)
+        if stream is not None and queue in stream.subscribers:
+            stream.subscribers.remove(queue)
+
+    def _publish(self, stream: _ReportStream, event: dict, force: bool = False):
+        event = {**event, "time": time.time()}
+        for queue in stream.subscribers:
+            if queue.full():
+                # Lagging subscriber: drop its backlog, resync with the full content
+                while not queue.empty():
+                    queue.get_nowait()
+                if not force:
+                    event_for_queue = {"type": "replace", "content": stream.content, "time": event["time"]}
+                    queue.put_nowait(event_for_queue)
+                    continue
+            queue.put_nowait(event)
+
+report_streams = ReportStreamBroker()
@@ -0,0 +1,77 @@
+"""
+Per-stage timing of report generation.
+
+DifyService.generate_report records where each report's generation time
+went in ai_reports.timing (seconds per stage, below); generation_time is the
+total. stats() aggregates the most recent reports into percentiles per stage
+and the share of the total spent waiting on Dify, to tell whether the LLM or
+our own code (context queries, queueing, database writes) is the bottleneck.
+"""
+from typing import Optional
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from ..models import AIReport
+
+STAGES = {
+    # stage: what it measures
+    "pending": "queued as a background task / batch job before generation started",
+    "context": "loading the report, context queries and cache lookup",
+    "queue_wait": "waiting for a dify_max_concurrency slot",
+    "ttfb": "Dify response headers of the last attempt",
+    "first_event": "first streamed event of the last attempt",
+    "http": "Dify call from the slot to the end of the response, retries included",
+    "retry_wait": "backoff sleeps between attempts",
+    "flush": "partial content writes while streaming",
+    "db_write": "final report write and cache store, commit included",
+    "total": "generation, from its start to the final commit (pending excluded)",
+}
+
+
+class ReportTimingService:
+
+    def stats(
+        self,
+        db: Session,
+        report_type: Optional[str] = None,
+        batch_id: Optional[int] = None,
+        limit: int = 1000
+    ) -> dict:
+        """Percentiles per stage over the latest `limit` reports with a timing."""
+        query = db.query(AIReport.timing, AIReport.status, AIReport.cached)\
+            .filter(AIReport.timing.isnot(None))
+        if report_type:
+            query = query.filter(AIReport.report_type == report_type)
+        if batch_id is not None:
+            query = query.filter(AIReport.batch_id == batch_id)
+        rows = query.order_by(AIReport.report_id.desc()).limit(limit).all()
+
+        stages = {}
+        for stage in STAGES:
+            values = np.array([timing[stage] for timing, _, _ in rows if timing.get(stage) is not None], dtype=float)
+            if not values.size:
+                continue
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            stages[stage] = {
+                "count": int(values.size),
+                "mean": round(float(values.mean()), 4),
+                "p50": round(float(p50), 4),
+                "p95": round(float(p95), 4),
+                "p99": round(float(p99), 4),
+                "max": round(float(values.max()), 4),
+            }
+
+        # Reports that called Dify: share of their generation time spent in the call
+        called = [timing for timing, _, _ in rows if "http" in timing and timing.get("total")]
+        total = sum(timing["total"] for timing in called)
+        return {
+            "reports": len(rows),
+            "cached": sum(1 for _, _, cached in rows if cached),
+            "failed": sum(1 for _, status, _ in rows if status == "failed"),
+            "stages": stages,
+            "dify_share": round(sum(timing["http"] for timing in called) / total, 4) if total else None,
+            "retries": sum(max(0, timing.get("attempts", 1) - 1) for timing, _, _ in rows),
+        }
+
+report_timing = ReportTimingService()
@@ -0,0 +1,179 @@
+"""
+RFM window engine.
+
+Recomputes Recency / Frequency / Monetary for every doctor over an arbitrary
+month-aligned time window. Per-doctor monthly bins (from doctor_monthly_rollups)
+are held as dense numpy arrays with prefix sums along the month axis, so any
+window is answered for all doctors with a few vectorized column operations:
+
+    F = count_cum[:, end + 1] - count_cum[:, start]
+    M = amount_cum[:, end + 1] - amount_cum[:, start]
+    R = reference_date - last payment date of the latest active month <= end
+"""
+from datetime import date
+from threading import Lock
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy.orm import Session
+from sqlalchemy import func
+
+from ..models import DoctorMonthlyRollup
+
+RFM_FEATURES = ('recency_days', 'frequency', 'monetary')
+
+_EPOCH = np.datetime64('1970-01-01', 'D')
+
+
+def _to_month(value: date) -> np.datetime64:
+    return np.datetime64(value, 'M')
+
+
+def _to_day(value: date) -> int:
+    return int((np.datetime64(value, 'D') - _EPOCH).astype(np.int64))
+
+
+class RFMWindowEngine:
+    """
+    Dense (doctor x month) payment bins with cumulative sums.
+
+    Attributes:
+        npis: Doctor NPIs, one per row
+        months: First day of each month column (consecutive, datetime64[M])
+    """
+
+    def __init__(self, npis: np.ndarray, months: np.ndarray,
+                 counts: np.ndarray, amounts: np.ndarray, last_days: np.ndarray):
+        n_doctors, n_months = counts.shape
+        self.npis = npis
+        self.months = months
+
+        # Prefix sums with a leading zero column: window sums are one subtraction
+        self.count_cum = np.zeros((n_doctors, n_months + 1), dtype=np.int64)
+        np.cumsum(counts, axis=1, out=self.count_cum[:, 1:])
+        self.amount_cum = np.zeros((n_doctors, n_months + 1), dtype=np.float64)
+        np.cumsum(amounts, axis=1, out=self.amount_cum[:, 1:])
+
+        # Last payment day per bin, and for each month the index of the latest
+        # active month at or before it (-1 if none): a prefix max over indices
+        self.last_days = last_days
+        active_index = np.where(counts > 0, np.arange(n_months, dtype=np.int32), -1)
+        self.last_active = np.maximum.accumulate(active_index, axis=1)
+
+    @classmethod
+    def from_db(cls, db: Session) -> "RFMWindowEngine":
+        """Build the dense bins from doctor_monthly_rollups."""
+        query = db.query(
+            DoctorMonthlyRollup.npi,
+            DoctorMonthlyRollup.month,
+            DoctorMonthlyRollup.payment_count,
+            DoctorMonthlyRollup.total_amount,
+            DoctorMonthlyRollup.last_payment_date
+        )
+        df = pd.read_sql(query.statement, db.bind)
+        if df.empty:
+            raise ValueError("No monthly rollups available, run the ETL first")
+
+        row_index, npis = pd.factorize(df['npi'])
+        month_values = pd.to_datetime(df['month']).values.astype('datetime64[M]')
+        first_month = month_values.min()
+        col_index = (month_values - first_month).astype(np.int64)
+        n_months = int(col_index.max()) + 1
+        shape = (len(npis), n_months)
+
+        counts = np.zeros(shape, dtype=np.int32)
+        counts[row_index, col_index] = df['payment_count'].values
+        amounts = np.zeros(shape, dtype=np.float64)
+        amounts[row_index, col_index] = df['total_amount'].values
+        last_days = np.full(shape, -1, dtype=np.int32)
+        last_dates = pd.to_datetime(df['last_payment_date']).values.astype('datetime64[D]')
+        last_days[row_index, col_index] = (last_dates - _EPOCH).astype(np.int32)
+
+        months = first_month + np.arange(n_months)
+        return cls(np.asarray(npis, dtype=object), months, counts, amounts, last_days)
+
+    def _month_range(self, window_start: Optional[date], window_end: Optional[date]) -> Tuple[int, int]:
+        """Clamp a date window to (start, end) month column indices, inclusive."""
+        last = len(self.months) - 1
+        start = 0 if window_start is None else int((_to_month(window_start) - self.months[0]).astype(int))
+        end = last if window_end is None else int((_to_month(window_end) - self.months[0]).astype(int))
+        return max(start, 0), min(end, last)
+
+    def compute(
+        self,
+        window_start: Optional[date] = None,
+        window_end: Optional[date] = None,
+        reference_date: Optional[date] = None
+    ) -> pd.DataFrame:
+        """
+        RFM for all doctors with at least one payment in the window.
+
+        Args:
+            window_start: First day of the window (month-aligned), None for the first month
+            window_end: Last day of the window (month-aligned, inclusive), None for the last month
+            reference_date: Date Recency is measured from, defaults to window_end
+                (or the last day of the last month)
+
+        Returns:
+            DataFrame with columns npi, recency_days, frequency, monetary
+        """
+        start, end = self._month_range(window_start, window_end)
+        empty = pd.DataFrame({'npi': [], 'recency_days': [], 'frequency': [], 'monetary': []})
+        if start > end:
+            return empty
+
+        frequency = self.count_cum[:, end + 1] - self.count_cum[:, start]
+        monetary = self.amount_cum[:, end + 1] - self.amount_cum[:, start]
+        latest = self.last_active[:, end]
+        active = np.flatnonzero((frequency > 0) & (latest >= start))
+        if active.size == 0:
+            return empty
+
+        if reference_date is None:
+            reference_date = window_end
+        if reference_date is None:
+            # Last day of the last month
+            next_month = (self.months[-1] + 1).astype('datetime64[D]')
+            reference_day = int((next_month - _EPOCH).astype(np.int64)) - 1
+        else:
+            reference_day = _to_day(reference_date)
+
+        last_day = self.last_days[active, latest[active]]
+        # Month-aligned windows may include payments after a mid-month reference date
+        recency = np.maximum(reference_day - last_day, 0)
+
+        return pd.DataFrame({
+            'npi': self.npis[active],
+            'recency_days': recency.astype(np.int64),
+            'frequency': frequency[active],
+            'monetary': monetary[active]
+        })
+
+
+_engine: Optional[RFMWindowEngine] = None
+_engine_version = None
+_engine_lock = Lock()
+
+
+def rollup_version(db: Session) -> tuple:
+    """Cheap fingerprint of doctor_monthly_rollups, changes whenever the ETL reloads it."""
+    return tuple(db.query(
+        func.count(),
+        func.max(DoctorMonthlyRollup.month),
+        func.sum(DoctorMonthlyRollup.payment_count)
+    ).select_from(DoctorMonthlyRollup).one())
+
+
+def get_engine(db: Session) -> RFMWindowEngine:
+    """
+    Return the process-wide engine, rebuilding it when the rollups changed.
+    """
+    global _engine, _engine_version
+    version = rollup_version(db)
+
+    with _engine_lock:
+        if _engine is None or _engine_version != version:
+            _engine = RFMWindowEngine.from_db(db)
+            _engine_version = version
+        return _engine
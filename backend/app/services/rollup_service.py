@@ -0,0 +1,102 @@
+"""
+Rollup Service for time-windowed payment analytics.
+
+Reads the monthly doctor / manufacturer rollups built by the ETL instead of
+scanning payment_records. Windows are month-aligned: a window from 2024-07-15
+to 2024-09-02 covers the July, August and September rollups.
+"""
+from datetime import date
+from typing import Optional, List
+
+from sqlalchemy.orm import Session
+from sqlalchemy import func, desc
+
+from ..models import DoctorMonthlyRollup, ManufacturerMonthlyRollup
+
+
+def month_start(value: date) -> date:
+    """Return the first day of the month containing `value`."""
+    return value.replace(day=1)
+
+
+class RollupService:
+
+    def _apply_window(self, query, month_column, start: Optional[date], end: Optional[date]):
+        if start:
+            query = query.filter(month_column >= month_start(start))
+        if end:
+            query = query.filter(month_column <= month_start(end))
+        return query
+
+    def doctor_monthly(
+        self,
+        db: Session,
+        npi: str,
+        start: Optional[date] = None,
+        end: Optional[date] = None
+    ) -> List[DoctorMonthlyRollup]:
+        """Monthly rollups of one doctor within the window, oldest first."""
+        query = db.query(DoctorMonthlyRollup).filter(DoctorMonthlyRollup.npi == npi)
+        query = self._apply_window(query, DoctorMonthlyRollup.month, start, end)
+        return query.order_by(DoctorMonthlyRollup.month).all()
+
+    def summarize_window(self, rollups: List[DoctorMonthlyRollup]) -> dict:
+        """
+        Window totals from monthly rollups.
+        Distinct manufacturers are not additive across months, so they are not summarized.
+        """
+        return {
+            "payment_count": sum(r.payment_count for r in rollups),
+            "total_amount": float(sum(r.total_amount for r in rollups)),
+            "max_amount": max((r.max_amount for r in rollups if r.max_amount is not None), default=None),
+            "last_payment_date": max(
+                (r.last_payment_date for r in rollups if r.last_payment_date is not None), default=None
+            ),
+            "active_months": len(rollups)
+        }
+
+    def manufacturer_monthly(
+        self,
+        db: Session,
+        manufacturer_name: str,
+        start: Optional[date] = None,
+        end: Optional[date] = None
+    ) -> List[ManufacturerMonthlyRollup]:
+        """Monthly trend of one manufacturer within the window, oldest first."""
+        query = db.query(ManufacturerMonthlyRollup)\
+            .filter(ManufacturerMonthlyRollup.manufacturer_name == manufacturer_name)
+        query = self._apply_window(query, ManufacturerMonthlyRollup.month, start, end)
+        return query.order_by(ManufacturerMonthlyRollup.month).all()
+
+    def top_manufacturers(
+        self,
+        db: Session,
+        start: Optional[date] = None,
+        end: Optional[date] = None,
+        limit: int = 20
+    ) -> List[dict]:
+        """Manufacturers ranked by total amount paid within the window."""
+        total_amount = func.sum(ManufacturerMonthlyRollup.total_amount).label("total_amount")
+        query = db.query(
+            ManufacturerMonthlyRollup.manufacturer_name,
+            func.sum(ManufacturerMonthlyRollup.payment_count).label("payment_count"),
+            total_amount,
+            func.max(ManufacturerMonthlyRollup.max_amount).label("max_amount")
+        )
+        query = self._apply_window(query, ManufacturerMonthlyRollup.month, start, end)
+        rows = query.group_by(ManufacturerMonthlyRollup.manufacturer_name)\
+            .order_by(desc(total_amount))\
+            .limit(limit)\
+            .all()
+
+        return [
+            {
+                "manufacturer_name": r.manufacturer_name,
+                "payment_count": int(r.payment_count or 0),
+                "total_amount": float(r.total_amount or 0),
+                "max_amount": r.max_amount
+            }
+            for r in rows
+        ]
+
+rollup_service = RollupService()
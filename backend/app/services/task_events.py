@@ -0,0 +1,110 @@
+"""
+Analysis task progress events.
+
+Worker processes report progress by putting events on a multiprocessing queue
+instead of committing task.progress: report() in the worker, the task runner
+forwards queued events to task_event_broker in the API process, and the SSE
+endpoint (GET /analysis/tasks/{id}/events) pushes them to clients. Only status
+changes (running, completed, failed, cancelled) and the final progress_detail
+are still written to the database.
+
+Event types:
+    progress: {"progress": 0-100, "stage": ...}
+    fit: fine-grained fit progress (per n_init run, MiniBatch epoch or sweep K)
+    stage: {"stage": ..., "seconds": ...} when a stage finishes
+    segment: {"segment": ..., "done": n, "total": n, "k": ...} per finished segment (segmented clustering)
+    status: {"status": ...} on a status change; completed/failed/cancelled end the stream
+"""
+import asyncio
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+TERMINAL_STATUSES = ("completed", "failed", "cancelled")
+
+# Worker side: set by bind() in the worker process
+_queue = None
+
+
+def bind(queue):
+    """Route report() calls of this (worker) process to the task runner's queue."""
+    global _queue
+    _queue = queue
+
+
+def report(task_id: Optional[int], event_type: str, **data):
+    """
+    Report a task event. Never blocks and never raises; a no-op outside a
+    worker process or for tasks without an id.
+    """
+    if _queue is None or not task_id:
+        return
+    try:
+        _queue.put_nowait({"task_id": task_id, "type": event_type, "time": time.time(), **data})
+    except Exception:
+        pass
+
+
+class TaskEventBroker:
+    """
+    In-process fan-out of task events to SSE subscribers.
+
+    Events are published from the task runner threads and delivered to
+    asyncio queues on the subscribers' event loops. The latest progress event
+    of each running task is kept for late subscribers and task reads.
+    """
+
+    # Events buffered per subscriber; a client that falls further behind misses events
+    SUBSCRIBER_BUFFER = 1000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latest: Dict[int, dict] = {}
+        self._subscribers: Dict[int, List[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = defaultdict(list)
+
+    def publish(self, event: dict):
+        task_id = event["task_id"]
+        with self._lock:
+            if event["type"] == "progress":
+                self._latest[task_id] = event
+            elif event["type"] == "status" and event.get("status") in TERMINAL_STATUSES:
+                self._latest.pop(task_id, None)
+            subscribers = list(self._subscribers.get(task_id, ()))
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(self._offer, queue, event)
+            except RuntimeError:
+                pass  # Subscriber's loop already closed
+
+    def publish_status(self, task_id: int, status: str, **data):
+        """Publish a status change made outside a worker (cancel, timeout, crash)."""
+        self.publish({"task_id": task_id, "type": "status", "time": time.time(), "status": status, **data})
+
+    def latest(self, task_id: int) -> Optional[dict]:
+        """Latest progress event of a running task, or None."""
+        with self._lock:
+            return self._latest.get(task_id)
+
+    def subscribe(self, task_id: int) -> asyncio.Queue:
+        """Queue receiving the task's events; call from the subscriber's event loop."""
+        queue = asyncio.Queue(maxsize=self.SUBSCRIBER_BUFFER)
+        with self._lock:
+            self._subscribers[task_id].append((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, task_id: int, queue: asyncio.Queue):
+        with self._lock:
+            subscribers = self._subscribers.get(task_id, [])
+            subscribers[:] = [s for s in subscribers if s[1] is not queue]
+            if not subscribers:
+                self._subscribers.pop(task_id, None)
+
+    @staticmethod
+    def _offer(queue: asyncio.Queue, event: dict):
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            pass
+
+task_event_broker = TaskEventBroker()
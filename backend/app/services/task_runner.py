@@ -0,0 +1,273 @@
+"""
+Analysis task execution engine.
+
+Analysis tasks are queued in the analysis_tasks table (status "pending"), so
+the queue survives API restarts. A dispatcher thread in the API process claims
+pending tasks atomically (pending -> running) and runs each one in its own
+worker process with its own database session, keeping CPU-bound numerical
+work out of the API process.
+
+- analysis_max_workers bounds the number of concurrent worker processes
+- analysis_type_limits caps concurrent tasks per task_type
+- each task is granted cores from a shared CPU budget and its worker caps
+  its BLAS/OpenMP threads and lowers its priority (see cpu_governor)
+- a task whose status becomes "cancelled" (or whose row is deleted) has its
+  worker terminated
+- a task running longer than its timeout (timeout_seconds parameter, default
+  analysis_task_timeout) is terminated and marked failed
+- tasks left "running" by a previous API process are re-queued on start, and
+  tasks still running at shutdown are re-queued as well
+- progress events reported by workers arrive on a multiprocessing queue and
+  are forwarded to task_event_broker (see task_events)
+
+Only one API process should run the dispatcher (analysis_runner_enabled).
+"""
+import json
+import multiprocessing
+import queue
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Optional
+
+from sqlalchemy.orm import Session
+
+from ..config import get_settings
+from ..database import SessionLocal
+from ..models import AnalysisTask
+from .analysis_service import analysis_service
+from . import cpu_governor, task_events
+from .task_events import task_event_broker
+
+# task_type -> callable(db, task_id), resolved by name inside the worker process
+TASK_HANDLERS = {
+    "clustering": analysis_service.perform_clustering,
+    "k_sweep": analysis_service.perform_k_sweep,
+    "segmented_clustering": analysis_service.perform_segmented_clustering,
+    "stability": analysis_service.perform_stability,
+}
+
+
+def _worker_main(task_id: int, task_type: str, events, threads: int):
+    """Entry point of a worker process: run one task with its own session on `threads` cores."""
+    cpu_governor.apply_worker_limits(threads)
+    task_events.bind(events)
+    db = SessionLocal()
+    try:
+        TASK_HANDLERS[task_type](db, task_id)
+    finally:
+        db.close()
+
+
+class TaskRunner:
+
+    def __init__(self):
+        settings = get_settings()
+        self.max_workers = settings.analysis_max_workers
+        self.type_limits = settings.analysis_type_limits
+        self.default_timeout = settings.analysis_task_timeout
+        self.poll_interval = settings.analysis_poll_interval
+        self.cpu_budget = cpu_governor.CpuBudget()
+
+        # task_id -> {"process", "task_type", "threads", "deadline", "timeout"}
+        self._jobs: Dict[int, dict] = {}
+        self._ctx = multiprocessing.get_context("spawn")
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._events = None
+        self._forwarder: Optional[threading.Thread] = None
+
+    def start(self):
+        """Re-queue interrupted tasks and start the dispatcher thread."""
+        if self._thread and self._thread.is_alive():
+            return
+        db = SessionLocal()
+        try:
+            requeued = self._requeue(db, AnalysisTask.status == "running")
+            if requeued:
+                print(f"Re-queued {requeued} interrupted analysis task(s).")
+        finally:
+            db.close()
+
+        self._stop.clear()
+        self._events = self._ctx.Queue()
+        self._forwarder = threading.Thread(target=self._forward_events, name="analysis-task-events", daemon=True)
+        self._forwarder.start()
+        self._thread = threading.Thread(target=self._run, name="analysis-task-runner", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop dispatching, terminate workers and re-queue their tasks."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+        if self._jobs:
+            task_ids = list(self._jobs)
+            for task_id in task_ids:
+                self._terminate(task_id)
+            db = SessionLocal()
+            try:
+                self._requeue(db, AnalysisTask.task_id.in_(task_ids))
+            finally:
+                db.close()
+
+        if self._forwarder:
+            self._events.put(None)
+            self._forwarder.join()
+            self._forwarder = None
+            self._events.close()
+            self._events = None
+
+    def wake(self):
+        """Dispatch now instead of waiting for the next poll (new or cancelled task)."""
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            db = SessionLocal()
+            try:
+                self._reap(db)
+                self._dispatch(db)
+            except Exception as e:
+                db.rollback()
+                print(f"Task runner error: {e}")
+            finally:
+                db.close()
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def _forward_events(self):
+        """Move worker progress events to the broker until stop() sends None."""
+        while True:
+            try:
+                event = self._events.get(timeout=1)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                return
+            if event is None:
+                return
+            task_event_broker.publish(event)
+
+    def _reap(self, db: Session):
+        """Collect finished workers and enforce cancellation and timeouts."""
+        if not self._jobs:
+            return
+        statuses = dict(
+            db.query(AnalysisTask.task_id, AnalysisTask.status)
+            .filter(AnalysisTask.task_id.in_(list(self._jobs)))
+            .all()
+        )
+        now = time.monotonic()
+
+        for task_id, job in list(self._jobs.items()):
+            process = job["process"]
+            status = statuses.get(task_id, "cancelled")  # Deleted rows count as cancelled
+
+            if not process.is_alive():
+                process.join()
+                self._release(task_id)
+                if status == "running":
+                    # Crashed without recording a result (e.g. killed by the OS)
+                    self._finish(db, task_id, "failed", f"Worker exited with code {process.exitcode}")
+            elif status == "cancelled":
+                self._terminate(task_id)
+                task_event_broker.publish_status(task_id, "cancelled")
+                print(f"Analysis task {task_id} cancelled.")
+            elif now > job["deadline"]:
+                self._terminate(task_id)
+                self._finish(db, task_id, "failed", f"Timed out after {job['timeout']} seconds")
+
+    def _dispatch(self, db: Session):
+        """Claim pending tasks up to the worker and per-type limits and the CPU budget."""
+        free = self.max_workers - len(self._jobs)
+        if free <= 0:
+            return
+        running_by_type = Counter(job["task_type"] for job in self._jobs.values())
+
+        pending = db.query(AnalysisTask)\
+            .filter(AnalysisTask.status == "pending")\
+            .filter(AnalysisTask.task_type.in_(list(TASK_HANDLERS)))\
+            .order_by(AnalysisTask.task_id)\
+            .limit(50)\
+            .all()
+
+        for task in pending:
+            if free <= 0:
+                break
+            limit = self.type_limits.get(task.task_type, self.max_workers)
+            if running_by_type[task.task_type] >= limit:
+                continue
+            threads = self.cpu_budget.grant(task.task_id)
+            if not threads:
+                break
+
+            # Atomic claim: another dispatcher or a cancellation may have won
+            claimed = db.query(AnalysisTask)\
+                .filter(AnalysisTask.task_id == task.task_id, AnalysisTask.status == "pending")\
+                .update({"status": "running", "started_at": datetime.now()}, synchronize_session=False)
+            db.commit()
+            if not claimed:
+                self.cpu_budget.release(task.task_id)
+                continue
+
+            params = json.loads(task.parameters) if task.parameters else {}
+            timeout = int(params.get("timeout_seconds", self.default_timeout))
+            process = self._ctx.Process(
+                target=_worker_main,
+                args=(task.task_id, task.task_type, self._events, threads),
+                name=f"analysis-task-{task.task_id}"
+            )
+            process.start()
+            self._jobs[task.task_id] = {
+                "process": process,
+                "task_type": task.task_type,
+                "threads": threads,
+                "deadline": time.monotonic() + timeout,
+                "timeout": timeout
+            }
+            running_by_type[task.task_type] += 1
+            free -= 1
+            task_event_broker.publish_status(task.task_id, "running")
+            print(f"Analysis task {task.task_id} ({task.task_type}) started in worker pid {process.pid} "
+                  f"on {threads} core(s).")
+
+    def _terminate(self, task_id: int):
+        process = self._jobs[task_id]["process"]
+        process.terminate()
+        process.join(timeout=10)
+        if process.is_alive():
+            process.kill()
+            process.join()
+        self._release(task_id)
+
+    def _release(self, task_id: int):
+        """Forget a finished job and return its cores to the budget."""
+        del self._jobs[task_id]
+        self.cpu_budget.release(task_id)
+
+    def _finish(self, db: Session, task_id: int, status: str, error_message: str):
+        db.query(AnalysisTask)\
+            .filter(AnalysisTask.task_id == task_id, AnalysisTask.status == "running")\
+            .update({
+                "status": status,
+                "error_message": error_message,
+                "completed_at": datetime.now()
+            }, synchronize_session=False)
+        db.commit()
+        task_event_broker.publish_status(task_id, status, error_message=error_message)
+        print(f"Analysis task {task_id} {status}: {error_message}")
+
+    def _requeue(self, db: Session, condition) -> int:
+        count = db.query(AnalysisTask)\
+            .filter(condition, AnalysisTask.status == "running")\
+            .update({"status": "pending", "progress": 0, "started_at": None}, synchronize_session=False)
+        db.commit()
+        return count
+
+task_runner = TaskRunner()
@@ -0,0 +1,267 @@
+"""
+Level-of-detail visualization data for clustering results.
+
+While a clustering is saved, the labelled population is binned per cluster
+into 2D histograms of every feature pair and (for exactly three features) a 3D
+histogram, and cluster-stratified samples are drawn. Each detail level is
+stored as one compressed .npz payload in cluster_viz_levels:
+
+    level 0: 16² / 8³ bins,    2,000 sample points
+    level 1: 64² / 16³ bins,  10,000 sample points
+    level 2: 256² / 32³ bins, 40,000 sample points
+
+Only the first MAX_FEATURES features are binned (payment-mix results can
+have many), so grid memory stays bounded.
+
+Coordinates are in display space (log1p for skewed features), so the bins
+are even on the chart axes. The finest grids are accumulated chunk by chunk
+and coarser levels are block sums of them. GET /analysis/results/{id}/viz
+serves a level, optionally cropped to the visible bounds, as base64 typed arrays.
+"""
+import base64
+import io
+from itertools import combinations
+from typing import Dict, List, Optional
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from ..models import ClusterVizLevel
+from .cluster_metrics import stratified_sample
+
+GRID_BINS = [16, 64, 256]
+GRID_BINS_3D = [8, 16, 32]
+SAMPLE_SIZES = [2000, 10000, 40000]
+SAMPLE_SEED = 42
+MAX_FEATURES = 4
+
+
+def display_transform(raw, features: List[str], log_features: List[str]) -> np.ndarray:
+    """Raw feature values -> display coordinates (log1p on skewed features)."""
+    X = np.array(raw, dtype=np.float64, ndmin=2)
+    for j, f in enumerate(features):
+        if f in log_features:
+            X[:, j] = np.log1p(np.maximum(X[:, j], 0))
+    return X
+
+
+class VizBuilder:
+    """
+    Accumulates per-cluster histograms over chunks of (raw features, labels).
+
+    Args:
+        features, log_features: Feature names and the log1p-displayed ones
+        n_clusters: Number of clusters
+        lower, upper: Per-feature display-space range of the population
+    """
+
+    def __init__(self, features: List[str], log_features: List[str], n_clusters: int, lower, upper):
+        self.features = list(features)
+        self.log_features = [f for f in log_features if f in self.features]
+        self.n_clusters = n_clusters
+        lower = np.asarray(lower, dtype=np.float64)
+        upper = np.asarray(upper, dtype=np.float64)
+        # Degenerate ranges still get a bin width
+        self.lower = lower
+        self.upper = np.where(upper > lower, upper, lower + 1)
+        self.pairs = list(combinations(range(min(len(self.features), MAX_FEATURES)), 2))
+
+        bins, bins_3d = GRID_BINS[-1], GRID_BINS_3D[-1]
+        self._grids = {pair: np.zeros(n_clusters * bins * bins, dtype=np.int64) for pair in self.pairs}
+        self._grid_3d = np.zeros(n_clusters * bins_3d ** 3, dtype=np.int64) if len(self.features) == 3 else None
+
+    def _bin(self, X, bins: int) -> np.ndarray:
+        scaled = (X - self.lower) / (self.upper - self.lower) * bins
+        return np.clip(scaled.astype(np.int64), 0, bins - 1)
+
+    def update(self, raw, labels):
+        X = display_transform(raw, self.features, self.log_features)
+        labels = np.asarray(labels, dtype=np.int64)
+        bins, bins_3d = GRID_BINS[-1], GRID_BINS_3D[-1]
+
+        idx = self._bin(X, bins)
+        for i, j in self.pairs:
+            flat = (labels * bins + idx[:, i]) * bins + idx[:, j]
+            self._grids[(i, j)] += np.bincount(flat, minlength=self._grids[(i, j)].size)
+        if self._grid_3d is not None:
+            idx = self._bin(X, bins_3d)
+            flat = ((labels * bins_3d + idx[:, 0]) * bins_3d + idx[:, 1]) * bins_3d + idx[:, 2]
+            self._grid_3d += np.bincount(flat, minlength=self._grid_3d.size)
+
+    def build(self, sample_raw, sample_labels) -> Dict[int, bytes]:
+        """
+        Payload of every level from the accumulated grids and a pool of
+        labelled rows to draw the stratified samples from.
+        """
+        sample_raw = np.asarray(sample_raw)
+        sample_labels = np.asarray(sample_labels)
+        payloads = {}
+        for level, (bins, bins_3d, size) in enumerate(zip(GRID_BINS, GRID_BINS_3D, SAMPLE_SIZES)):
+            arrays = {
+                'lower': self.lower.astype(np.float32),
+                'upper': self.upper.astype(np.float32),
+            }
+            for i, j in self.pairs:
+                grid = self._downsample(self._grids[(i, j)], GRID_BINS[-1], bins, dims=2)
+                arrays.update(self._sparse(f'grid_{i}_{j}', grid))
+            if self._grid_3d is not None:
+                grid = self._downsample(self._grid_3d, GRID_BINS_3D[-1], bins_3d, dims=3)
+                arrays.update(self._sparse('grid3d', grid))
+
+            idx = stratified_sample(sample_labels, size, SAMPLE_SEED)
+            arrays['sample_cluster'] = sample_labels[idx].astype(np.uint8)
+            arrays['sample_coords'] = display_transform(
+                sample_raw[idx], self.features, self.log_features
+            )[:, :MAX_FEATURES].astype(np.float32)
+
+            buffer = io.BytesIO()
+            np.savez_compressed(buffer, **arrays)
+            payloads[level] = buffer.getvalue()
+        return payloads
+
+    def _downsample(self, flat, fine: int, bins: int, dims: int) -> np.ndarray:
+        """(n_clusters, bins, ...) counts from the finest grid by block sums."""
+        factor = fine // bins
+        grid = flat.reshape((self.n_clusters,) + (fine,) * dims)
+        shape = (self.n_clusters,) + sum(((bins, factor) for _ in range(dims)), ())
+        return grid.reshape(shape).sum(axis=tuple(range(2, 2 + 2 * dims, 2)))
+
+    @staticmethod
+    def _sparse(name: str, grid: np.ndarray) -> dict:
+        """Non-empty cells as (cluster, flat cell index, count) columns."""
+        cluster, cell = np.nonzero(grid.reshape(grid.shape[0], -1))
+        counts = grid.reshape(grid.shape[0], -1)[cluster, cell]
+        return {
+            f'{name}_cluster': cluster.astype(np.uint8),
+            f'{name}_cell': cell.astype(np.uint32),
+            f'{name}_count': counts.astype(np.uint32),
+        }
+
+
+def population_builder(features, log_features, n_clusters: int, raw, labels,
+                       chunk_size: int = 100000) -> VizBuilder:
+    """VizBuilder accumulated over an in-memory population (raw may be memory-mapped)."""
+    lower = np.full(len(features), np.inf)
+    upper = np.full(len(features), -np.inf)
+    for start in range(0, len(raw), chunk_size):
+        X = display_transform(raw[start:start + chunk_size], features, log_features)
+        lower = np.minimum(lower, X.min(axis=0))
+        upper = np.maximum(upper, X.max(axis=0))
+
+    builder = VizBuilder(features, log_features, n_clusters, lower, upper)
+    for start in range(0, len(raw), chunk_size):
+        builder.update(raw[start:start + chunk_size], labels[start:start + chunk_size])
+    return builder
+
+
+def save_levels(db: Session, result_id: int, payloads: Dict[int, bytes]):
+    """Store the payloads of a result. The caller commits."""
+    for level, payload in payloads.items():
+        db.add(ClusterVizLevel(result_id=result_id, level=level, payload=payload))
+
+
+def _encode(array: np.ndarray) -> dict:
+    """Typed array as {dtype, shape, data (base64, little-endian)}."""
+    array = np.ascontiguousarray(array)
+    return {
+        'dtype': array.dtype.name,
+        'shape': list(array.shape),
+        'data': base64.b64encode(array.astype(array.dtype.newbyteorder('<')).tobytes()).decode('ascii'),
+    }
+
+
+def load_level(db: Session, result_id: int, features: List[str], log_features: List[str], level: int,
+               x: str, y: str, z: Optional[str] = None, bounds: Optional[dict] = None) -> Optional[dict]:
+    """
+    One detail level of a result for the x/y (and optional z, 3D grid) axes,
+    optionally cropped to display-space bounds {x_min, x_max, y_min, y_max}.
+
+    Returns:
+        dict for ClusterVizResponse, or None if the result has no stored level
+    """
+    payload = db.query(ClusterVizLevel.payload)\
+        .filter(ClusterVizLevel.result_id == result_id, ClusterVizLevel.level == level)\
+        .scalar()
+    if payload is None:
+        return None
+    data = np.load(io.BytesIO(payload))
+    lower, upper = data['lower'], data['upper']
+    features = list(features)
+    for name in (x, y, z):
+        if name is not None and name not in features[:MAX_FEATURES]:
+            raise ValueError(f"Feature {name} has no visualization data in this result")
+    axes = [features.index(x), features.index(y)] + ([features.index(z)] if z else [])
+    if len(set(axes)) != len(axes):
+        raise ValueError("Axes must be different features")
+
+    def axis_info(index, bins):
+        return {
+            'feature': features[index],
+            'transform': 'log1p' if features[index] in log_features else 'linear',
+            'min': float(lower[index]),
+            'max': float(upper[index]),
+            'bins': bins,
+        }
+
+    # Sample points inside the bounds
+    coords = data['sample_coords'][:, axes]
+    keep = np.ones(len(coords), dtype=bool)
+    for axis, name in enumerate(('x', 'y')):
+        if bounds and bounds.get(f'{name}_min') is not None:
+            keep &= coords[:, axis] >= bounds[f'{name}_min']
+        if bounds and bounds.get(f'{name}_max') is not None:
+            keep &= coords[:, axis] <= bounds[f'{name}_max']
+    sample = {
+        'cluster': _encode(data['sample_cluster'][keep]),
+        'coords': _encode(coords[keep]),
+    }
+
+    if z:
+        if 'grid3d_cell' not in data.files:
+            raise ValueError("3D grids are stored for results with exactly three features")
+        bins = GRID_BINS_3D[level]
+        grid = _grid_columns(data, 'grid3d', axes, bins, dims=3)
+    else:
+        bins = GRID_BINS[level]
+        i, j = sorted(axes)
+        grid = _grid_columns(data, f'grid_{i}_{j}', (0, 1) if axes[0] < axes[1] else (1, 0), bins, dims=2)
+        grid = _crop(grid, bounds, lower[axes], upper[axes], bins)
+
+    return {
+        'result_id': result_id,
+        'level': level,
+        'levels': len(GRID_BINS),
+        'features': features[:MAX_FEATURES],
+        'axes': [axis_info(index, bins) for index in axes],
+        'grid': {name: _encode(values) for name, values in grid.items()},
+        'sample': sample,
+        'sample_size': int(len(data['sample_cluster'])),
+    }
+
+
+def _grid_columns(data, name: str, order, bins: int, dims: int) -> dict:
+    """Sparse grid as cluster + per-axis bin index columns, axes in the requested order."""
+    cell = data[f'{name}_cell'].astype(np.int64)
+    index = []
+    for _ in range(dims):
+        index.insert(0, cell % bins)
+        cell //= bins
+    columns = {'cluster': data[f'{name}_cluster'], 'count': data[f'{name}_count']}
+    for axis, stored in zip(('x', 'y', 'z'), order):
+        columns[axis] = index[stored].astype(np.uint16)
+    return columns
+
+
+def _crop(grid: dict, bounds: Optional[dict], lower, upper, bins: int) -> dict:
+    """Keep the cells overlapping the display-space bounds."""
+    if not bounds:
+        return grid
+    keep = np.ones(len(grid['cluster']), dtype=bool)
+    for axis, name in enumerate(('x', 'y')):
+        width = (upper[axis] - lower[axis]) / bins
+        cell_min = lower[axis] + grid[name].astype(np.float64) * width
+        if bounds.get(f'{name}_min') is not None:
+            keep &= cell_min + width >= bounds[f'{name}_min']
+        if bounds.get(f'{name}_max') is not None:
+            keep &= cell_min <= bounds[f'{name}_max']
+    return {name: values[keep] for name, values in grid.items()}
@@ -74,6 +74,11 @@ def main():
             ("inertia", "FLOAT"),
             ("visualization_data", "TEXT"),
             ("is_active", "BOOLEAN DEFAULT 1"),
+            ("is_current", "BOOLEAN DEFAULT 0"),
+            ("model_params", "JSON"),
+            ("quality_metrics", "JSON"),
+            ("segment_by", "VARCHAR(50)"),
+            ("segment_value", "VARCHAR(200)"),
         ]
         
         for col_name, col_type in cluster_columns:
@@ -106,12 +111,29 @@ def main():
                 completed_at DATETIME,
                 created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
                 result_id INTEGER,
+                progress_detail JSON,
                 FOREIGN KEY (created_by) REFERENCES users(id),
                 FOREIGN KEY (result_id) REFERENCES cluster_results(cluster_id)
             )
         """)
         print("   ✅ Created table: analysis_tasks")
         
+        # Columns added to analysis_tasks after its first release
+        task_columns = [
+            ("progress_detail", "JSON"),
+            ("fingerprint", "VARCHAR(40)"),
+        ]
+        
+        for col_name, col_type in task_columns:
+            try:
+                cursor.execute(f"ALTER TABLE analysis_tasks ADD COLUMN {col_name} {col_type}")
+                print(f"   ✅ Added column: analysis_tasks.{col_name}")
+            except sqlite3.OperationalError as e:
+                if "duplicate column name" in str(e):
+                    print(f"   ⏭️  Column already exists: analysis_tasks.{col_name}")
+                else:
+                    raise
+        
         # AIReport table
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS ai_reports (
@@ -136,6 +158,55 @@ def main():
         """)
         print("   ✅ Created table: ai_reports")
         
+        # Columns added to ai_reports after its first release
+        report_columns = [
+            ("cached", "BOOLEAN DEFAULT 0"),
+            ("batch_id", "INTEGER REFERENCES report_batches(batch_id)"),
+            ("timing", "JSON"),
+        ]
+        
+        for col_name, col_type in report_columns:
+            try:
+                cursor.execute(f"ALTER TABLE ai_reports ADD COLUMN {col_name} {col_type}")
+                print(f"   ✅ Added column: ai_reports.{col_name}")
+            except sqlite3.OperationalError as e:
+                if "duplicate column name" in str(e):
+                    print(f"   ⏭️  Column already exists: ai_reports.{col_name}")
+                else:
+                    raise
+        
+        # Batch report generation requests
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS report_batches (
+                batch_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                target VARCHAR(20) NOT NULL,
+                report_type VARCHAR(50) NOT NULL,
+                parameters JSON,
+                total INTEGER NOT NULL,
+                created_by INTEGER NOT NULL,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                finished_at DATETIME,
+                FOREIGN KEY (created_by) REFERENCES users(id)
+            )
+        """)
+        print("   ✅ Created table: report_batches")
+        
+        # Dify answer cache
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS report_cache (
+                cache_key VARCHAR(40) PRIMARY KEY,
+                report_type VARCHAR(50) NOT NULL,
+                app_version VARCHAR(100) NOT NULL,
+                content TEXT NOT NULL,
+                content_bytes INTEGER NOT NULL,
+                hit_count INTEGER DEFAULT 0,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                last_used_at DATETIME NOT NULL,
+                expires_at DATETIME NOT NULL
+            )
+        """)
+        print("   ✅ Created table: report_cache")
+        
         # SystemLog table
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS system_logs (
@@ -152,6 +223,93 @@ def main():
         """)
         print("   ✅ Created table: system_logs")
         
+        # Monthly payment rollups (filled by the ETL)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS doctor_monthly_rollups (
+                npi VARCHAR(10) NOT NULL,
+                month DATE NOT NULL,
+                payment_count INTEGER NOT NULL DEFAULT 0,
+                total_amount FLOAT NOT NULL DEFAULT 0.0,
+                max_amount FLOAT,
+                manufacturer_count INTEGER,
+                last_payment_date DATE,
+                PRIMARY KEY (npi, month),
+                FOREIGN KEY (npi) REFERENCES doctors(npi)
+            )
+        """)
+        print("   ✅ Created table: doctor_monthly_rollups")
+        
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS manufacturer_monthly_rollups (
+                manufacturer_name VARCHAR(200) NOT NULL,
+                month DATE NOT NULL,
+                payment_count INTEGER NOT NULL DEFAULT 0,
+                total_amount FLOAT NOT NULL DEFAULT 0.0,
+                max_amount FLOAT,
+                doctor_count INTEGER,
+                PRIMARY KEY (manufacturer_name, month)
+            )
+        """)
+        print("   ✅ Created table: manufacturer_monthly_rollups")
+        
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS k_sweep_results (
+                sweep_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                cache_key VARCHAR(40) NOT NULL,
+                dataset_version VARCHAR(40) NOT NULL,
+                task_id INTEGER,
+                features_used TEXT,
+                k_min INTEGER NOT NULL,
+                k_max INTEGER NOT NULL,
+                sample_size INTEGER NOT NULL,
+                metrics JSON NOT NULL,
+                recommended_k INTEGER,
+                elbow_k INTEGER,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (task_id) REFERENCES analysis_tasks(task_id) ON DELETE SET NULL
+            )
+        """)
+        print("   ✅ Created table: k_sweep_results")
+        
+        # Per-result cluster membership
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS cluster_assignments (
+                result_id INTEGER NOT NULL,
+                npi VARCHAR(10) NOT NULL,
+                cluster INTEGER NOT NULL,
+                PRIMARY KEY (result_id, npi),
+                FOREIGN KEY (result_id) REFERENCES cluster_results(cluster_id) ON DELETE CASCADE
+            ) WITHOUT ROWID
+        """)
+        print("   ✅ Created table: cluster_assignments")
+        
+        # Level-of-detail visualization data per result
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS cluster_viz_levels (
+                result_id INTEGER NOT NULL,
+                level INTEGER NOT NULL,
+                payload BLOB NOT NULL,
+                PRIMARY KEY (result_id, level),
+                FOREIGN KEY (result_id) REFERENCES cluster_results(cluster_id) ON DELETE CASCADE
+            )
+        """)
+        print("   ✅ Created table: cluster_viz_levels")
+        
+        # Labels written to doctors.cluster_id by earlier runs belong to the
+        # latest result: keep them as that result's assignments and make it current
+        cursor.execute("SELECT COUNT(*) FROM cluster_results WHERE is_current = 1")
+        if cursor.fetchone()[0] == 0:
+            cursor.execute("SELECT MAX(cluster_id) FROM cluster_results WHERE is_active = 1")
+            latest_result = cursor.fetchone()[0]
+            if latest_result is not None:
+                cursor.execute("""
+                    INSERT OR IGNORE INTO cluster_assignments (result_id, npi, cluster)
+                    SELECT ?, npi, cluster_id FROM doctors WHERE cluster_id IS NOT NULL
+                """, (latest_result,))
+                backfilled = cursor.rowcount
+                cursor.execute("UPDATE cluster_results SET is_current = (cluster_id = ?)", (latest_result,))
+                print(f"   ✅ Backfilled {backfilled:,} assignments of result {latest_result} (now current)")
+        
         conn.commit()
         
         # ===== Step 4: Create indexes for performance =====
@@ -167,6 +325,14 @@ def main():
             ("idx_ai_reports_generated_by", "CREATE INDEX IF NOT EXISTS idx_ai_reports_generated_by ON ai_reports(generated_by)"),
             ("idx_system_logs_user_id", "CREATE INDEX IF NOT EXISTS idx_system_logs_user_id ON system_logs(user_id)"),
             ("idx_system_logs_action", "CREATE INDEX IF NOT EXISTS idx_system_logs_action ON system_logs(action)"),
+            ("idx_payment_records_npi_date", "CREATE INDEX IF NOT EXISTS idx_payment_records_npi_date ON payment_records(npi, payment_date DESC)"),
+            ("idx_doctor_monthly_rollups_month", "CREATE INDEX IF NOT EXISTS idx_doctor_monthly_rollups_month ON doctor_monthly_rollups(month)"),
+            ("idx_manufacturer_monthly_rollups_month", "CREATE INDEX IF NOT EXISTS idx_manufacturer_monthly_rollups_month ON manufacturer_monthly_rollups(month)"),
+            ("idx_cluster_assignments_result_cluster", "CREATE INDEX IF NOT EXISTS idx_cluster_assignments_result_cluster ON cluster_assignments(result_id, cluster)"),
+            ("ix_k_sweep_results_cache_key", "CREATE INDEX IF NOT EXISTS ix_k_sweep_results_cache_key ON k_sweep_results(cache_key)"),
+            ("ix_analysis_tasks_fingerprint", "CREATE INDEX IF NOT EXISTS ix_analysis_tasks_fingerprint ON analysis_tasks(fingerprint)"),
+            ("ix_cluster_results_task_id", "CREATE INDEX IF NOT EXISTS ix_cluster_results_task_id ON cluster_results(task_id)"),
+            ("ix_ai_reports_batch_id", "CREATE INDEX IF NOT EXISTS ix_ai_reports_batch_id ON ai_reports(batch_id)"),
         ]
         
         for idx_name, idx_sql in indexes:
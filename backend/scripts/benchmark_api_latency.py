@@ -0,0 +1,149 @@
+"""
+Benchmark of API latency while a clustering task runs.
+
+Starts the API with uvicorn (task runner enabled) against the configured
+pharma.db, once with CPU governance (the analysis_* settings as configured)
+and once without it (every core granted to the task, no niceness), and for
+each mode measures request latency of a cheap endpoint while idle and while
+a clustering task runs.
+
+Usage:
+    python -m scripts.benchmark_api_latency
+    python -m scripts.benchmark_api_latency --k 5 --interval 0.05 --modes governed ungoverned
+"""
+
+import sys
+import argparse
+import os
+import statistics
+import subprocess
+import time
+from pathlib import Path
+
+import httpx
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.services.cpu_governor import available_cores
+
+BACKEND_DIR = Path(__file__).parent.parent
+USER = {"username": "latency_bench", "email": "latency_bench@example.com", "password": "latency-bench"}
+
+
+def mode_env(mode):
+    """Environment overrides of a benchmark mode."""
+    if mode == "governed":
+        return {}
+    cores = str(len(available_cores()))
+    return {
+        "ANALYSIS_CPU_BUDGET": cores,
+        "ANALYSIS_TASK_THREADS": cores,
+        "ANALYSIS_RESERVED_CORES": "0",
+        "ANALYSIS_WORKER_NICE": "0",
+        "ANALYSIS_PIN_WORKERS": "false",
+    }
+
+
+def start_server(port, env, workdir):
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--app-dir", str(BACKEND_DIR),
+         "--port", str(port), "--log-level", "warning"],
+        cwd=workdir,
+        env={**os.environ, **env},
+    )
+    for _ in range(100):
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/health").status_code == 200:
+                return process
+        except httpx.TransportError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("API did not start")
+
+
+def login(client):
+    client.post("/api/v1/auth/register", json=USER)
+    token = client.post(
+        "/api/v1/auth/login", data={"username": USER["username"], "password": USER["password"]}
+    ).json()["access_token"]
+    client.headers["Authorization"] = f"Bearer {token}"
+
+
+def probe(client, path, interval, until):
+    """Request latencies in milliseconds, one request per interval until until() is true."""
+    timings = []
+    while not until():
+        start = time.perf_counter()
+        client.get(path).raise_for_status()
+        timings.append((time.perf_counter() - start) * 1000)
+        time.sleep(interval)
+    return timings
+
+
+def summarize(name, timings):
+    timings = sorted(timings)
+    p95 = timings[max(0, int(len(timings) * 0.95) - 1)]
+    p99 = timings[max(0, int(len(timings) * 0.99) - 1)]
+    print(f"{name:<28} n={len(timings):5d}  p50={statistics.median(timings):8.2f} ms  "
+          f"p95={p95:8.2f} ms  p99={p99:8.2f} ms  max={timings[-1]:8.2f} ms")
+
+
+def run_mode(mode, args):
+    process = start_server(args.port, mode_env(mode), args.workdir)
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{args.port}", timeout=60) as client:
+            login(client)
+            idle_end = time.monotonic() + args.idle_seconds
+            idle = probe(client, args.path, args.interval, lambda: time.monotonic() > idle_end)
+
+            task = client.post("/api/v1/analysis/tasks", json={
+                "task_name": f"Latency benchmark ({mode})",
+                "task_type": "clustering",
+                "force": True,
+                "parameters": {"k": args.k, "activate": False, "use_feature_cache": False},
+            })
+            task.raise_for_status()
+            task = task.json()
+            task_start = time.perf_counter()
+            state = {"last_poll": 0.0, "status": "pending"}
+
+            def finished():
+                # Poll the task every second; the probe keeps its own cadence
+                if time.monotonic() - state["last_poll"] >= 1:
+                    state["last_poll"] = time.monotonic()
+                    state["status"] = client.get(f"/api/v1/analysis/tasks/{task['task_id']}").json()["status"]
+                return state["status"] in ("completed", "failed", "cancelled")
+
+            busy = probe(client, args.path, args.interval, finished)
+            task_seconds = time.perf_counter() - task_start
+
+        print(f"\n{mode}: clustering {state['status']} in {task_seconds:.1f}s")
+        summarize("idle", idle)
+        summarize("during clustering", busy)
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--modes", nargs="+", default=["governed", "ungoverned"],
+                        choices=["governed", "ungoverned"])
+    parser.add_argument("--path", default="/api/v1/doctors?page=1&page_size=20", help="Probed endpoint")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--interval", type=float, default=0.05, help="Seconds between probe requests")
+    parser.add_argument("--idle-seconds", type=float, default=5)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workdir", default=str(BACKEND_DIR),
+                        help="Directory the API runs in (pharma.db and feature_cache are relative to it)")
+    args = parser.parse_args()
+
+    print(f"{len(available_cores())} core(s) available, probing {args.path}")
+    for mode in args.modes:
+        run_mode(mode, args)
+
+
+if __name__ == "__main__":
+    main()
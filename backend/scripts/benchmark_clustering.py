@@ -0,0 +1,135 @@
+"""
+Benchmark for the clustering algorithms in the registry
+(app/services/clustering_algorithms.py).
+
+Builds a synthetic doctors table (log-normal RFM values) of each requested
+size in a temporary SQLite database, then runs the load + preprocess + fit +
+predict stage of each algorithm in a fresh process and reports wall time,
+peak memory (RSS growth over the process baseline), number of clusters,
+inertia and silhouette on the scaled sample.
+
+Usage:
+    python -m scripts.benchmark_clustering
+    python -m scripts.benchmark_clustering --sizes 100000 740000 5000000 --k 5
+    python -m scripts.benchmark_clustering --sizes 740000 --algorithms k-means birch gmm
+"""
+
+import sys
+import argparse
+import os
+import multiprocessing
+import resource
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.services.clustering_algorithms import ALGORITHMS
+
+FEATURES = ["recency_days", "frequency", "monetary"]
+
+
+def build_database(path: Path, n_rows: int, seed: int = 0):
+    """Create a doctors table with n_rows synthetic RFM rows."""
+    from sqlalchemy import create_engine
+    from app.database import Base
+    from app import models  # noqa: F401  (register tables)
+
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    engine.dispose()
+
+    rng = np.random.default_rng(seed)
+    conn = sqlite3.connect(path)
+    batch = 500000
+    for start in range(0, n_rows, batch):
+        size = min(batch, n_rows - start)
+        recency = rng.integers(0, 540, size)
+        frequency = rng.negative_binomial(1, 0.08, size) + 1
+        monetary = np.round(frequency * rng.lognormal(3.5, 1.3, size), 2)
+        conn.executemany(
+            "INSERT INTO doctors (npi, recency_days, frequency, monetary) VALUES (?, ?, ?, ?)",
+            zip((str(1000000000 + start + i) for i in range(size)),
+                recency.tolist(), frequency.tolist(), monetary.tolist())
+        )
+        conn.commit()
+    conn.close()
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _run_fit(db_path: str, algorithm: str, k: int, queue):
+    """Child process: run one fit and report (seconds, peak RSS MB, clusters, inertia, silhouette)."""
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from app.models import AnalysisTask
+    from app.services.analysis_service import analysis_service
+    from app.services.cluster_metrics import sampled_silhouette
+
+    engine = create_engine(f"sqlite:///{db_path}")
+    db = sessionmaker(bind=engine)()
+    task = AnalysisTask(task_name="benchmark", task_type="clustering")
+    db.add(task)
+    db.commit()
+
+    baseline = _peak_rss_mb()
+    start = time.perf_counter()
+    if ALGORITHMS[algorithm].streaming:
+        fit = analysis_service._fit_minibatch_streaming(db, task, FEATURES, k, {})
+    else:
+        fit = analysis_service._fit_in_memory(
+            db, task, FEATURES, k, {"use_feature_cache": False}, ALGORITHMS[algorithm]
+        )
+    elapsed = time.perf_counter() - start
+    memory = _peak_rss_mb() - baseline
+    silhouette = sampled_silhouette(fit["metric_X"], fit["metric_labels"])["mean"]
+    queue.put((elapsed, memory, fit["n_clusters"], float(fit["inertia"]), float(silhouette)))
+    db.close()
+
+
+def run_isolated(db_path: Path, algorithm: str, k: int):
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    process = ctx.Process(target=_run_fit, args=(str(db_path), algorithm, k, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100000, 740000, 5000000])
+    parser.add_argument("--algorithms", nargs="+", default=list(ALGORITHMS), choices=list(ALGORITHMS))
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("Clustering Benchmark")
+    print("=" * 60)
+    print(f"{'rows':>10} {'algorithm':<18} {'time (s)':>10} {'peak mem (MB)':>14} "
+          f"{'clusters':>9} {'inertia':>14} {'silhouette':>11}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Keep feature cache entries out of the working directory (inherited by workers)
+        os.environ["FEATURE_CACHE_DIR"] = str(Path(tmp) / "feature_cache")
+        for n_rows in args.sizes:
+            db_path = Path(tmp) / f"doctors_{n_rows}.db"
+            build_database(db_path, n_rows)
+            for algorithm in args.algorithms:
+                elapsed, memory, clusters, inertia, silhouette = run_isolated(db_path, algorithm, args.k)
+                print(f"{n_rows:>10,} {algorithm:<18} {elapsed:>10.2f} {memory:>14.1f} "
+                      f"{clusters:>9} {inertia:>14.0f} {silhouette:>11.3f}")
+            db_path.unlink()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Benchmark for doctor detail / payment history queries.
+
+Runs the previous query plan (doctor lookup + separate sorted payment query,
+plus COUNT for the history page) against the single round-trip plan used by
+the doctors router, for the top-100 most-paid doctors.
+
+Usage:
+    python -m scripts.benchmark_doctor_queries
+    python -m scripts.benchmark_doctor_queries --top 100 --repeat 5
+"""
+
+import sys
+import argparse
+import statistics
+import time
+from pathlib import Path
+
+from sqlalchemy import text
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.database import SessionLocal
+from app.models import Doctor, PaymentRecord
+from app.routers.doctors import _load_doctor_with_payments
+
+
+def legacy_detail(db, npi):
+    """Two queries: doctor lookup, then sorted recent payments."""
+    doctor = db.query(Doctor).filter(Doctor.npi == npi).first()
+    payments = db.query(PaymentRecord)\
+        .filter(PaymentRecord.npi == npi)\
+        .order_by(PaymentRecord.payment_date.desc())\
+        .limit(10)\
+        .all()
+    return doctor, payments
+
+
+def legacy_history(db, npi, page_size=20):
+    """Three queries: doctor lookup, COUNT, sorted page."""
+    doctor = db.query(Doctor).filter(Doctor.npi == npi).first()
+    query = db.query(PaymentRecord).filter(PaymentRecord.npi == npi)
+    total = query.count()
+    payments = query.order_by(PaymentRecord.payment_date.desc()).limit(page_size).all()
+    return doctor, total, payments
+
+
+def single_detail(db, npi):
+    return _load_doctor_with_payments(db, npi, limit=10)
+
+
+def single_history(db, npi, page_size=20):
+    doctor, payments = _load_doctor_with_payments(db, npi, limit=page_size)
+    return doctor, doctor.frequency, payments
+
+
+def time_plan(db, fn, npis, repeat):
+    """Return per-call latencies in milliseconds."""
+    timings = []
+    for _ in range(repeat):
+        for npi in npis:
+            db.expunge_all()
+            start = time.perf_counter()
+            fn(db, npi)
+            timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def summarize(name, timings):
+    timings = sorted(timings)
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(f"{name:<28} p50={statistics.median(timings):8.2f} ms  "
+          f"p95={p95:8.2f} ms  mean={statistics.mean(timings):8.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--top", type=int, default=100, help="Number of top doctors by monetary")
+    parser.add_argument("--repeat", type=int, default=3, help="Passes over the doctor list")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        npis = [row[0] for row in db.query(Doctor.npi)
+                .order_by(Doctor.monetary.desc())
+                .limit(args.top)
+                .all()]
+        if not npis:
+            print("No doctors found, run the ETL first.")
+            return
+
+        indexed = db.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_payment_records_npi_date'"
+        )).first() is not None
+
+        print("=" * 60)
+        print("Doctor Detail / Payment History Benchmark")
+        print("=" * 60)
+        print(f"Doctors: top {len(npis)} by monetary")
+        print(f"Repeat: {args.repeat}")
+        print(f"Composite index present: {indexed}")
+        print("=" * 60)
+
+        # Warm the page cache so both plans read from memory
+        time_plan(db, single_detail, npis, 1)
+
+        summarize("detail (2 queries)", time_plan(db, legacy_detail, npis, args.repeat))
+        summarize("detail (single query)", time_plan(db, single_detail, npis, args.repeat))
+        summarize("history (3 queries)", time_plan(db, legacy_history, npis, args.repeat))
+        summarize("history (single query)", time_plan(db, single_history, npis, args.repeat))
+
+        plan = db.execute(text(
+            "EXPLAIN QUERY PLAN SELECT * FROM payment_records "
+            "WHERE npi = :npi ORDER BY payment_date DESC LIMIT 10"
+        ), {"npi": npis[0]}).fetchall()
+        print("\nPayment page plan:")
+        for row in plan:
+            print(f"   {row[-1]}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -4,8 +4,9 @@ ETL Process Script for CMS Open Payments Data
 Processes large CSV file (15M+ rows) using chunked reading to:
 1. Filter: Keep only Physicians, exclude Teaching Hospitals, drop null NPIs
 2. Clean: Convert dates, validate amounts
-3. Aggregate: Calculate RFM values in-memory
-4. Load: Batch insert into SQLite database
+3. Aggregate: Calculate RFM values and monthly payment rollups in-memory
+4. Load: Batch insert new doctors and update changed ones in SQLite
+5. Assign: Place new/changed doctors into the current clustering result
 
 Usage:
     python -m scripts.etl_process
@@ -15,9 +16,10 @@ import sys
 import os
 from pathlib import Path
 from datetime import datetime, date
-from typing import Dict, Any
+from typing import Dict, Any, List
 import time
 
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
 from sqlalchemy.orm import Session
@@ -26,8 +28,9 @@ from sqlalchemy.orm import Session
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
 from app.database import SessionLocal, engine
-from app.models import Doctor, PaymentRecord, Base
+from app.models import Doctor, PaymentRecord, DoctorMonthlyRollup, ManufacturerMonthlyRollup, Base
 from app.config import get_settings
+from app.services import cluster_model
 
 # ============== Configuration ==============
 
@@ -39,6 +42,7 @@ CSV_FILE_PATH = settings.raw_data_path
 # Processing parameters
 CHUNK_SIZE = 50000  # Process 50k rows at a time
 IMPORT_DETAILS = False  # Set to True to import PaymentRecord details (WARNING: 15M rows!)
+ROLLUP_COMPACT_EVERY = 20  # Merge partial monthly rollups every N chunks to bound memory
 
 # Reference date for Recency calculation (use latest date in dataset or current date)
 REFERENCE_DATE = datetime(2025, 6, 30).date()  # Based on Payment_Publication_Date
@@ -72,6 +76,12 @@ class ETLProcessor:
         self.error_rows = 0
         self.payment_batch = []
         
+        # Monthly rollup state: partial (npi, month, manufacturer) aggregates
+        # and a global manufacturer name <-> code mapping
+        self.rollup_parts: List[pd.DataFrame] = []
+        self.manufacturer_codes: Dict[str, int] = {}
+        self.manufacturer_names: List[str] = []
+        
     def filter_chunk(self, chunk: pd.DataFrame) -> pd.DataFrame:
         """
         Filter chunk to keep only valid physician records.
@@ -192,6 +202,130 @@ class ETLProcessor:
                 if self.error_rows <= 10:  # Only print first 10 errors
                     print(f"Error processing row: {e}")
     
+    def aggregate_rollups(self, chunk: pd.DataFrame):
+        """
+        Aggregate monthly payment rollups for the chunk (vectorized).
+        
+        Partial results are kept at (npi, month, manufacturer) grain so that
+        distinct manufacturer / doctor counts stay exact across chunks, and
+        are compacted every ROLLUP_COMPACT_EVERY chunks.
+        """
+        if chunk.empty:
+            return
+        
+        # Map manufacturer names to global integer codes
+        names = pd.Categorical(
+            chunk['Applicable_Manufacturer_or_Applicable_GPO_Making_Payment_Name'].fillna('Unknown')
+        )
+        category_codes = np.array(
+            [self._manufacturer_code(name) for name in names.categories],
+            dtype=np.int32
+        )
+        
+        part = pd.DataFrame({
+            'npi': chunk['Covered_Recipient_NPI'].astype('int64').values,
+            'month': chunk['Date_of_Payment'].values.astype('datetime64[M]'),
+            'manufacturer': category_codes[names.codes],
+            'amount': chunk['Total_Amount_of_Payment_USDollars'].values,
+            'payment_date': chunk['Date_of_Payment'].values,
+        })
+        grouped = part.groupby(['npi', 'month', 'manufacturer'], sort=False).agg(
+            payment_count=('amount', 'size'),
+            total_amount=('amount', 'sum'),
+            max_amount=('amount', 'max'),
+            last_payment_date=('payment_date', 'max'),
+        ).reset_index()
+        
+        self.rollup_parts.append(grouped)
+        if len(self.rollup_parts) >= ROLLUP_COMPACT_EVERY:
+            self.rollup_parts = [self._compact_rollups()]
+    
+    def _manufacturer_code(self, name: str) -> int:
+        code = self.manufacturer_codes.get(name)
+        if code is None:
+            code = len(self.manufacturer_names)
+            self.manufacturer_codes[name] = code
+            self.manufacturer_names.append(name)
+        return code
+    
+    def _compact_rollups(self) -> pd.DataFrame:
+        """Merge partial rollups into one frame at (npi, month, manufacturer) grain."""
+        merged = pd.concat(self.rollup_parts, ignore_index=True)
+        return merged.groupby(['npi', 'month', 'manufacturer'], sort=False).agg(
+            payment_count=('payment_count', 'sum'),
+            total_amount=('total_amount', 'sum'),
+            max_amount=('max_amount', 'max'),
+            last_payment_date=('last_payment_date', 'max'),
+        ).reset_index()
+    
+    def load_rollups(self, db: Session):
+        """
+        Build doctor and manufacturer monthly rollups and replace the tables.
+        """
+        if not self.rollup_parts:
+            return
+        
+        detail = self._compact_rollups()
+        self.rollup_parts = []
+        
+        doctor_rollups = detail.groupby(['npi', 'month']).agg(
+            payment_count=('payment_count', 'sum'),
+            total_amount=('total_amount', 'sum'),
+            max_amount=('max_amount', 'max'),
+            manufacturer_count=('manufacturer', 'size'),
+            last_payment_date=('last_payment_date', 'max'),
+        ).reset_index()
+        doctor_rollups['npi'] = doctor_rollups['npi'].astype(str)
+        doctor_rollups['month'] = doctor_rollups['month'].dt.date
+        doctor_rollups['last_payment_date'] = doctor_rollups['last_payment_date'].dt.date
+        
+        manufacturer_rollups = detail.groupby(['manufacturer', 'month']).agg(
+            payment_count=('payment_count', 'sum'),
+            total_amount=('total_amount', 'sum'),
+            max_amount=('max_amount', 'max'),
+            doctor_count=('npi', 'size'),
+        ).reset_index()
+        manufacturer_rollups['manufacturer_name'] = np.array(
+            self.manufacturer_names, dtype=object
+        )[manufacturer_rollups.pop('manufacturer').values]
+        manufacturer_rollups['month'] = manufacturer_rollups['month'].dt.date
+        
+        db.query(DoctorMonthlyRollup).delete()
+        db.query(ManufacturerMonthlyRollup).delete()
+        
+        print(f"Inserting {len(doctor_rollups):,} doctor monthly rollups...")
+        self._bulk_insert(db, DoctorMonthlyRollup, doctor_rollups)
+        print(f"Inserting {len(manufacturer_rollups):,} manufacturer monthly rollups...")
+        self._bulk_insert(db, ManufacturerMonthlyRollup, manufacturer_rollups)
+    
+    def _bulk_insert(self, db: Session, model, df: pd.DataFrame, batch_size: int = 50000):
+        for start in range(0, len(df), batch_size):
+            db.bulk_insert_mappings(model, df.iloc[start:start + batch_size].to_dict('records'))
+            db.commit()
+    
+    def split_doctor_records(self, db: Session, doctor_records: List[Dict[str, Any]]):
+        """
+        Split doctor records into new NPIs and existing NPIs whose RFM values
+        changed; unchanged doctors are dropped.
+        
+        Returns:
+            (new_records, changed_records)
+        """
+        existing = {
+            npi: (recency_days, frequency, monetary)
+            for npi, recency_days, frequency, monetary in db.query(
+                Doctor.npi, Doctor.recency_days, Doctor.frequency, Doctor.monetary
+            )
+        }
+        new_records, changed_records = [], []
+        for record in doctor_records:
+            current = existing.get(record['npi'])
+            if current is None:
+                new_records.append(record)
+            elif current != (record['recency_days'], record['frequency'], record['monetary']):
+                changed_records.append(record)
+        return new_records, changed_records
+    
     def load_payment_details(self, chunk: pd.DataFrame, db: Session):
         """
         Load payment details to database (optional, for detailed analysis).
@@ -258,6 +392,7 @@ class ETLProcessor:
                     chunk = self.filter_chunk(chunk)
                     chunk = self.clean_chunk(chunk)
                     self.aggregate_rfm(chunk)
+                    self.aggregate_rollups(chunk)
                     
                     # Optional: Load payment details
                     if IMPORT_DETAILS:
@@ -289,10 +424,24 @@ class ETLProcessor:
                     'monetary': stats['monetary']
                 })
             
-            # Batch insert doctors
-            print(f"Inserting {len(doctor_records):,} doctor records...")
-            db.bulk_insert_mappings(Doctor, doctor_records)
+            # Insert new doctors, update those whose RFM values changed
+            new_records, changed_records = self.split_doctor_records(db, doctor_records)
+            print(f"Inserting {len(new_records):,} new doctor records, "
+                  f"updating {len(changed_records):,} changed...")
+            db.bulk_insert_mappings(Doctor, new_records)
+            db.bulk_update_mappings(Doctor, changed_records)
+            db.commit()
+            
+            # Monthly rollups for time-windowed analytics
+            print("\nBuilding monthly rollups...")
+            self.load_rollups(db)
+            
+            # New and changed doctors get a cluster from the current result's model
+            assigned = cluster_model.assign_doctors(
+                db, [r['npi'] for r in new_records + changed_records]
+            )
             db.commit()
+            print(f"Assigned {assigned:,} new/changed doctors to current clusters")
             
         except Exception as e:
             print(f"\nERROR: {e}")
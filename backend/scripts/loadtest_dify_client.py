@@ -0,0 +1,133 @@
+"""
+Load test of the Dify client against the local mock Dify server.
+
+Starts scripts.mock_dify_server and sends --requests completion calls two ways:
+
+- async: the pooled app client (services/dify_client.py), all calls issued at
+  once on one event loop, bounded by dify_max_concurrency
+- blocking: the previous approach, one blocking POST without connection reuse
+  per call on a 40-thread pool (FastAPI's default threadpool size)
+
+and reports throughput, latency percentiles, retries and failures. All calls
+are submitted at once, so latencies include the wait for a free slot.
+
+Usage:
+    python -m scripts.loadtest_dify_client
+    python -m scripts.loadtest_dify_client --requests 400 --concurrency 16 --latency 0.5 --error-rate 0.1
+"""
+
+import sys
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import httpx
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+BACKEND_DIR = Path(__file__).parent.parent
+THREADPOOL_SIZE = 40
+INPUTS = {"report_type": "cluster_analysis", "context": "{\"cluster_name\": \"load test\"}"}
+
+
+def start_mock(args):
+    process = subprocess.Popen(
+        [sys.executable, "-m", "scripts.mock_dify_server", "--port", str(args.port),
+         "--latency", str(args.latency), "--error-rate", str(args.error_rate)],
+        cwd=BACKEND_DIR,
+    )
+    for _ in range(100):
+        try:
+            httpx.get(f"http://127.0.0.1:{args.port}/stats")
+            return process
+        except httpx.TransportError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("Mock Dify server did not start")
+
+
+def summarize(name, timings, wall, failures, extra=""):
+    timings = sorted(timings) or [0.0]
+    pct = lambda q: timings[max(0, int(len(timings) * q) - 1)]
+    print(f"{name:<9} {len(timings) / wall:7.1f} req/s  p50={statistics.median(timings):7.3f}s  "
+          f"p95={pct(0.95):7.3f}s  p99={pct(0.99):7.3f}s  failures={failures}  {extra}")
+
+
+async def run_async(args):
+    from app.services.dify_client import dify_client
+
+    async def one():
+        try:
+            await dify_client.completion(INPUTS, user="load-test")
+            return time.perf_counter() - start, None
+        except Exception as e:
+            return time.perf_counter() - start, e
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*[one() for _ in range(args.requests)])
+    wall = time.perf_counter() - start
+    await dify_client.aclose()
+    failures = sum(1 for _, error in results if error)
+    summarize("async", [t for t, error in results if not error], wall, failures,
+              f"retries={dify_client.stats['retries']}")
+
+
+def run_blocking(args):
+    url = f"http://127.0.0.1:{args.port}/v1/completion-messages"
+
+    def one(_):
+        try:
+            response = httpx.post(url, json={"inputs": INPUTS, "response_mode": "blocking", "user": "load-test"},
+                                  headers={"Authorization": "Bearer test"}, timeout=60)
+            response.raise_for_status()
+            return time.perf_counter() - start, None
+        except Exception as e:
+            return time.perf_counter() - start, e
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=THREADPOOL_SIZE) as pool:
+        results = list(pool.map(one, range(args.requests)))
+    wall = time.perf_counter() - start
+    failures = sum(1 for _, error in results if error)
+    summarize("blocking", [t for t, error in results if not error], wall, failures, "retries=0")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=THREADPOOL_SIZE, help="dify_max_concurrency of the async client")
+    parser.add_argument("--latency", type=float, default=1.0, help="Mock response latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of mock responses that are 429s")
+    parser.add_argument("--port", type=int, default=8801)
+    args = parser.parse_args()
+
+    # Settings are read when the app modules are imported
+    os.environ.update({
+        "DIFY_API_URL": f"http://127.0.0.1:{args.port}/v1",
+        "DIFY_API_KEY": "test",
+        "DIFY_MAX_CONCURRENCY": str(args.concurrency),
+        "DIFY_MAX_CONNECTIONS": str(args.concurrency),
+    })
+
+    mock = start_mock(args)
+    try:
+        print(f"{args.requests} requests, mock latency {args.latency}s, error rate {args.error_rate}")
+        for name, run in (("async", lambda: asyncio.run(run_async(args))), ("blocking", lambda: run_blocking(args))):
+            httpx.get(f"http://127.0.0.1:{args.port}/stats", params={"reset": True})
+            run()
+            served = httpx.get(f"http://127.0.0.1:{args.port}/stats").json()
+            print(f"{'':<9} server: {served.get('requests', 0)} requests, "
+                  f"peak in flight {served.get('peak_in_flight', 0)}")
+    finally:
+        mock.terminate()
+        mock.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+"""
+Load test of the report pipeline against the local mock Dify server.
+
+Starts scripts.mock_dify_server and the API (uvicorn) pointed at it, then
+--concurrency clients each generate reports back to back (closed loop):
+POST /reports/generate, then follow GET /reports/{id}/stream until done,
+until --requests reports are generated. Doctor profile reports of the top
+doctors are requested without the response cache, so every report reaches
+the mock.
+
+Reports throughput, latency percentiles of the POST, the first streamed
+chunk (TTFT) and the finished report, failures, the queue depth sampled
+every --sample-interval seconds (reports generating in the API minus
+requests in flight at the mock, i.e. reports waiting on our side for
+context preparation, dify_max_concurrency slots or retry backoff), and the
+API's own per-stage breakdown of the reports (GET /reports/timing/stats).
+
+Usage:
+    python -m scripts.loadtest_reports
+    python -m scripts.loadtest_reports --concurrency 50 --requests 500 --dify-concurrency 16 --latency-dist lognormal
+    python -m scripts.loadtest_reports --blocking --stream-error-rate 0.05 --workdir /data
+"""
+
+import sys
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import time
+from pathlib import Path
+
+import httpx
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+BACKEND_DIR = Path(__file__).parent.parent
+USER = {"username": "report_loadtest", "email": "report_loadtest@example.com", "password": "report-loadtest"}
+
+
+def wait_for(url, process, name):
+    for _ in range(150):
+        try:
+            if httpx.get(url).status_code == 200:
+                return process
+        except httpx.TransportError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"{name} did not start")
+
+
+def stop(process):
+    # Open report streams can keep uvicorn's graceful shutdown waiting
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def start_mock(args):
+    process = subprocess.Popen(
+        [sys.executable, "-m", "scripts.mock_dify_server", "--port", str(args.mock_port),
+         "--latency", str(args.latency), "--jitter", str(args.jitter), "--latency-dist", args.latency_dist,
+         "--ttft", str(args.ttft), "--tokens", str(args.tokens), "--token-interval", str(args.token_interval),
+         "--error-rate", str(args.error_rate), "--stream-error-rate", str(args.stream_error_rate),
+         "--max-concurrency", str(args.mock_max_concurrency)],
+        cwd=BACKEND_DIR,
+    )
+    return wait_for(f"http://127.0.0.1:{args.mock_port}/stats", process, "Mock Dify server")
+
+
+def start_api(args):
+    env = {
+        **os.environ,
+        "DIFY_API_URL": f"http://127.0.0.1:{args.mock_port}/v1",
+        "DIFY_API_KEY": "test",
+        "DIFY_MAX_CONCURRENCY": str(args.dify_concurrency),
+        "DIFY_MAX_CONNECTIONS": str(args.dify_concurrency),
+        "DIFY_STREAMING": "false" if args.blocking else "true",
+        "ANALYSIS_RUNNER_ENABLED": "false",
+    }
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--app-dir", str(BACKEND_DIR),
+         "--port", str(args.port), "--log-level", "warning"],
+        cwd=args.workdir,
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+    return wait_for(f"http://127.0.0.1:{args.port}/health", process, "API")
+
+
+async def login(client):
+    await client.post("/api/v1/auth/register", json=USER)
+    response = await client.post(
+        "/api/v1/auth/login", data={"username": USER["username"], "password": USER["password"]}
+    )
+    client.headers["Authorization"] = f"Bearer {response.json()['access_token']}"
+
+
+async def generate(client, npi, timings):
+    """Generate one report; appends (post, ttft, total, failed) seconds."""
+    start = time.perf_counter()
+    response = await client.post("/api/v1/reports/generate", json={
+        "report_title": f"Load test {npi}",
+        "report_type": "doctor_profile",
+        "related_npi": npi,
+        "use_cache": False,
+    })
+    response.raise_for_status()
+    posted = time.perf_counter() - start
+    report_id = response.json()["report_id"]
+
+    first, status = None, "failed"
+    async with client.stream("GET", f"/api/v1/reports/{report_id}/stream") as stream:
+        async for line in stream.aiter_lines():
+            if line.startswith("event: delta") and first is None:
+                first = time.perf_counter() - start
+            elif line.startswith("data:") and '"type": "done"' in line:
+                status = "failed" if '"status": "failed"' in line else "published"
+                break
+    total = time.perf_counter() - start
+    timings.append((posted, first if first is not None else total, total, status != "published"))
+
+
+async def sample_queue(client, mock, interval, baseline, samples, stop):
+    while not stop.is_set():
+        generating = (await client.get("/api/v1/reports", params={"status": "generating", "page_size": 1})).json()["total"]
+        in_flight = (await mock.get("/stats")).json().get("in_flight", 0)
+        generating -= baseline
+        samples.append((generating, max(0, generating - in_flight)))
+        await asyncio.sleep(interval)
+
+
+def percentiles(values):
+    values = sorted(values) or [0.0]
+    pct = lambda q: values[max(0, int(len(values) * q) - 1)]
+    return f"p50={statistics.median(values):7.3f}s  p95={pct(0.95):7.3f}s  p99={pct(0.99):7.3f}s  max={values[-1]:7.3f}s"
+
+
+async def run(args):
+    limits = httpx.Limits(max_connections=args.concurrency + 5)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", timeout=300, limits=limits) as client, \
+            httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.mock_port}") as mock:
+        await login(client)
+        doctors = (await client.get("/api/v1/doctors", params={"page_size": 100})).json()["items"]
+        npis = [d["npi"] for d in doctors] or [None]
+        baseline = (await client.get("/api/v1/reports", params={"status": "generating", "page_size": 1})).json()["total"]
+        await mock.get("/stats", params={"reset": True})
+
+        timings, samples, stop = [], [], asyncio.Event()
+        remaining = iter(range(args.requests))
+
+        async def worker():
+            for i in remaining:
+                try:
+                    await generate(client, npis[i % len(npis)], timings)
+                except Exception as e:
+                    print(f"request failed: {e!r}")
+                    timings.append((0.0, 0.0, 0.0, True))
+
+        sampler = asyncio.create_task(sample_queue(client, mock, args.sample_interval, baseline, samples, stop))
+        start = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(args.concurrency)])
+        wall = time.perf_counter() - start
+        stop.set()
+        await sampler
+        served = (await mock.get("/stats")).json()
+        breakdown = (await client.get("/api/v1/reports/timing/stats", params={"limit": args.requests})).json()
+
+    ok = [t for t in timings if not t[3]]
+    print(f"{len(timings)} reports in {wall:.1f}s: {len(ok) / wall:.2f} reports/s, "
+          f"{len(timings) - len(ok)} failed")
+    print(f"  POST      {percentiles([t[0] for t in ok])}")
+    print(f"  TTFT      {percentiles([t[1] for t in ok])}")
+    print(f"  complete  {percentiles([t[2] for t in ok])}")
+    if samples:
+        generating = [s[0] for s in samples]
+        queued = [s[1] for s in samples]
+        print(f"  generating: mean {statistics.mean(generating):.1f}, max {max(generating)}   "
+              f"queue depth: mean {statistics.mean(queued):.1f}, max {max(queued)}")
+    print(f"  mock: {served.get('requests', 0)} requests, peak in flight {served.get('peak_in_flight', 0)}, "
+          f"rate limited {served.get('rate_limited', 0)}, stream errors {served.get('stream_errors', 0)}")
+    print(f"  server-side stages (GET /reports/timing/stats), Dify share of generation {breakdown.get('dify_share')}:")
+    for stage, values in breakdown.get("stages", {}).items():
+        print(f"    {stage:<12} p50={values['p50']:7.3f}s  p95={values['p95']:7.3f}s  max={values['max']:7.3f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200, help="Reports to generate")
+    parser.add_argument("--concurrency", type=int, default=20, help="Concurrent clients")
+    parser.add_argument("--dify-concurrency", type=int, default=8, help="dify_max_concurrency of the API")
+    parser.add_argument("--blocking", action="store_true", help="Blocking instead of streaming Dify calls")
+    parser.add_argument("--latency", type=float, default=1.0, help="Mock blocking latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--latency-dist", default="normal", choices=["normal", "lognormal", "exponential", "fixed"])
+    parser.add_argument("--ttft", type=float, default=1.0)
+    parser.add_argument("--tokens", type=int, default=50)
+    parser.add_argument("--token-interval", type=float, default=0.02)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--stream-error-rate", type=float, default=0.0)
+    parser.add_argument("--mock-max-concurrency", type=int, default=0, help="Mock rate limit, 0 = none")
+    parser.add_argument("--sample-interval", type=float, default=0.5)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--mock-port", type=int, default=8802)
+    parser.add_argument("--workdir", default=str(BACKEND_DIR),
+                        help="Directory the API runs in (pharma.db is relative to it)")
+    args = parser.parse_args()
+
+    mock = start_mock(args)
+    try:
+        api = start_api(args)
+        try:
+            print(f"{args.concurrency} clients, dify_max_concurrency {args.dify_concurrency}, "
+                  f"{'blocking' if args.blocking else 'streaming'}, mock {args.latency_dist} "
+                  f"ttft {args.ttft}s / latency {args.latency}s")
+            asyncio.run(run(args))
+        finally:
+            stop(api)
+    finally:
+        stop(mock)
+
+
+if __name__ == "__main__":
+    main()
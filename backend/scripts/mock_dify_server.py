@@ -0,0 +1,193 @@
+"""
+Local stand-in for the Dify completion API.
+
+Serves POST /v1/completion-messages in blocking and streaming mode, GET /stats
+with request counts and the peak number of concurrent requests (?reset=true
+clears them), and GET / PUT /config to read or change the behavior below
+while the server runs (a JSON object of the keys of `config`).
+
+- latency: in blocking mode the whole answer comes after a latency drawn from
+  --latency-dist (normal, lognormal, exponential or fixed) with mean
+  --latency and standard deviation --jitter
+- streaming: the first chunk comes after a time to first token drawn from the
+  same distribution with mean --ttft (same relative spread), followed by
+  --tokens chunks --token-interval seconds apart and a message_end event in
+  Dify's SSE format; "event: ping" lines are sent every --ping-interval
+  seconds while the first chunk is pending
+- errors: --error-rate of the requests are answered with --error-status,
+  --stream-error-rate of the streams fail halfway with an "error" event, and
+  with --max-concurrency requests beyond that many in flight get a 429 with
+  Retry-After (Dify's rate limit)
+
+Usage:
+    python -m scripts.mock_dify_server --port 8801 --latency 1.0 --error-rate 0.1
+    python -m scripts.mock_dify_server --ttft 1.0 --tokens 300 --token-interval 0.05
+    python -m scripts.mock_dify_server --latency-dist lognormal --ttft 2.0 --jitter 1.0 --max-concurrency 20
+    # then: DIFY_API_URL=http://127.0.0.1:8801/v1 DIFY_API_KEY=test uvicorn app.main:app
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+import uuid
+from collections import Counter
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+LATENCY_DISTRIBUTIONS = ["normal", "lognormal", "exponential", "fixed"]
+
+app = FastAPI(title="Mock Dify")
+config = {"latency": 1.0, "jitter": 0.2, "latency_dist": "normal", "error_rate": 0.0, "error_status": 429,
+          "ttft": 1.0, "tokens": 200, "token_interval": 0.05, "ping_interval": 0.0,
+          "stream_error_rate": 0.0, "max_concurrency": 0}
+stats = Counter()
+
+
+def _sample(mean: float) -> float:
+    """Seconds drawn from the configured distribution; jitter scales with the mean."""
+    std = config["jitter"] * mean / config["latency"] if config["latency"] else config["jitter"]
+    dist = config["latency_dist"]
+    if mean <= 0 or dist == "fixed":
+        return max(0.0, mean)
+    if dist == "exponential":
+        return random.expovariate(1 / mean)
+    if dist == "lognormal":
+        sigma2 = math.log(1 + (std / mean) ** 2)
+        return random.lognormvariate(math.log(mean) - sigma2 / 2, math.sqrt(sigma2))
+    return max(0.0, random.gauss(mean, std))
+
+
+def _answer(inputs: dict) -> str:
+    return f"# Mock {inputs.get('report_type', 'report')}\n\n{inputs.get('context', '')[:200]}"
+
+
+def _sse(event: dict) -> str:
+    return f"data: {json.dumps(event)}\n\n"
+
+
+async def _stream(inputs: dict):
+    """Dify streaming events: pings, message chunks, then message_end (or error)."""
+    message_id = str(uuid.uuid4())
+    started = time.perf_counter()
+    try:
+        first_token = started + _sample(config["ttft"])
+        while True:
+            remaining = first_token - time.perf_counter()
+            if remaining <= 0:
+                break
+            if config["ping_interval"] > 0 and remaining > config["ping_interval"]:
+                await asyncio.sleep(config["ping_interval"])
+                yield "event: ping\n\n"
+            else:
+                await asyncio.sleep(remaining)
+
+        fail_at = config["tokens"] // 2 if random.random() < config["stream_error_rate"] else None
+        chunks = [_answer(inputs) + "\n\n"] + [f"token{i} " for i in range(config["tokens"])]
+        for i, chunk in enumerate(chunks):
+            if i:
+                await asyncio.sleep(config["token_interval"])
+            if i == fail_at:
+                stats["stream_errors"] += 1
+                yield _sse({"event": "error", "message_id": message_id, "status": 500,
+                            "code": "completion_request_error", "message": "mock stream error"})
+                return
+            yield _sse({"event": "message", "message_id": message_id, "answer": chunk,
+                        "created_at": int(time.time())})
+        yield _sse({"event": "message_end", "message_id": message_id,
+                    "metadata": {"usage": {"latency": time.perf_counter() - started}}})
+    finally:
+        stats["in_flight"] -= 1
+
+
+@app.post("/v1/completion-messages")
+async def completion_messages(request: Request):
+    payload = await request.json()
+    stats["requests"] += 1
+    if config["max_concurrency"] and stats["in_flight"] >= config["max_concurrency"]:
+        stats["rate_limited"] += 1
+        return JSONResponse({"code": "too_many_requests", "message": "mock rate limit"},
+                            status_code=429, headers={"Retry-After": "1"})
+    stats["in_flight"] += 1
+    stats["peak_in_flight"] = max(stats["peak_in_flight"], stats["in_flight"])
+    streaming = False
+    try:
+        if random.random() < config["error_rate"]:
+            stats[f"errors_{config['error_status']}"] += 1
+            return JSONResponse({"code": "too_many_requests", "message": "mock error"},
+                                status_code=config["error_status"])
+        if payload.get("response_mode") == "streaming":
+            # in_flight is decremented when the stream ends
+            streaming = True
+            stats["streams"] += 1
+            return StreamingResponse(_stream(payload.get("inputs", {})), media_type="text/event-stream")
+        latency = _sample(config["latency"])
+        await asyncio.sleep(latency)
+        inputs = payload.get("inputs", {})
+        return {
+            "event": "message",
+            "message_id": str(uuid.uuid4()),
+            "mode": "completion",
+            "answer": _answer(inputs),
+            "metadata": {"usage": {"latency": latency}},
+            "created_at": int(time.time()),
+        }
+    finally:
+        if not streaming:
+            stats["in_flight"] -= 1
+
+
+@app.get("/stats")
+async def get_stats(reset: bool = False):
+    """Counters since start (or the last reset)."""
+    current = dict(stats)
+    if reset:
+        stats.clear()
+        stats["in_flight"] = current.get("in_flight", 0)
+    return current
+
+
+@app.get("/config")
+async def get_config():
+    return config
+
+
+@app.put("/config")
+async def update_config(request: Request):
+    """Change the mock's behavior; unknown keys are rejected."""
+    changes = await request.json()
+    unknown = set(changes) - set(config)
+    if unknown:
+        return JSONResponse({"message": f"Unknown keys: {', '.join(sorted(unknown))}"}, status_code=400)
+    config.update(changes)
+    return config
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8801)
+    parser.add_argument("--latency", type=float, default=1.0, help="Mean response latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Latency standard deviation in seconds")
+    parser.add_argument("--latency-dist", default="normal", choices=LATENCY_DISTRIBUTIONS)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with an error")
+    parser.add_argument("--error-status", type=int, default=429, choices=[429, 500, 502, 503, 504])
+    parser.add_argument("--ttft", type=float, default=1.0, help="Mean seconds to the first chunk of a streaming response")
+    parser.add_argument("--tokens", type=int, default=200, help="Chunks of a streaming response")
+    parser.add_argument("--token-interval", type=float, default=0.05, help="Seconds between streamed chunks")
+    parser.add_argument("--ping-interval", type=float, default=0.0, help="Seconds between pings before the first chunk, 0 = none")
+    parser.add_argument("--stream-error-rate", type=float, default=0.0, help="Fraction of streams failing halfway")
+    parser.add_argument("--max-concurrency", type=int, default=0, help="429 beyond this many requests in flight, 0 = unlimited")
+    args = parser.parse_args()
+    config.update(latency=args.latency, jitter=args.jitter, latency_dist=args.latency_dist,
+                  error_rate=args.error_rate, error_status=args.error_status, ttft=args.ttft,
+                  tokens=args.tokens, token_interval=args.token_interval, ping_interval=args.ping_interval,
+                  stream_error_rate=args.stream_error_rate, max_concurrency=args.max_concurrency)
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import request from './request'
+
+interface TypedArrayPayload {
+  dtype: 'uint8' | 'uint16' | 'uint32' | 'float32'
+  shape: number[]
+  data: string
+}
+
+export interface VizAxis {
+  feature: string
+  transform: 'log1p' | 'linear'
+  min: number
+  max: number
+  bins: number
+}
+
+export interface ClusterViz {
+  level: number
+  levels: number
+  features: string[]
+  axes: VizAxis[]
+  // Sparse density cells: cluster, x / y bin index, count
+  grid: { cluster: Uint8Array; x: Uint16Array; y: Uint16Array; count: Uint32Array }
+  // Cluster-stratified points, coords flattened row-major (n x axes)
+  sample: { cluster: Uint8Array; coords: Float32Array }
+}
+
+export interface VizBounds {
+  x_min?: number
+  x_max?: number
+  y_min?: number
+  y_max?: number
+}
+
+const TYPED_ARRAYS = {
+  uint8: Uint8Array,
+  uint16: Uint16Array,
+  uint32: Uint32Array,
+  float32: Float32Array
+}
+
+const decode = (payload: TypedArrayPayload) => {
+  const bytes = Uint8Array.from(atob(payload.data), c => c.charCodeAt(0))
+  return new TYPED_ARRAYS[payload.dtype](bytes.buffer)
+}
+
+const decodeAll = (arrays: Record<string, TypedArrayPayload>) =>
+  Object.fromEntries(Object.entries(arrays).map(([name, payload]) => [name, decode(payload)]))
+
+/**
+ * One level of detail of a result's density grid and stratified sample
+ * (GET /analysis/results/{id}/viz). Bounds are in display coordinates and
+ * crop the response to the visible window.
+ */
+export const fetchClusterViz = async (
+  resultId: number,
+  params: { level: number; x: string; y: string } & VizBounds
+): Promise<ClusterViz> => {
+  const res: any = await request.get(`/analysis/results/${resultId}/viz`, { params })
+  return { ...res, grid: decodeAll(res.grid), sample: decodeAll(res.sample) }
+}
+
+// Display coordinate -> raw feature value
+export const toRaw = (axis: VizAxis, value: number) =>
+  axis.transform === 'log1p' ? Math.expm1(value) : value
@@ -0,0 +1,64 @@
+export interface ReportStreamEvent {
+  report_id: number
+  type: 'snapshot' | 'delta' | 'replace' | 'done'
+  content?: string
+  text?: string
+  status?: string
+  error_message?: string | null
+}
+
+/**
+ * Follow a report's content while it is generated (GET /reports/{id}/stream).
+ * onContent receives the full content so far after every event, onDone the
+ * final status. fetch() is used instead of EventSource so the bearer token
+ * goes in a header. Call the returned function to stop.
+ */
+export const watchReport = (
+  reportId: number,
+  onContent: (content: string) => void,
+  onDone: (status: string, errorMessage?: string | null) => void
+): (() => void) => {
+  const controller = new AbortController()
+  let content = ''
+
+  const handle = (event: ReportStreamEvent) => {
+    if (event.type === 'snapshot' || event.type === 'replace') {
+      content = event.content || ''
+    } else if (event.type === 'delta') {
+      content += event.text || ''
+    }
+    onContent(content)
+    if (event.type === 'done') onDone(event.status || 'failed', event.error_message)
+  }
+
+  const connect = async () => {
+    try {
+      const response = await fetch(`/api/v1/reports/${reportId}/stream`, {
+        headers: { Authorization: `Bearer ${localStorage.getItem('token') || ''}` },
+        signal: controller.signal
+      })
+      if (!response.ok || !response.body) throw new Error(`HTTP ${response.status}`)
+
+      const reader = response.body.pipeThrough(new TextDecoderStream()).getReader()
+      let buffer = ''
+      while (true) {
+        const { value, done } = await reader.read()
+        if (done) break
+        buffer += value
+        const messages = buffer.split('\n\n')
+        buffer = messages.pop() || ''
+        for (const message of messages) {
+          const data = message.split('\n').find(line => line.startsWith('data:'))
+          if (data) handle(JSON.parse(data.slice(5)))
+        }
+      }
+    } catch (e) {
+      if (controller.signal.aborted) return
+      console.error('Report stream error', e)
+      onDone('failed', String(e))
+    }
+  }
+
+  connect()
+  return () => controller.abort()
+}
@@ -0,0 +1,73 @@
+import request from './request'
+
+export interface TaskEvent {
+  task_id: number
+  type: 'status' | 'progress' | 'fit' | 'stage' | 'segment'
+  status?: string
+  progress?: number
+  stage?: string
+  error_message?: string | null
+  [key: string]: any
+}
+
+const TERMINAL_STATUSES = ['completed', 'failed', 'cancelled']
+const RETRY_DELAY_MS = 2000
+
+/**
+ * Follow an analysis task over Server-Sent Events (GET /analysis/tasks/{id}/events).
+ * fetch() is used instead of EventSource so the bearer token goes in a header.
+ * Reconnects if the stream drops before a terminal status; call the returned
+ * function to stop.
+ */
+export const watchTask = (taskId: number, onEvent: (event: TaskEvent) => void): (() => void) => {
+  const controller = new AbortController()
+  let finished = false
+
+  const handle = (event: TaskEvent) => {
+    onEvent(event)
+    if (event.type === 'status' && TERMINAL_STATUSES.includes(event.status || '')) {
+      finished = true
+    }
+  }
+
+  const connect = async () => {
+    try {
+      const response = await fetch(`/api/v1/analysis/tasks/${taskId}/events`, {
+        headers: { Authorization: `Bearer ${localStorage.getItem('token') || ''}` },
+        signal: controller.signal
+      })
+      if (!response.ok || !response.body) throw new Error(`HTTP ${response.status}`)
+
+      const reader = response.body.pipeThrough(new TextDecoderStream()).getReader()
+      let buffer = ''
+      while (!finished) {
+        const { value, done } = await reader.read()
+        if (done) break
+        buffer += value
+        const messages = buffer.split('\n\n')
+        buffer = messages.pop() || ''
+        for (const message of messages) {
+          const data = message.split('\n').find(line => line.startsWith('data:'))
+          if (data) handle(JSON.parse(data.slice(5)))
+        }
+      }
+    } catch (e) {
+      if (controller.signal.aborted) return
+      console.error('Task event stream error', e)
+    }
+
+    if (!finished && !controller.signal.aborted) {
+      // Stream dropped: check the task once, then reconnect if still running
+      try {
+        const task: any = await request.get(`/analysis/tasks/${taskId}`)
+        handle({ task_id: taskId, type: 'status', status: task.status, progress: task.progress, error_message: task.error_message })
+      } catch (e) {
+        console.error('Task status error', e)
+      }
+      if (!finished) setTimeout(connect, RETRY_DELAY_MS)
+    }
+  }
+
+  connect()
+  return () => controller.abort()
+}